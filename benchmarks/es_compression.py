@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import argparse
+import gzip
+import json
+import sys
+import time
+
+from events import sample_event
+
+
+def index_body(event):
+    return json.dumps(event).encode('utf-8')
+
+
+def bulk_body(events):
+    lines = []
+    for i, event in enumerate(events):
+        lines.append(json.dumps({'index': {'_index': 'basic-index',
+                                           '_type': 'raven-log',
+                                           '_id': str(i)}}))
+        lines.append(json.dumps(event))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def measure(bodies, level):
+    raw = sum(len(body) for body in bodies)
+    start = time.process_time()
+    sent = sum(len(gzip.compress(body, level)) for body in bodies)
+    elapsed = time.process_time() - start
+    return raw, sent, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Bandwidth and CPU cost of gzip compressed requests '
+                    'to elasticsearch')
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--bulk-size', type=int, default=100)
+    args = parser.parse_args()
+    events = [sample_event(i) for i in range(args.events)]
+    workloads = [
+        ('index', [index_body(event) for event in events]),
+        ('bulk', [bulk_body(events[i:i + args.bulk_size])
+                  for i in range(0, len(events), args.bulk_size)]),
+    ]
+    sys.stdout.write('{:<6} {:>5} {:>12} {:>12} {:>7} {:>10}\n'.format(
+        'body', 'level', 'raw bytes', 'sent bytes', 'ratio', 'us/event'))
+    for name, bodies in workloads:
+        for level in range(1, 10):
+            raw, sent, elapsed = measure(bodies, level)
+            sys.stdout.write(
+                '{:<6} {:>5} {:>12} {:>12} {:>7.2f} {:>10.1f}\n'.format(
+                    name, level, raw, sent, raw / sent,
+                    elapsed / len(events) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import random
+
+
+def sample_event(seed=0, frames=20, extra_fields=10):
+    rng = random.Random(seed)
+    return {
+        'project': 'basic-index-{0:%Y.%m.%d}',
+        'event_id': '%032x' % rng.getrandbits(128),
+        'level': rng.choice([10, 20, 30, 40, 50]),
+        'logger': 'app.views',
+        'culprit': 'app.views in handle_request',
+        'message': 'ValueError: invalid literal for int() with base 10',
+        'server_name': 'web-%d' % rng.randint(1, 40),
+        'timestamp': '2014-01-01T00:00:%02d' % rng.randint(0, 59),
+        'extra': {'field%d' % i: rng.choice(['value', i, i * 0.5, None])
+                  for i in range(extra_fields)},
+        'sentry.interfaces.Exception': {
+            'type': 'ValueError',
+            'value': "invalid literal for int() with base 10: 'x'",
+            'module': 'exceptions',
+        },
+        'sentry.interfaces.Stacktrace': {
+            'frames': [{
+                'filename': 'app/module%d.py' % i,
+                'function': 'function_%d' % i,
+                'lineno': rng.randint(1, 1000),
+                'context_line': '    result = handle(request, %d)' % i,
+                'vars': {'request': '<WSGIRequest>', 'i': i},
+            } for i in range(frames)],
+        },
+    }
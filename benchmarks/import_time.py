@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    ('udp_to_amqp.py', 'elasticsearch_raven.amqp'),
+    ('amqp_to_elasticsearch.py', 'elasticsearch_raven.amqp'),
+    ('elasticsearch-raven.py', 'elasticsearch_raven.udp_server'),
+    ('elasticsearch-raven-http.py', 'elasticsearch_raven.http_server'),
+    ('wsgi', 'elasticsearch_raven.wsgi'),
+]
+HEAVY_MODULES = ['elasticsearch', 'urllib3', 'kombu', 'amqp', 'tempfile']
+
+MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+sys.stdout.write(json.dumps([elapsed, sorted(
+    name for name in {heavy!r} if name in sys.modules)]))
+'''
+
+
+def measure(module, runs):
+    code = MEASURE.format(module=module, heavy=HEAVY_MODULES)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root)
+        elapsed, loaded = json.loads(output.decode('utf-8'))
+        timings.append(elapsed)
+    return statistics.median(timings), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Cold import time of elasticsearch-raven entry points')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    for entry_point, module in ENTRY_POINTS:
+        elapsed, loaded = measure(module, args.runs)
+        sys.stdout.write('{:<28} {:7.1f} ms  {}\n'.format(
+            entry_point, elapsed * 1000, ' '.join(loaded) or '-'))
+    sys.stdout.write('Modules needed by entry point at run time, like kombu '
+                     'for amqp, are imported when first used.\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import argparse
+import base64
+import collections
+import json
+import re
+import sys
+import tracemalloc
+import zlib
+
+from elasticsearch_raven import transport
+
+LegacySentryMessage = collections.namedtuple('LegacySentryMessage',
+                                             ['headers', 'body'])
+
+
+def legacy_create_from_udp(data):
+    byte_headers, data = data.split(b'\n\n')
+    match = re.search(
+        r'sentry_key=(?P<sentry_key>[^, =]+), sentry_secret='
+        r'(?P<sentry_secret>[^, =]+)$', byte_headers.decode('utf-8'))
+    return LegacySentryMessage(match.groupdict(), base64.b64decode(data))
+
+
+def make_datagrams(count, keys, body_size):
+    body = json.dumps({'project': 'basic-index-{0:%Y.%m.%d}',
+                       'message': 'x' * body_size}).encode('utf-8')
+    encoded = base64.b64encode(zlib.compress(body))
+    for i in range(count):
+        headers = 'sentry_key=public{0}, sentry_secret=secret{0}'.format(
+            i % keys)
+        yield headers.encode('utf-8') + b'\n\n' + encoded
+
+
+def measure(factory, datagrams):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    messages = [factory(datagram) for datagram in datagrams]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Per-message memory footprint of queued SentryMessages')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--keys', type=int, default=10)
+    parser.add_argument('--body-size', type=int, default=200)
+    args = parser.parse_args()
+    datagrams = list(make_datagrams(args.messages, args.keys, args.body_size))
+    legacy = measure(legacy_create_from_udp, datagrams)
+    current = measure(transport.SentryMessage.create_from_udp, datagrams)
+    sys.stdout.write('legacy namedtuple: {:.1f} bytes/message\n'
+                     'SentryMessage:     {:.1f} bytes/message\n'.format(
+                         legacy, current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+from elasticsearch_raven.http_server import run_server
+
+
+if __name__ == '__main__':
+    run_server()
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+from elasticsearch_raven import load_generator
+
+
+if __name__ == '__main__':
+    load_generator.run()
@@ -1,22 +1,33 @@
+import functools
+import importlib
 import socket
 import signal
+import time
 
 try:
     from urllib import parse
 except ImportError:
     import urlparse as parse
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import argparse
 
 from elasticsearch_raven import configuration
+from elasticsearch_raven import lanes
+from elasticsearch_raven import profiling
 from elasticsearch_raven import transport
 from elasticsearch_raven import queues
-from elasticsearch_raven import queue_sender
 from elasticsearch_raven import udp_handler
+from elasticsearch_raven import utils
 
 
 def run_handler():
     args = _parse_handler_args()
+    profiling.configure()
     parsed = parse.urlparse(args.listen_address)
     if parsed.scheme == 'fd':
         sock = socket.fromfd(int(parsed.netloc), socket.AF_INET,
@@ -27,18 +38,42 @@ def run_handler():
         sock.bind((ip, int(port)))
     else:
         raise ValueError('only fd and udp protocols are supported')
+    if configuration['udp_receive_buffer']:
+        udp_handler.set_receive_buffer(sock,
+                                       configuration['udp_receive_buffer'])
     sock.setblocking(1)
-    sock.settimeout(None)
-    queue = queues.KombuQueue(configuration['amqp_url'],
-                              configuration['amqp_queue'])
-    handler = udp_handler.Handler(sock, queue, _exception_handler,
+    sock.settimeout(udp_handler.RECEIVE_TIMEOUT)
+    publishers = []
+
+    def open_publisher(amqp_url, queue_name):
+        publisher = queues.PublishingKombuQueue(
+            amqp_url, queue_name,
+            buffer_size=configuration['amqp_publish_buffer'],
+            batch_size=configuration['amqp_publish_batch'],
+            confirm_timeout=configuration['amqp_confirm_timeout'])
+        publishers.append(publisher)
+        return publisher
+    classifier = lanes.get_configured_classifier()
+    shards = [queues.open_queue(open_publisher, amqp_url, queue_name,
+                                classifier)
+              for amqp_url, queue_name in get_shards()]
+    pending_logs = queues.ShardedQueue(shards,
+                                       configuration['amqp_shard_by'])
+    handler = udp_handler.Handler(sock, pending_logs, _exception_handler,
                                   debug=args.debug)
+    if configuration['stats_interval']:
+        udp_handler.start_stats_reporter(sock, [handler] + publishers)
 
     def terminate(signum, frame):
-        exit(0)
+        # received messages are published before exiting, up to
+        # AMQP_PUBLISH_TIMEOUT
+        handler.should_finish = True
     signal.signal(signal.SIGTERM, terminate)
     signal.signal(signal.SIGQUIT, terminate)
-    handler.handle()
+    try:
+        handler.handle()
+    finally:
+        pending_logs.flush(timeout=configuration['amqp_publish_timeout'])
 
 
 def _parse_handler_args():
@@ -50,17 +85,86 @@ def _parse_handler_args():
     return parser.parse_args()
 
 
+DRAIN_TIMEOUT = 20.0
+# imported by the supervisor, so forked and restarted workers share them
+# instead of each importing the clients again
+PRELOADED_MODULES = ('elasticsearch', 'kombu',
+                     'elasticsearch_raven.connection',
+                     'elasticsearch_raven.queue_sender')
+
+
 def run_sender():
-    log_transport = transport.get_configured_log_transport()
-    queue = queues.KombuQueue(configuration['amqp_url'],
-                              configuration['amqp_queue'])
-    sender = queue_sender.Sender(log_transport, queue, _exception_handler)
+    args = _parse_sender_args()
+    shards = get_shards()
+    if args.shards:
+        shards = [shards[shard] for shard in args.shards]
+    if args.processes > 1:
+        from elasticsearch_raven import prefork
+        for name in PRELOADED_MODULES:
+            importlib.import_module(name)
+        supervisor = prefork.Supervisor(
+            functools.partial(_run_senders, shards,
+                              output_directory=args.output_directory),
+            args.processes,
+            drain_timeout=DRAIN_TIMEOUT + 10.0)
+        supervisor.run()
+    else:
+        _run_senders(shards, output_directory=args.output_directory)
+
+
+def _run_senders(shards, stats_file=None, output_directory=None):
+    from elasticsearch_raven import queue_sender
+    profiling.configure()
+    log_transport = transport.get_configured_log_transport(
+        output_directory=output_directory)
+    exception_queue = queue.Queue()
+    classifier = lanes.get_configured_classifier()
+    senders = []
+    for amqp_url, queue_name in shards:
+        pending_logs = queues.open_queue(queues.KombuQueue, amqp_url,
+                                         queue_name, classifier)
+        sender = queue_sender.Sender(log_transport, pending_logs,
+                                     exception_queue.put)
+        sender.as_thread().start()
+        senders.append(sender)
+    if stats_file is not None:
+        utils.StatsReporter(stats_file,
+                            senders + [log_transport]).as_thread().start()
 
     def terminate(signum, frame):
+        # unacknowledged messages are requeued by the broker, so waiting for
+        # messages being sent right now is enough
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        for sender in senders:
+            sender.finish(max(deadline - time.monotonic(), 0))
+        # forked workers exit without running atexit handlers
+        log_transport.close()
         exit(0)
     signal.signal(signal.SIGTERM, terminate)
     signal.signal(signal.SIGQUIT, terminate)
-    sender.send()
+    raise exception_queue.get()
+
+
+def _parse_sender_args():
+    parser = argparse.ArgumentParser(
+        description='Sends logs from amqp queue to elasticsearch')
+    parser.add_argument('--shard', dest='shards', type=int, action='append',
+                        help='Consume only given shard, can be repeated')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of worker processes to fork')
+    parser.add_argument(
+        '--output-directory', metavar='DIR',
+        help='Write documents to rotating bulk files in this directory '
+             'instead of sending them to elasticsearch.')
+    return parser.parse_args()
+
+
+def get_shards():
+    amqp_urls = configuration['amqp_shard_urls'] or [configuration['amqp_url']]
+    queue_names = queues.shard_names(configuration['amqp_queue'],
+                                     configuration['amqp_shards'])
+    return [(amqp_urls[shard % len(amqp_urls)], queue_name)
+            for shard, queue_name in enumerate(queue_names)]
 
 
 def _exception_handler(exception):
@@ -0,0 +1,53 @@
+import collections
+import hashlib
+import threading
+
+
+def body_key(body):
+    # blake2b is faster than sha1 and a 128 bit digest makes collisions of
+    # different bodies practically impossible
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class LruCache(object):
+    def __init__(self, max_bytes, name='document_cache'):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return collections.Counter({
+                self.name + '_hits': self._hits,
+                self.name + '_misses': self._misses,
+                self.name + '_entries': len(self._entries),
+                self.name + '_bytes': self._bytes,
+            })
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = value, size
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
@@ -0,0 +1,89 @@
+import collections
+import gzip
+import time
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+import elasticsearch
+from elasticsearch.connection import Urllib3HttpConnection
+
+# answers of a cluster that does not understand compressed bodies, anything
+# else (like 429) may be transient and must not disable compression
+ENCODING_NOT_ACCEPTED = frozenset([400, 411, 415])
+
+
+class CompressedHttpConnection(Urllib3HttpConnection):
+    def __init__(self, compression_level=6, **kwargs):
+        super(CompressedHttpConnection, self).__init__(**kwargs)
+        self.compression_level = compression_level
+        self.compression_supported = None
+        self.stats = collections.Counter()
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        if (body is None or not self.compression_level or
+                self.compression_supported is False):
+            return super(CompressedHttpConnection, self).perform_request(
+                method, url, params=params, body=body, timeout=timeout,
+                ignore=ignore)
+        compressed_body = gzip.compress(body, self.compression_level)
+        self.stats['body_bytes'] += len(body)
+        self.stats['sent_bytes'] += len(compressed_body)
+        if self.compression_supported:
+            return self._perform_compressed_request(
+                method, url, params, body, compressed_body, timeout, ignore)
+        return self._negotiate(method, url, params, body, compressed_body,
+                               timeout, ignore)
+
+    def _negotiate(self, method, url, params, body, compressed_body,
+                   timeout, ignore):
+        try:
+            response = self._perform_compressed_request(
+                method, url, params, body, compressed_body, timeout, ignore)
+        except elasticsearch.exceptions.TransportError as e:
+            if e.status_code not in ENCODING_NOT_ACCEPTED:
+                raise
+            # the request may be wrong on its own, so only give up on
+            # compression when the plain one succeeds
+            response = super(CompressedHttpConnection, self).perform_request(
+                method, url, params=params, body=body, timeout=timeout,
+                ignore=ignore)
+            self.compression_supported = False
+        else:
+            self.compression_supported = True
+        return response
+
+    def _perform_compressed_request(self, method, url, params, body,
+                                    compressed_body, timeout, ignore):
+        url = self.url_prefix + url
+        if params:
+            url = '%s?%s' % (url, urlencode(params))
+        full_url = self.host + url
+        headers = dict(self.pool.headers, **{'content-encoding': 'gzip'})
+
+        start = time.time()
+        try:
+            kw = {}
+            if timeout:
+                kw['timeout'] = timeout
+            response = self.pool.urlopen(method, url, compressed_body,
+                                         headers=headers, **kw)
+            duration = time.time() - start
+            raw_data = response.data.decode('utf-8')
+        except Exception as e:
+            self.log_request_fail(method, full_url, body, time.time() - start,
+                                  exception=e)
+            raise elasticsearch.exceptions.ConnectionError('N/A', str(e), e)
+
+        if (not (200 <= response.status < 300) and
+                response.status not in ignore):
+            self.log_request_fail(method, url, body, duration, response.status)
+            self._raise_error(response.status, raw_data)
+
+        self.log_request_success(method, full_url, url, body, response.status,
+                                 raw_data, duration)
+
+        return response.status, response.getheaders(), raw_data
@@ -0,0 +1,52 @@
+import threading
+
+from elasticsearch_raven import configuration
+
+
+def get_configured_controller():
+    max_concurrency = configuration['send_max_concurrency']
+    max_batch = configuration['send_max_batch']
+    if max_concurrency <= 1 and max_batch <= 1:
+        return None
+    return AimdController(max_concurrency, max_batch,
+                          configuration['send_target_latency'])
+
+
+class AimdController(object):
+    def __init__(self, max_concurrency, max_batch, target_latency,
+                 min_concurrency=1, min_batch=1, decrease=0.5):
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.max_batch = max(max_batch, min_batch)
+        self.min_concurrency = min_concurrency
+        self.min_batch = min_batch
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self._concurrency = float(min_concurrency)
+        self._batch_size = float(min_batch)
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return int(self._concurrency)
+
+    @property
+    def batch_size(self):
+        return int(self._batch_size)
+
+    def update(self, latency, rejected=False):
+        # additive increase, multiplicative decrease like tcp congestion
+        # window, concurrency grows by one after a whole window of requests
+        # succeeds, batch size by one message after every request
+        with self._lock:
+            if rejected or latency > self.target_latency:
+                self._concurrency = max(self._concurrency * self.decrease,
+                                        self.min_concurrency)
+                self._batch_size = max(self._batch_size * self.decrease,
+                                       self.min_batch)
+                return True
+            else:
+                self._concurrency = min(
+                    self._concurrency + 1.0 / self._concurrency,
+                    self.max_concurrency)
+                self._batch_size = min(self._batch_size + 1, self.max_batch)
+                return False
@@ -0,0 +1,179 @@
+import atexit
+import datetime
+import gzip
+import os
+import threading
+import time
+import zlib
+
+from elasticsearch_raven import configuration
+from elasticsearch_raven import transport
+
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+PART_SUFFIX = '.part'
+
+
+def get_configured_file_transport(directory):
+    return FileTransport(directory,
+                         compression=configuration['file_compression'],
+                         max_bytes=configuration['file_max_bytes'],
+                         max_age=configuration['file_max_age'],
+                         flush_interval=configuration['file_flush_interval'])
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd compression needs zstandard package')
+    return zstandard
+
+
+class GzipWriter(object):
+    def __init__(self, raw):
+        # name of the .part file is not stored in the header
+        self._file = gzip.GzipFile(filename='', fileobj=raw, mode='wb')
+
+    def write(self, data):
+        self._file.write(data)
+
+    def flush(self):
+        # sync flush ends a deflate block, everything written so far can be
+        # decompressed even if the process dies before the file is finished
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        self._file.close()
+
+
+class ZstdWriter(object):
+    def __init__(self, raw):
+        self._zstandard = import_zstandard()
+        self._file = self._zstandard.ZstdCompressor().stream_writer(raw)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush(self._zstandard.FLUSH_BLOCK)
+
+    def finish(self):
+        self._file.flush(self._zstandard.FLUSH_FRAME)
+
+
+class PlainWriter(object):
+    def __init__(self, raw):
+        self._file = raw
+
+    def write(self, data):
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def finish(self):
+        pass
+
+
+WRITERS = {'gzip': GzipWriter, 'zstd': ZstdWriter, 'none': PlainWriter}
+
+
+class FileTransport(transport.DocumentTransport):
+    # documents are written as bulk request bodies, a finished file can be
+    # loaded with curl -H 'Content-Encoding: gzip' --data-binary @file
+    # .../_bulk or after decompressing it
+    def __init__(self, directory, compression='gzip', max_bytes=10485760,
+                 max_age=3600.0, flush_interval=1.0):
+        transport.DocumentTransport.__init__(self)
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown file compression: {}'.format(
+                compression))
+        if compression == 'zstd':
+            # fail on start instead of on the first message
+            import_zstandard()
+        self.directory = directory
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self._flush_timer = None
+        self._lock = threading.Lock()
+        self._raw = None
+        self._writer = None
+        self._path = None
+        self._size = 0
+        self._opened = 0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.close)
+
+    def send_message(self, message):
+        self.send_messages([message])
+
+    def send_messages(self, messages):
+        lines = self.bulk_lines(messages)
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with self._lock, self.timer.stage('write_file'):
+            self._rotate_if_needed(len(data))
+            if self._writer is None:
+                self._open()
+            self._writer.write(data)
+            self._size += len(data)
+            self._flush_later()
+        return [None] * len(messages)
+
+    def _flush_later(self):
+        # every flush ends a compression block, flushing each of small
+        # documents sent one by one would hurt the compression ratio, so
+        # everything written within flush_interval is flushed together
+        if not self.flush_interval:
+            self._writer.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval,
+                                                self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush(self):
+        with self._lock:
+            self._flush_timer = None
+            if self._writer is not None:
+                self._writer.flush()
+
+    def _rotate_if_needed(self, size):
+        # max_bytes counts uncompressed bytes, so every file fits in one
+        # bulk request, a batch is never split between files
+        if self._writer is None:
+            return
+        if (self._size and self._size + size > self.max_bytes or
+                time.monotonic() - self._opened >= self.max_age):
+            self._finish()
+
+    def _open(self):
+        self._sequence += 1
+        name = 'raven-{:%Y%m%dT%H%M%S}-{}-{}.ndjson{}'.format(
+            datetime.datetime.now(), os.getpid(), self._sequence,
+            EXTENSIONS[self.compression])
+        self._path = os.path.join(self.directory, name)
+        self._raw = open(self._path + PART_SUFFIX, 'wb')
+        self._writer = WRITERS[self.compression](self._raw)
+        self._size = 0
+        self._opened = time.monotonic()
+
+    def _finish(self):
+        # files being written have .part suffix, only finished ones should
+        # be picked up for loading
+        self._writer.finish()
+        self._raw.close()
+        os.rename(self._path + PART_SUFFIX, self._path)
+        self._raw = None
+        self._writer = None
+
+    def close(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._writer is not None:
+                self._finish()
@@ -3,20 +3,22 @@ try:
 except ImportError:
     import Queue as queue
 
-from elasticsearch_raven import configuration
+from elasticsearch_raven import queues
+from elasticsearch_raven import routing
 from elasticsearch_raven import transport
-from elasticsearch_raven.queue_sender import Sender
 
 
 class HttpUtils:
     def __init__(self):
-        self._pending_logs = queue.Queue(configuration['queue_maxsize'])
+        self._pending_logs = queues.get_configured_queue()
         self._exception_queue = queue.Queue()
 
     def start_sender(self):
         log_transport = transport.get_configured_log_transport()
-        sender = Sender(log_transport, self._pending_logs,
-                        self._exception_queue.put).as_thread()
+        self._pending_logs = routing.route_queue(
+            self._pending_logs, log_transport, queues.get_configured_queue)
+        sender = routing.create_sender(log_transport, self._pending_logs,
+                                       self._exception_queue.put).as_thread()
         sender.start()
 
     def get_application(self):
@@ -30,7 +32,8 @@ class HttpUtils:
             length = int(environ.get('CONTENT_LENGTH', '0'))
             data = environ['wsgi.input'].read(length)
             self._pending_logs.put(transport.SentryMessage.create_from_http(
-                environ['HTTP_X_SENTRY_AUTH'], data))
+                environ['HTTP_X_SENTRY_AUTH'], data,
+                content_encoding=environ.get('HTTP_CONTENT_ENCODING')))
 
             status = '200 OK'
             response_headers = [('Content-Type', 'text/plain')]
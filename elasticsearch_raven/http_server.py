@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import binascii
+import collections
+import resource
+import signal
+import sys
+
+from elasticsearch_raven import configuration
+from elasticsearch_raven import exceptions
+from elasticsearch_raven import profiling
+from elasticsearch_raven import queues
+from elasticsearch_raven import routing
+from elasticsearch_raven import transport
+from elasticsearch_raven import utils
+
+MAX_HEAD_SIZE = 65536
+BACKLOG = 65535
+PUT_TIMEOUT = 1.0
+PUT_RETRY_DELAY = 0.01
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    503: 'Service Unavailable',
+}
+
+
+def run_server():
+    args = _parse_args()
+    profiling.configure()
+    raise_open_files_limit()
+    log_transport = transport.get_configured_log_transport(
+        output_directory=args.output_directory)
+    pending_logs = routing.route_queue(queues.get_configured_queue(),
+                                       log_transport,
+                                       queues.get_configured_queue)
+    Server(args.ip, args.port, pending_logs, log_transport).run()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Http proxy server for raven')
+    parser.add_argument('ip')
+    parser.add_argument('port', type=int)
+    parser.add_argument(
+        '--output-directory', metavar='DIR',
+        help='Write documents to rotating bulk files in this directory '
+             'instead of sending them to elasticsearch.')
+    return parser.parse_args()
+
+
+def raise_open_files_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def response(status, keep_alive):
+    lines = ['HTTP/1.1 {} {}'.format(status, REASONS[status]),
+             'Content-Type: text/plain',
+             'Content-Length: 0',
+             'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+    if status == 503:
+        lines.append('Retry-After: 1')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+
+
+RESPONSES = {(status, keep_alive): response(status, keep_alive)
+             for status in REASONS for keep_alive in [True, False]}
+
+
+class BadRequest(Exception):
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+class Request(object):
+    __slots__ = ('method', 'version', 'headers')
+
+    def __init__(self, method, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+
+    @classmethod
+    def parse(cls, head):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, _, version = lines[0].split(' ')
+        except ValueError:
+            raise BadRequest(400)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return cls(method, version, headers)
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+
+class Server(object):
+    def __init__(self, ip, port, pending_logs, log_transport):
+        self.ip = ip
+        self.port = port
+        self.pending_logs = pending_logs
+        self.log_transport = log_transport
+        self.keep_alive_timeout = configuration['http_keep_alive_timeout']
+        self.max_body_size = configuration['http_max_body_size']
+        self.connections = set()
+        self.stats = collections.Counter()
+        self.timer = profiling.timer
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        failed = loop.create_future()
+        stopping = loop.create_future()
+        killed = loop.create_future()
+
+        def exception_handler(exception):
+            loop.call_soon_threadsafe(_set_exception, failed, exception)
+
+        def terminate():
+            # second signal stops waiting for pending logs
+            for future in [stopping, killed]:
+                if not future.done():
+                    future.set_result(None)
+                    return
+
+        for signum in [signal.SIGTERM, signal.SIGQUIT, signal.SIGINT]:
+            loop.add_signal_handler(signum, terminate)
+        sender = routing.create_sender(self.log_transport, self.pending_logs,
+                                       exception_handler)
+        sender.as_thread().start()
+        if configuration['stats_interval']:
+            utils.StatsReporter(sys.stdout, [self, sender, self.log_transport],
+                                configuration['stats_interval']
+                                ).as_thread().start()
+        server = await asyncio.start_server(
+            self.handle_connection, self.ip, self.port, limit=MAX_HEAD_SIZE,
+            backlog=BACKLOG)
+        try:
+            await asyncio.wait([failed, stopping],
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            server.close()
+            for writer in list(self.connections):
+                writer.close()
+        while (not failed.done() and not killed.done() and
+               self.pending_logs.has_nonpersistent_task()):
+            await asyncio.wait([failed, killed], timeout=1)
+        if failed.done():
+            failed.result()
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        self.connections.add(writer)
+        self.stats['open_connections'] += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                # closing the writer ends the pending read, which covers
+                # both idle connections and slowly sent requests
+                timeout = loop.call_later(self.keep_alive_timeout,
+                                          writer.close)
+                try:
+                    status, keep_alive = await self.handle_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                finally:
+                    timeout.cancel()
+                writer.write(RESPONSES[status, keep_alive])
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.stats['open_connections'] -= 1
+            self.connections.discard(writer)
+            writer.close()
+
+    async def handle_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            return 431, False
+        self.stats['requests'] += 1
+        try:
+            request = Request.parse(head)
+            body = await self.read_body(reader, request)
+        except BadRequest as e:
+            self.stats['bad_requests'] += 1
+            return e.status, False
+        if request.method != 'POST':
+            return 405, request.keep_alive
+        try:
+            with self.timer.stage('create_from_http'):
+                message = transport.SentryMessage.create_from_http(
+                    request.headers['x-sentry-auth'], body,
+                    content_encoding=request.headers.get('content-encoding'))
+        except (KeyError, binascii.Error,
+                exceptions.ElasticsearchRavenError):
+            self.stats['bad_requests'] += 1
+            return 400, request.keep_alive
+        with self.timer.stage('queue_put'):
+            accepted = await self.put(message)
+        if not accepted:
+            self.stats['rejected'] += 1
+            return 503, request.keep_alive
+        self.stats['received'] += 1
+        return 200, request.keep_alive
+
+    async def read_body(self, reader, request):
+        if request.headers.get('transfer-encoding', '').lower() == 'chunked':
+            return await self.read_chunked_body(reader)
+        try:
+            length = int(request.headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequest(400)
+        if length < 0:
+            raise BadRequest(400)
+        if length > self.max_body_size:
+            raise BadRequest(413)
+        return await reader.readexactly(length)
+
+    async def read_chunked_body(self, reader):
+        chunks = []
+        size = 0
+        while True:
+            try:
+                line = await reader.readuntil(b'\r\n')
+                length = int(line.split(b';', 1)[0], 16)
+            except (asyncio.LimitOverrunError, ValueError):
+                raise BadRequest(400)
+            if length < 0:
+                raise BadRequest(400)
+            if not length:
+                break
+            size += length
+            if size > self.max_body_size:
+                raise BadRequest(413)
+            chunk = await reader.readexactly(length + 2)
+            chunks.append(chunk[:-2])
+        try:
+            # skip trailers
+            while await reader.readuntil(b'\r\n') != b'\r\n':
+                pass
+        except asyncio.LimitOverrunError:
+            raise BadRequest(400)
+        return b''.join(chunks)
+
+    async def put(self, message):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PUT_TIMEOUT
+        while True:
+            try:
+                self.pending_logs.put_nowait(message)
+                return True
+            except queues.Full:
+                if loop.time() >= deadline:
+                    return False
+                await asyncio.sleep(PUT_RETRY_DELAY)
+
+
+def _set_exception(future, exception):
+    if not future.done():
+        future.set_exception(exception)
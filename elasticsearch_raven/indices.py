@@ -0,0 +1,111 @@
+import collections
+import datetime
+import logging
+import re
+import threading
+import time
+
+import elasticsearch
+
+logger = logging.getLogger(__name__)
+
+DYNAMIC_TEMPLATES = [
+    {'postfixed_strings': {'match': '*<string>',
+                           'mapping': {'type': 'string'}}},
+    {'postfixed_ints': {'match': '*<int>', 'mapping': {'type': 'long'}}},
+    {'postfixed_floats': {'match': '*<float>',
+                          'mapping': {'type': 'double'}}},
+    {'postfixed_bools': {'match': '*<bool>',
+                         'mapping': {'type': 'boolean'}}},
+]
+
+
+def index_pattern(project):
+    return re.sub(r'\{[^}]*\}', '*', project)
+
+
+def template_name(project):
+    return 'elasticsearch-raven-' + re.sub(r'[^a-z0-9_.-]+', '_',
+                                           index_pattern(project).lower())
+
+
+def index_template(project, document_type):
+    return {
+        'template': index_pattern(project),
+        'mappings': {
+            document_type: {'dynamic_templates': DYNAMIC_TEMPLATES},
+        },
+    }
+
+
+class IndexScheduler(object):
+    def __init__(self, log_transport, lookahead, interval=60.0,
+                 max_projects=1000, expiry=86400.0):
+        self.log_transport = log_transport
+        self.lookahead = datetime.timedelta(seconds=lookahead)
+        self.interval = interval
+        self.max_projects = max_projects
+        self.expiry = expiry
+        # project names come from clients, keep only recently seen ones
+        # ordered by last sighting
+        self._projects = collections.OrderedDict()
+        self._prepared = {}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+
+    def add_project(self, project):
+        now = time.monotonic()
+        seen = self._projects.get(project)
+        # refresh at most once per interval, the lock is not taken for
+        # every message
+        if seen is not None and now - seen < self.interval:
+            return
+        with self._lock:
+            self._projects[project] = now
+            self._projects.move_to_end(project)
+            while len(self._projects) > self.max_projects:
+                self._projects.popitem(last=False)
+        if seen is None:
+            self._wake_up.set()
+
+    def as_thread(self):
+        scheduler = threading.Thread(target=self.run)
+        scheduler.daemon = True
+        return scheduler
+
+    def run(self):
+        while True:
+            self._wake_up.wait(self.interval)
+            self._wake_up.clear()
+            self.prepare(datetime.datetime.now())
+
+    def prepare(self, now):
+        with self._lock:
+            self._expire(time.monotonic())
+            projects = list(self._projects)
+        for project in set(self._prepared) - set(projects):
+            del self._prepared[project]
+        for project in projects:
+            try:
+                self._prepare_project(project, now)
+            except elasticsearch.exceptions.TransportError as e:
+                logger.warning('Cannot prepare indices for %s: %s',
+                               project, e)
+
+    def _expire(self, now):
+        while self._projects:
+            project, seen = next(iter(self._projects.items()))
+            if now - seen < self.expiry:
+                break
+            del self._projects[project]
+
+    def _prepare_project(self, project, now):
+        if project not in self._prepared:
+            self.log_transport.put_template(
+                template_name(project),
+                index_template(project, self.log_transport.DOCUMENT_TYPE))
+            self._prepared[project] = None
+        index = project.format(now + self.lookahead)
+        if self._prepared[project] != index:
+            self.log_transport.create_index(index)
+            self._prepared[project] = index
@@ -0,0 +1,112 @@
+import collections
+
+from elasticsearch_raven import configuration
+from elasticsearch_raven import exceptions
+from elasticsearch_raven import transport
+
+# events are put in lanes on receiving threads, only this many bytes of a
+# body are decompressed to find its project and level
+CLASSIFY_PREFIX = 4096
+
+
+def lane_names(queue_name, lanes):
+    if lanes == 1:
+        return [queue_name]
+    return ['{}-lane-{}'.format(queue_name, lane) for lane in range(lanes)]
+
+
+def parse_lanes(pairs):
+    # projects are index patterns, which may contain colons themselves
+    lanes = {}
+    for pair in pairs:
+        key, lane = pair.rsplit(':', 1)
+        lanes[key] = int(lane)
+    return lanes
+
+
+def get_configured_classifier():
+    weights = [int(weight) for weight in configuration['lane_weights']]
+    if len(weights) < 2:
+        return None
+    return Classifier(weights, parse_lanes(configuration['lane_levels']),
+                      parse_lanes(configuration['project_lanes']))
+
+
+def get_configured_lanes():
+    classifier = get_configured_classifier()
+    if classifier is None:
+        return None
+    return Lanes(classifier)
+
+
+class Classifier(object):
+    def __init__(self, weights, levels, projects=None):
+        self.weights = weights
+        self.default_lane = len(weights) - 1
+        self.levels = self._limit(levels)
+        self.projects = self._limit(projects or {})
+
+    def __call__(self, message):
+        lane = self.projects.get(message.headers.get('sentry_key'))
+        if lane is not None:
+            return lane
+        try:
+            data = transport.decompress_prefix(message.body, CLASSIFY_PREFIX)
+        except exceptions.DamagedSentryMessageBodyError:
+            return self.default_lane
+        if self.projects:
+            project = transport.extract_project(data)
+            if project in self.projects:
+                return self.projects[project]
+        return self.levels.get(transport.extract_level(data),
+                               self.default_lane)
+
+    def _limit(self, lanes):
+        return {key: min(lane, self.default_lane)
+                for key, lane in lanes.items()}
+
+
+class Scheduler(object):
+    def __init__(self, weights):
+        self.weights = weights
+        self._credits = [0] * len(weights)
+
+    def choose(self, ready):
+        # smooth weighted round robin, lanes that are not ready lose their
+        # credit so they do not burst when they fill up again
+        chosen = None
+        total = 0
+        for lane, weight in enumerate(self.weights):
+            if lane not in ready:
+                self._credits[lane] = 0
+                continue
+            self._credits[lane] += weight
+            total += weight
+            if chosen is None or self._credits[lane] > self._credits[chosen]:
+                chosen = lane
+        self._credits[chosen] -= total
+        return chosen
+
+
+class Lanes(object):
+    def __init__(self, classifier):
+        self.classify = classifier
+        self.scheduler = Scheduler(classifier.weights)
+        self._lanes = [collections.deque() for _ in classifier.weights]
+        self._size = 0
+
+    def append(self, item):
+        # messages are classified by ThreadingQueue before it takes the
+        # queue lock
+        lane, message = item
+        self._lanes[lane].append(message)
+        self._size += 1
+
+    def popleft(self):
+        ready = [lane for lane, messages in enumerate(self._lanes) if messages]
+        message = self._lanes[self.scheduler.choose(ready)].popleft()
+        self._size -= 1
+        return message
+
+    def __len__(self):
+        return self._size
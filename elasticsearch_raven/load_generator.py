@@ -0,0 +1,338 @@
+import argparse
+import base64
+import gzip
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from http import client as http_client
+from http import server as http_server
+from urllib import parse
+
+from elasticsearch_raven import sockets
+
+SENT_FIELD = 'load_generator_sent'
+RECORD_HEADER = struct.Struct('>dI')
+MAX_LATENCIES = 1000000
+
+
+def run():
+    args = _parse_args()
+    args.command(args)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Load generator for elasticsearch-raven endpoints')
+    commands = parser.add_subparsers()
+
+    generate = commands.add_parser('generate', help='Send generated events')
+    _add_load_args(generate)
+    generate.add_argument('--body-size', type=int, default=1000,
+                          help='Size of message in generated events')
+    generate.add_argument('--project', default='load-test-{0:%Y.%m.%d}')
+    generate.set_defaults(command=_generate)
+
+    replay = commands.add_parser(
+        'replay', help='Send captured datagrams, latency is measured only '
+                       'for generated events')
+    _add_load_args(replay)
+    replay.add_argument('capture_file')
+    replay.set_defaults(command=_replay)
+
+    capture = commands.add_parser(
+        'capture', help='Record datagrams received on udp socket')
+    capture.add_argument('listen_address', help='IP:PORT')
+    capture.add_argument('capture_file')
+    capture.add_argument('--count', type=int, default=0,
+                         help='Stop after that many datagrams')
+    capture.set_defaults(command=_capture)
+    return parser.parse_args()
+
+
+def _add_load_args(parser):
+    parser.add_argument('target', help='udp://IP:PORT or http://IP:PORT/PATH')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='Messages per second')
+    parser.add_argument('--ramp-to', type=float, default=None,
+                        help='Grow rate linearly to this value')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--connections', type=int, default=4,
+                        help='Parallel http connections')
+    parser.add_argument('--sink-port', type=int, default=None,
+                        help='Run fake elasticsearch on this port and '
+                             'measure indexed events')
+    parser.add_argument('--sink-wait', type=float, default=5.0,
+                        help='Seconds to wait for late events in the sink')
+
+
+def _generate(args):
+    def messages():
+        while True:
+            yield make_datagram(args.project, args.body_size)
+    _run_load(args, messages())
+
+
+def _replay(args):
+    records = [data for _, data in read_capture(args.capture_file)]
+    if not records:
+        sys.exit('Capture file is empty.')
+
+    def messages():
+        while True:
+            for data in records:
+                yield data
+    _run_load(args, messages())
+
+
+def make_datagram(project, body_size, sent=None):
+    body = json.dumps({
+        'project': project,
+        'message': 'x' * body_size,
+        'extra': {SENT_FIELD: time.time() if sent is None else sent},
+    }).encode('utf-8')
+    return (b'sentry_key=load, sentry_secret=generator\n\n' +
+            base64.b64encode(zlib.compress(body)))
+
+
+def rate_at(args, elapsed):
+    if args.ramp_to is None:
+        return args.rate
+    return args.rate + (args.ramp_to - args.rate) * elapsed / args.duration
+
+
+def _run_load(args, messages):
+    target = parse.urlparse(args.target)
+    sink = None
+    if args.sink_port is not None:
+        sink = FakeElasticsearch(args.sink_port)
+        sink.as_thread().start()
+    if target.scheme == 'udp':
+        sender = UdpSender(target)
+    elif target.scheme == 'http':
+        sender = HttpSender(target, args.connections)
+    else:
+        raise ValueError('only udp and http targets are supported')
+
+    drops_before = sockets.read_udp_drops(port=target.port)
+    started = time.monotonic()
+    sent = 0
+    while True:
+        elapsed = time.monotonic() - started
+        if elapsed >= args.duration:
+            break
+        due = int(_messages_due(args, elapsed))
+        while sent < due:
+            sender.send(next(messages))
+            sent += 1
+        time.sleep(0.001)
+    sender.close()
+    elapsed = time.monotonic() - started
+    if sink is not None:
+        sink.wait_for(sent, args.sink_wait)
+    drops = sockets.read_udp_drops(port=target.port) - drops_before
+    report = {
+        'sent': sent,
+        'sent_rate': sent / elapsed,
+        'errors': sender.errors,
+        'kernel_drops': drops,
+        'kernel_drop_rate': drops / elapsed,
+    }
+    if sink is not None:
+        report.update(sink.report(elapsed))
+    sys.stdout.write(''.join('{}: {}\n'.format(key, _format(value))
+                             for key, value in sorted(report.items())))
+
+
+def _messages_due(args, elapsed):
+    # integral of the linear rate function
+    return (args.rate + rate_at(args, elapsed)) / 2 * elapsed
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.3f}'.format(value)
+    return value
+
+
+class UdpSender(object):
+    def __init__(self, target):
+        self.address = target.hostname, target.port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.errors = 0
+
+    def send(self, data):
+        try:
+            self.sock.sendto(data, self.address)
+        except socket.error:
+            self.errors += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class HttpSender(object):
+    def __init__(self, target, connections):
+        self.target = target
+        self.errors = 0
+        self._pending = queue.Queue(connections * 100)
+        self._workers = [threading.Thread(target=self._work)
+                         for _ in range(connections)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def send(self, data):
+        self._pending.put(data)
+
+    def close(self):
+        for _ in self._workers:
+            self._pending.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        connection = http_client.HTTPConnection(self.target.hostname,
+                                                self.target.port)
+        while True:
+            data = self._pending.get()
+            if data is None:
+                break
+            headers, body = data.split(b'\n\n', 1)
+            try:
+                connection.request('POST', self.target.path or '/', body, {
+                    'X-Sentry-Auth': headers.decode('utf-8')})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    self.errors += 1
+            except (socket.error, http_client.HTTPException):
+                self.errors += 1
+                connection.close()
+        connection.close()
+
+
+class FakeElasticsearch(object):
+    def __init__(self, port):
+        self.received = 0
+        self.latencies = []
+        self._condition = threading.Condition()
+        sink = self
+
+        class RequestHandler(http_server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                if self.path.split('?')[0].endswith('/_bulk'):
+                    documents = body.splitlines()[1::2]
+                    response = {'errors': False, 'items': [
+                        {'index': {'status': 201}} for _ in documents]}
+                else:
+                    documents = [body]
+                    response = {'ok': True, 'created': True}
+                sink.add([json.loads(document.decode('utf-8'))
+                          for document in documents])
+                self._respond(response)
+
+            do_PUT = do_POST
+
+            def do_GET(self):
+                self._respond({})
+
+            def _respond(self, response):
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http_server.ThreadingHTTPServer(('127.0.0.1', port),
+                                                      RequestHandler)
+
+    def as_thread(self):
+        sink = threading.Thread(target=self.server.serve_forever)
+        sink.daemon = True
+        return sink
+
+    def add(self, documents):
+        now = time.time()
+        with self._condition:
+            for document in documents:
+                sent = self._sent_time(document)
+                if sent is not None and len(self.latencies) < MAX_LATENCIES:
+                    self.latencies.append(now - sent)
+            self.received += len(documents)
+            self._condition.notify_all()
+
+    @staticmethod
+    def _sent_time(document):
+        extra = document.get('extra', {})
+        return extra.get(SENT_FIELD + '<float>', extra.get(SENT_FIELD))
+
+    def wait_for(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.received < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+    def report(self, elapsed):
+        with self._condition:
+            latencies = sorted(self.latencies)
+            report = {'indexed': self.received,
+                      'indexed_rate': self.received / elapsed}
+        for percentile in [50, 90, 99, 100]:
+            if latencies:
+                index = (len(latencies) - 1) * percentile // 100
+                report['latency_p{}'.format(percentile)] = latencies[index]
+        return report
+
+
+def read_capture(path):
+    with open(path, 'rb') as capture_file:
+        while True:
+            header = capture_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            received, length = RECORD_HEADER.unpack(header)
+            yield received, capture_file.read(length)
+
+
+def write_record(capture_file, received, data):
+    capture_file.write(RECORD_HEADER.pack(received, len(data)))
+    capture_file.write(data)
+
+
+def _capture(args):
+    ip, port = args.listen_address.rsplit(':', 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ip, int(port)))
+    count = 0
+    with open(args.capture_file, 'ab') as capture_file:
+        try:
+            while not args.count or count < args.count:
+                data, _ = sock.recvfrom(65535)
+                write_record(capture_file, time.time(), data)
+                count += 1
+        except KeyboardInterrupt:
+            pass
+    sys.stdout.write('Captured {} datagrams.\n'.format(count))
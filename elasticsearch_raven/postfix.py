@@ -2,7 +2,89 @@ import itertools
 import collections
 
 
-def postfix_encoded_data(encoded_data):
+class Limits(object):
+    def __init__(self, max_depth=0, max_string=0, max_list=0, max_fields=0,
+                 max_size=0):
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.max_list = max_list
+        self.max_fields = max_fields
+        self.max_size = max_size
+
+    def __bool__(self):
+        return any([self.max_depth, self.max_string, self.max_list,
+                    self.max_fields, self.max_size])
+
+    __nonzero__ = __bool__
+
+
+class Budget(object):
+    SCALAR_SIZE = 8
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.depth = 0
+        self.fields = 0
+        self.size = 0
+        self.truncated = set()
+
+    def postfix_items(self, items):
+        result = []
+        if self._enter():
+            try:
+                for item in items:
+                    if not self._add_field(len(item[0])):
+                        break
+                    result.extend(postfix_types(item, self))
+            finally:
+                self.depth -= 1
+        return result
+
+    def postfix_elements(self, elements):
+        result = []
+        if self._enter():
+            try:
+                if 0 < self.limits.max_list < len(elements):
+                    self.truncated.add('list')
+                    elements = elements[:self.limits.max_list]
+                for element in elements:
+                    if not self._add_field(0):
+                        break
+                    result.extend(postfix_types(('', element), self))
+            finally:
+                self.depth -= 1
+        return result
+
+    def string(self, data):
+        if 0 < self.limits.max_string < len(data):
+            self.truncated.add('string')
+            data = data[:self.limits.max_string]
+        self.size += len(data)
+        return data
+
+    def scalar(self):
+        self.size += self.SCALAR_SIZE
+
+    def _enter(self):
+        if 0 < self.limits.max_depth <= self.depth:
+            self.truncated.add('depth')
+            return False
+        self.depth += 1
+        return True
+
+    def _add_field(self, key_size):
+        if 0 < self.limits.max_fields <= self.fields:
+            self.truncated.add('fields')
+            return False
+        if 0 < self.limits.max_size <= self.size:
+            self.truncated.add('size')
+            return False
+        self.fields += 1
+        self.size += key_size
+        return True
+
+
+def postfix_encoded_data(encoded_data, limits=None):
     field_names_to_postfix = ['extra']
     sentry_fields = keys_starting_with(encoded_data, 'sentry.')
     field_names_to_postfix.extend(sentry_fields)
@@ -10,51 +92,67 @@ def postfix_encoded_data(encoded_data):
     fields_to_postfix = (field for field in encoded_data
                          if field in field_names_to_postfix)
 
+    budget = Budget(limits) if limits else None
     for field in fields_to_postfix:
         _, encoded_data[field] = next(postfix_types(
-            ('', encoded_data[field])))
+            ('', encoded_data[field]), budget))
+    if budget is not None and budget.truncated:
+        encoded_data['_truncated'] = sorted(budget.truncated)
 
 
 def keys_starting_with(dictionary, word):
     return (key for key in dictionary if key.startswith(word))
 
 
-def postfix_types(row):
+def postfix_types(row, budget=None):
     name, data = row
     if data is None:
-        return postfix_none(name, data)
+        return postfix_none(name, data, budget)
     type_postfix = postfixes.get(type(data), postfix_other)
-    return type_postfix(name, data)
+    return type_postfix(name, data, budget)
 
 
-def postfix_none(name, _):
+def postfix_none(name, _, budget=None):
+    if budget is not None:
+        budget.scalar()
     yield name, None
 
 
-def postfix_other(name, data):
+def postfix_other(name, data, budget=None):
+    if budget is not None:
+        budget.scalar()
     yield ('%s<%s>' % (name, type(data).__name__)), data
 
 
-def postfix_dict(name, data):
+def postfix_dict(name, data, budget=None):
     if name.endswith(">"):
         name += "<dict>"
-    postfix_items = list(map(postfix_types, data.items()))
+    if budget is None:
+        postfix_items = list(map(postfix_types, data.items()))
+    else:
+        postfix_items = [budget.postfix_items(data.items())]
     yield name, dict(itertools.chain(*postfix_items))
 
 
-def postfix_str(name, data):
+def postfix_str(name, data, budget=None):
+    if budget is not None:
+        data = budget.string(data)
     yield name + '<string>', data
 
 
-def postfix_list(name, data):
-    for k, v in _split_list_by_type(data).items():
+def postfix_list(name, data, budget=None):
+    for k, v in _split_list_by_type(data, budget).items():
         yield name + k, v
 
 
-def _split_list_by_type(data):
+def _split_list_by_type(data, budget=None):
     result = collections.defaultdict(list)
-    for element in data:
-        for value_type, value in postfix_types(('', element)):
+    if budget is None:
+        for element in data:
+            for value_type, value in postfix_types(('', element)):
+                result[value_type].append(value)
+    else:
+        for value_type, value in budget.postfix_elements(data):
             result[value_type].append(value)
     if result:
         return dict(result)
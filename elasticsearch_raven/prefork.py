@@ -0,0 +1,135 @@
+import collections
+import json
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+
+MIN_WORKER_LIFETIME = 1.0
+
+
+class Supervisor(object):
+    def __init__(self, worker, processes, stats_interval=60.0,
+                 drain_timeout=30.0):
+        self.worker = worker
+        self.processes = processes
+        self.stats_interval = stats_interval
+        self.drain_timeout = drain_timeout
+        self.should_finish = False
+        self._workers = {}
+        self._stats = {}
+        self._finished_stats = collections.Counter()
+
+    def run(self):
+        def terminate(signum, frame):
+            self.should_finish = True
+        signal.signal(signal.SIGTERM, terminate)
+        signal.signal(signal.SIGQUIT, terminate)
+        # the default action of SIGUSR1 would kill the supervisor, workers
+        # are the ones sampling their stacks
+        signal.signal(signal.SIGUSR1, self.forward_signal)
+        for _ in range(self.processes):
+            self._spawn()
+        next_report = time.monotonic() + self.stats_interval
+        while not self.should_finish:
+            self._read_stats(1.0)
+            self._reap(respawn=True)
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report += self.stats_interval
+        self._drain()
+        self.report()
+
+    def forward_signal(self, signum, frame):
+        for pid in self._workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stats(self):
+        total = collections.Counter(self._finished_stats)
+        for stats in self._stats.values():
+            total.update(stats)
+        return total
+
+    def report(self):
+        sys.stdout.write('workers: {} {}\n'.format(
+            len(self._workers), ' '.join(
+                '{}: {}'.format(key, value)
+                for key, value in sorted(self.stats().items()))))
+        sys.stdout.flush()
+
+    def _spawn(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self._run_worker(os.fdopen(write_fd, 'w'))
+        os.close(write_fd)
+        self._workers[pid] = os.fdopen(read_fd), time.monotonic()
+        self._stats[pid] = collections.Counter()
+
+    def _run_worker(self, stats_file):
+        status = 1
+        try:
+            for stats_pipe, _ in self._workers.values():
+                stats_pipe.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGQUIT, signal.SIG_DFL)
+            # until the worker installs its stack sampler
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+            self.worker(stats_file)
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(bool(e.code))
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    def _read_stats(self, timeout):
+        pipes = {stats_pipe: pid
+                 for pid, (stats_pipe, _) in self._workers.items()}
+        try:
+            ready, _, _ = select.select(list(pipes), [], [], timeout)
+        except InterruptedError:
+            return
+        for stats_pipe in ready:
+            line = stats_pipe.readline()
+            if line:
+                self._stats[pipes[stats_pipe]] = collections.Counter(
+                    json.loads(line))
+
+    def _reap(self, respawn):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            stats_pipe, started = self._workers.pop(pid)
+            stats_pipe.close()
+            self._finished_stats.update(self._stats.pop(pid))
+            if respawn and not self.should_finish:
+                sys.stdout.write('Worker {} exited with status {}, '
+                                 'restarting.\n'.format(pid, status))
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+                self._spawn()
+
+    def _drain(self):
+        for pid in self._workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_timeout
+        while self._workers and time.monotonic() < deadline:
+            self._read_stats(0.1)
+            self._reap(respawn=False)
+        for pid in list(self._workers):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._workers.pop(pid)[0].close()
+            self._finished_stats.update(self._stats.pop(pid))
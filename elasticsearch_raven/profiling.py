@@ -0,0 +1,143 @@
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+from elasticsearch_raven import configuration
+
+
+class NullStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class NullTimer(object):
+    _stage = NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+
+class Stage(object):
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class StageTimer(object):
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self._counts = collections.Counter()
+        self._totals = collections.Counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def add(self, name, elapsed):
+        with self._lock:
+            self._counts[name] += 1
+            self._totals[name] += elapsed
+
+    def as_thread(self):
+        reporter = threading.Thread(target=self.run)
+        reporter.daemon = True
+        return reporter
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
+
+    def report(self):
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+            totals, self._totals = self._totals, collections.Counter()
+        sys.stdout.write('stages: {}\n'.format(' '.join(
+            '{}={}/{:.3f}s/{:.3f}ms'.format(
+                name, counts[name], totals[name],
+                totals[name] / counts[name] * 1000)
+            for name in sorted(counts))))
+        sys.stdout.flush()
+
+
+timer = NullTimer()
+
+
+def enable_stage_timers(interval):
+    global timer
+    timer = StageTimer(interval)
+    timer.as_thread().start()
+
+
+class StackSampler(object):
+    def __init__(self, duration, directory, interval=0.005):
+        self.duration = duration
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def install(self, signum=signal.SIGUSR1):
+        signal.signal(signum, self.toggle)
+
+    def toggle(self, signum=None, frame=None):
+        if self._sampler is not None and self._sampler.is_alive():
+            self._stop.set()
+        else:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self.run)
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def run(self):
+        stacks = collections.Counter()
+        own_id = threading.current_thread().ident
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline and not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stacks[self._format_stack(frame)] += 1
+            time.sleep(self.interval)
+        self.dump(stacks)
+
+    def dump(self, stacks):
+        path = os.path.join(self.directory, 'elasticsearch-raven-{}-{}.folded'
+                            .format(os.getpid(), int(time.time())))
+        with open(path, 'w') as dump:
+            for stack, count in stacks.most_common():
+                dump.write('{} {}\n'.format(stack, count))
+        sys.stdout.write('Profile written to {}\n'.format(path))
+        return path
+
+    @staticmethod
+    def _format_stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+
+def configure():
+    if configuration['stage_timers']:
+        enable_stage_timers(configuration['stage_timers'])
+    directory = configuration['profile_directory']
+    if directory is None:
+        import tempfile
+        directory = tempfile.gettempdir()
+    StackSampler(configuration['profile_seconds'], directory).install()
@@ -1,17 +1,44 @@
-import signal
+import collections
 import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import elasticsearch
 
 from elasticsearch_raven import configuration
+from elasticsearch_raven import controller
+from elasticsearch_raven import profiling
+from elasticsearch_raven import queues
 from elasticsearch_raven import utils
 
+BATCH_POLL_INTERVAL = 0.1
+TOO_MANY_REQUESTS = 429
+
 
 class Sender(object):
     def __init__(self, log_transport, pending_logs, exception_handler):
         self.log_transport = log_transport
         self.pending_logs = pending_logs
         self.exception_handler = exception_handler
+        self.should_finish = False
+        self.in_flight = threading.Lock()
+        self.stats = collections.Counter()
+        self.timer = profiling.timer
+        self.controller = controller.get_configured_controller()
+        # batches in the order their messages were taken from the queue,
+        # each is [messages, sent], sent is None until the request ends
+        self._batches = collections.deque()
+        self._sending = 0
+        # set when a batch failed unexpectedly, its messages and all taken
+        # after them stay unacknowledged, so the broker delivers them again
+        # when the process exits
+        self._failed = False
+        self._requests = queue.Queue()
+        self._changed = threading.Condition()
 
     def as_thread(self):
         sender = threading.Thread(target=self.send)
@@ -19,25 +46,183 @@ class Sender(object):
         return sender
 
     def send(self):
+        if self.controller is not None:
+            return self._send_batches()
         try:
-            while True:
-                message = self.pending_logs.get()
-                self._send_message(message)
+            while not self.should_finish:
+                with self.timer.stage('queue_wait'):
+                    message = self.pending_logs.get()
+                self._record_dequeued(message, time.time())
+                with self.in_flight, self.timer.stage('send_message'):
+                    self._send_message(message)
         except Exception as e:
             self.exception_handler(e)
 
+    def finish(self, timeout):
+        self.should_finish = True
+        if self.controller is not None:
+            with self._changed:
+                return self._changed.wait_for(self._batches_done, timeout)
+        return self.in_flight.acquire(timeout=timeout)
+
+    def _send_batches(self):
+        for _ in range(self.controller.max_concurrency):
+            worker = threading.Thread(target=self._batch_worker)
+            worker.daemon = True
+            worker.start()
+        try:
+            while not self.should_finish and not self._failed:
+                with self._changed:
+                    self._acknowledge()
+                    while self._sending >= self.controller.concurrency:
+                        self._changed.wait()
+                        self._acknowledge()
+                batch = self._next_batch()
+                if batch:
+                    entry = [batch, None]
+                    with self._changed:
+                        self._batches.append(entry)
+                        self._sending += 1
+                    self._requests.put(entry)
+        except Exception as e:
+            self._wait_for_batches()
+            self.exception_handler(e)
+        else:
+            self._wait_for_batches()
+
+    def _next_batch(self):
+        batch = []
+        with self.timer.stage('queue_wait'):
+            try:
+                batch.append(self.pending_logs.get(
+                    timeout=BATCH_POLL_INTERVAL))
+                while len(batch) < self.controller.batch_size:
+                    batch.append(self.pending_logs.get(timeout=0))
+            except queues.Empty:
+                pass
+        now = time.time()
+        with self._changed:
+            for message in batch:
+                self._record_dequeued(message, now)
+        return batch
+
+    def _acknowledge(self):
+        # messages are taken from the queue by this thread only and marked
+        # done in the same order, whichever batch finishes first
+        while self._batches and self._batches[0][1]:
+            batch, _ = self._batches.popleft()
+            for _ in batch:
+                self.pending_logs.task_done()
+        self._changed.notify_all()
+
+    def _batches_done(self):
+        if self._failed:
+            return all(sent is not None for _, sent in self._batches)
+        return not self._batches
+
+    def _wait_for_batches(self):
+        with self._changed:
+            self._acknowledge()
+            while not self._batches_done():
+                self._changed.wait()
+                self._acknowledge()
+
+    def _batch_worker(self):
+        while True:
+            entry = self._requests.get()
+            sent = False
+            try:
+                with self.timer.stage('send_batch'):
+                    self._send_batch(entry[0])
+                sent = True
+            except Exception as e:
+                with self._changed:
+                    self._failed = True
+                self.exception_handler(e)
+            finally:
+                with self._changed:
+                    entry[1] = sent
+                    self._sending -= 1
+                    self._changed.notify_all()
+
+    def _send_batch(self, batch):
+        for retry in utils.retry_loop(1.0, max_delay=60.0, back_off=1.5):
+            start = time.monotonic()
+            try:
+                errors = self.log_transport.send_messages(batch)
+            except elasticsearch.exceptions.ConnectionError as e:
+                self._update_controller(time.monotonic() - start, True)
+                with self._changed:
+                    self.stats['retried'] += len(batch)
+                retry(e)
+                continue
+            except elasticsearch.exceptions.TransportError as e:
+                errors = [e] * len(batch)
+            rejected = self._handle_errors(batch, errors,
+                                           time.monotonic() - start)
+            if rejected:
+                batch = [message for message, error in rejected]
+                retry(rejected[0][1])
+
+    def _handle_errors(self, batch, errors, latency):
+        # rejected messages are sent again once the controller backs off,
+        # other errors are reported like in single message mode
+        rejected = []
+        failed = []
+        for message, error in zip(batch, errors):
+            if error is None:
+                continue
+            if error.status_code == TOO_MANY_REQUESTS:
+                rejected.append((message, error))
+            else:
+                failed.append((message, error))
+        self._update_controller(latency, bool(rejected))
+        now = time.time()
+        with self._changed:
+            for message, error in zip(batch, errors):
+                if error is None:
+                    self._record_indexed(message, now)
+            self.stats['sent'] += len(batch) - len(rejected) - len(failed)
+            self.stats['rejected'] += len(rejected)
+            self.stats['failed'] += len(failed)
+        for message, error in failed:
+            self._raport_error(message, error)
+        return rejected
+
+    def _record_dequeued(self, message, now):
+        if message.enqueued is not None:
+            utils.record_latency(self.stats, 'queue_latency',
+                                 now - message.enqueued)
+
+    def _record_indexed(self, message, now):
+        if message.received is not None:
+            utils.record_latency(self.stats, 'ingest_latency',
+                                 now - message.received)
+
+    def _update_controller(self, latency, rejected):
+        throttled = self.controller.update(latency, rejected)
+        with self._changed:
+            self.stats['throttled'] += throttled
+            self.stats['send_concurrency'] = self.controller.concurrency
+            self.stats['send_batch_size'] = self.controller.batch_size
+
     def _send_message(self, message):
+        # shutdown waits for the message being sent with finish(), signals
+        # are not blocked around it
         for retry in utils.retry_loop(1.0, max_delay=60.0, back_off=1.5):
-            with utils.ignore_signals([signal.SIGTERM, signal.SIGQUIT]):
-                try:
-                    self.log_transport.send_message(message)
-                except elasticsearch.exceptions.ConnectionError as e:
-                    retry(e)
-                except elasticsearch.exceptions.TransportError as e:
-                    self._raport_error(message, e)
-                    self.pending_logs.task_done()
-                else:
-                    self.pending_logs.task_done()
+            try:
+                self.log_transport.send_message(message)
+            except elasticsearch.exceptions.ConnectionError as e:
+                self.stats['retried'] += 1
+                retry(e)
+            except elasticsearch.exceptions.TransportError as e:
+                self.stats['failed'] += 1
+                self._raport_error(message, e)
+                self.pending_logs.task_done()
+            else:
+                self.stats['sent'] += 1
+                self._record_indexed(message, time.time())
+                self.pending_logs.task_done()
 
     def _raport_error(self, message, error):
         connection = elasticsearch.Elasticsearch(
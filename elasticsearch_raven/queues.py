@@ -1,12 +1,18 @@
 import base64
+import collections
+import itertools
+import socket
+import threading
+import time
+import zlib
 
 try:
     import queue
 except ImportError:
     import Queue as queue
 
-import kombu
-
+from elasticsearch_raven import configuration
+from elasticsearch_raven import lanes
 from elasticsearch_raven import transport
 
 
@@ -14,6 +20,10 @@ class Empty(Exception):
     pass
 
 
+class Full(Exception):
+    pass
+
+
 class AbstractQueue:
     def get(self, timeout=None):
         raise NotImplementedError
@@ -31,9 +41,80 @@ class AbstractQueue:
         raise NotImplementedError
 
 
+def shard_names(queue_name, shards):
+    if shards == 1:
+        return [queue_name]
+    return ['{}-{}'.format(queue_name, shard) for shard in range(shards)]
+
+
+def message_size(item):
+    # laned queues are given (lane, message) pairs
+    if isinstance(item, tuple):
+        item = item[1]
+    return len(item.body)
+
+
+class ByteBoundedQueue(queue.Queue):
+    def __init__(self, maxsize=0, max_bytes=0):
+        queue.Queue.__init__(self, maxsize)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    def put(self, item, block=True, timeout=None):
+        size = message_size(item)
+        with self.not_full:
+            if not block:
+                if self._is_full(size):
+                    raise queue.Full
+            elif timeout is None:
+                while self._is_full(size):
+                    self.not_full.wait()
+            elif timeout < 0:
+                raise ValueError("'timeout' must be a non-negative number")
+            else:
+                endtime = time.monotonic() + timeout
+                while self._is_full(size):
+                    remaining = endtime - time.monotonic()
+                    if remaining <= 0.0:
+                        raise queue.Full
+                    self.not_full.wait(remaining)
+            self._put(item)
+            self.bytes += size
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _is_full(self, size):
+        if 0 < self.maxsize <= self._qsize():
+            return True
+        # a message bigger than the whole budget is still let into an
+        # empty queue, otherwise it would block forever
+        return self.bytes > 0 and self.bytes + size > self.max_bytes
+
+    def _get(self):
+        item = queue.Queue._get(self)
+        self.bytes -= message_size(item)
+        # freed bytes may be enough for more than one waiting producer
+        self.not_full.notify_all()
+        return item
+
+
+def get_configured_queue():
+    return ThreadingQueue(configuration['queue_maxsize'],
+                          max_bytes=configuration['queue_max_bytes'],
+                          lanes=lanes.get_configured_lanes())
+
+
 class ThreadingQueue:
-    def __init__(self, *args, **kwargs):
-        self.queue = queue.Queue(*args, **kwargs)
+    def __init__(self, maxsize=0, max_bytes=0, lanes=None):
+        if max_bytes:
+            self.queue = ByteBoundedQueue(maxsize, max_bytes)
+        else:
+            self.queue = queue.Queue(maxsize)
+        self.lanes = lanes
+        if lanes is not None:
+            # queue.Queue keeps items in a deque, lanes have the same
+            # append/popleft/len interface
+            self.queue.queue = lanes
 
     def get(self, timeout=None):
         try:
@@ -42,7 +123,20 @@ class ThreadingQueue:
             raise Empty()
 
     def put(self, message):
-        self.queue.put(message)
+        message.enqueued = time.time()
+        self.queue.put(self._item(message))
+
+    def put_nowait(self, message):
+        message.enqueued = time.time()
+        try:
+            self.queue.put(self._item(message), block=False)
+        except queue.Full:
+            raise Full()
+
+    def _item(self, message):
+        if self.lanes is None:
+            return message
+        return self.lanes.classify(message), message
 
     def join(self):
         self.queue.join()
@@ -56,17 +150,30 @@ class ThreadingQueue:
 
 class KombuQueue:
     def __init__(self, amqp_url, queue_name):
+        import kombu
         self.connection = kombu.Connection(amqp_url)
+        self.queue_name = queue_name
         self.queue = self.connection.SimpleQueue(queue_name)
-        self._processed = None
+        # batching senders take many messages before the first is done
+        self._processed = collections.deque()
 
     def get(self, timeout=None):
         try:
-            self._processed = self.queue.get(timeout=timeout)
+            processed = self.queue.get(timeout=timeout)
         except self.queue.Empty:
             raise Empty()
         else:
-            return self._deserialize(self._processed.payload)
+            self._processed.append(processed)
+            return self._deserialize(processed.payload)
+
+    def get_nowait(self):
+        try:
+            processed = self.queue.get_nowait()
+        except self.queue.Empty:
+            raise Empty()
+        else:
+            self._processed.append(processed)
+            return self._deserialize(processed.payload)
 
     def put(self, message):
         return self.queue.put(self._serialize(message))
@@ -75,16 +182,237 @@ class KombuQueue:
         pass
 
     def task_done(self):
-        self._processed.ack()
-        self._processed = None
+        self._processed.popleft().ack()
 
     def has_nonpersistent_task(self):
         return False
 
     def _serialize(self, message):
-        return message.headers, base64.b64encode(message.body).decode('utf-8')
+        return (message.headers,
+                base64.b64encode(message.body).decode('utf-8'),
+                message.received, time.time())
 
     def _deserialize(self, data):
-        headers, encoded_body = data
+        headers, encoded_body = data[:2]
+        # messages queued by older versions have no timestamps
+        received, enqueued = data[2:4] if len(data) >= 4 else (None, None)
         body = base64.b64decode(encoded_body.encode('utf-8'))
-        return transport.SentryMessage(headers, body)
+        headers = transport.shared_headers(headers)
+        return transport.SentryMessage(headers, body, received, enqueued)
+
+
+PUT_POLL_INTERVAL = 0.5
+
+
+class PublishingKombuQueue(KombuQueue):
+    def __init__(self, amqp_url, queue_name, buffer_size=10000,
+                 batch_size=100, confirm_timeout=10.0):
+        KombuQueue.__init__(self, amqp_url, queue_name)
+        self.batch_size = batch_size
+        self.confirm_timeout = confirm_timeout
+        self.stats = collections.Counter()
+        self._buffer = queue.Queue(buffer_size)
+        self._resend = collections.deque()
+        self._unconfirmed = collections.OrderedDict()
+        self._next_tag = 1
+        self._publisher = None
+        self._error = None
+
+    def put(self, message):
+        if self._error is not None:
+            raise self._error
+        if self._publisher is None:
+            self._publisher = threading.Thread(target=self._publish_forever)
+            self._publisher.daemon = True
+            self._publisher.start()
+        # a publisher that died with a full buffer would never free a slot,
+        # so wait in short steps and check for its error in between
+        while True:
+            try:
+                self._buffer.put(message, timeout=PUT_POLL_INTERVAL)
+                return
+            except queue.Full:
+                if self._error is not None:
+                    raise self._error
+
+    def join(self):
+        self._buffer.join()
+
+    def flush(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._buffer.all_tasks_done:
+            while self._buffer.unfinished_tasks and self._error is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._buffer.all_tasks_done.wait(remaining)
+        return not self._buffer.unfinished_tasks
+
+    def has_nonpersistent_task(self):
+        return bool(self._buffer.unfinished_tasks)
+
+    def _publish_forever(self):
+        try:
+            self._open_channel()
+            while True:
+                batch = self._next_batch()
+                try:
+                    self._publish_batch(batch)
+                except self.connection.connection_errors:
+                    self.stats['reconnected'] += 1
+                    self._resend.extend(self._unconfirmed.values())
+                    self._unconfirmed.clear()
+                    self._open_channel()
+        except Exception as e:
+            self._error = e
+            with self._buffer.all_tasks_done:
+                self._buffer.all_tasks_done.notify_all()
+
+    def _open_channel(self):
+        self.connection.ensure_connection()
+        channel = self.connection.channel()
+        channel.confirm_select()
+        channel.events['basic_ack'].add(self._on_ack)
+        channel.events['basic_nack'].add(self._on_nack)
+        self.queue = self.connection.SimpleQueue(self.queue_name,
+                                                 channel=channel)
+        self._next_tag = 1
+
+    def _next_batch(self):
+        batch = []
+        while self._resend and len(batch) < self.batch_size:
+            batch.append(self._resend.popleft())
+        if not batch:
+            batch.append(self._buffer.get())
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _publish_batch(self, batch):
+        for message in batch:
+            self._unconfirmed[self._next_tag] = message
+            self._next_tag += 1
+            self.queue.put(self._serialize(message))
+        self.stats['published'] += len(batch)
+        deadline = time.monotonic() + self.confirm_timeout
+        while self._unconfirmed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # republished messages get the same document id, so a late
+                # confirm of the first copy only costs a duplicate write
+                self.stats['timed_out'] += len(self._unconfirmed)
+                self._resend.extend(self._unconfirmed.values())
+                self._unconfirmed.clear()
+                break
+            try:
+                self.connection.drain_events(timeout=remaining)
+            except socket.timeout:
+                pass
+
+    def _confirmed_tags(self, delivery_tag, multiple):
+        if multiple:
+            return [tag for tag in self._unconfirmed if tag <= delivery_tag]
+        elif delivery_tag in self._unconfirmed:
+            return [delivery_tag]
+        else:
+            return []
+
+    def _on_ack(self, delivery_tag, multiple):
+        for tag in self._confirmed_tags(delivery_tag, multiple):
+            del self._unconfirmed[tag]
+            self.stats['confirmed'] += 1
+            self._buffer.task_done()
+
+    def _on_nack(self, delivery_tag, multiple):
+        for tag in self._confirmed_tags(delivery_tag, multiple):
+            self._resend.append(self._unconfirmed.pop(tag))
+            self.stats['nacked'] += 1
+
+
+class LanedQueue:
+    def __init__(self, lane_queues, classifier, poll_interval=0.05):
+        self.lanes = lane_queues
+        self.classify = classifier
+        self.scheduler = lanes.Scheduler(classifier.weights)
+        self.poll_interval = poll_interval
+        self._processed = collections.deque()
+
+    def get(self, timeout=None):
+        # amqp queues can not be waited on together, empty lanes are polled
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # lanes are chosen once per round, when the chosen one is empty
+            # the others are tried in priority order
+            chosen = self.scheduler.choose(range(len(self.lanes)))
+            for lane in [chosen] + [lane for lane in range(len(self.lanes))
+                                    if lane != chosen]:
+                try:
+                    message = self.lanes[lane].get_nowait()
+                except Empty:
+                    continue
+                self._processed.append(self.lanes[lane])
+                return message
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Empty()
+            time.sleep(self.poll_interval)
+
+    def put(self, message):
+        self.lanes[self.classify(message)].put(message)
+
+    def join(self):
+        for lane in self.lanes:
+            lane.join()
+
+    def task_done(self):
+        self._processed.popleft().task_done()
+
+    def flush(self, timeout):
+        deadline = time.monotonic() + timeout
+        return all([lane.flush(max(deadline - time.monotonic(), 0))
+                    for lane in self.lanes])
+
+    def has_nonpersistent_task(self):
+        return any(lane.has_nonpersistent_task() for lane in self.lanes)
+
+
+def open_queue(queue_class, amqp_url, queue_name, classifier=None):
+    if classifier is None:
+        return queue_class(amqp_url, queue_name)
+    return LanedQueue(
+        [queue_class(amqp_url, lane_name) for lane_name in
+         lanes.lane_names(queue_name, len(classifier.weights))], classifier)
+
+
+class ShardedQueue:
+    def __init__(self, shards, shard_by='sentry_key'):
+        self.shards = shards
+        self._round_robin = itertools.cycle(shards)
+        self._choose_shard = {
+            'sentry_key': self._by_sentry_key,
+            'round-robin': self._by_round_robin,
+        }[shard_by]
+
+    def put(self, message):
+        self._choose_shard(message).put(message)
+
+    def join(self):
+        for shard in self.shards:
+            shard.join()
+
+    def flush(self, timeout):
+        deadline = time.monotonic() + timeout
+        return all([shard.flush(max(deadline - time.monotonic(), 0))
+                    for shard in self.shards])
+
+    def has_nonpersistent_task(self):
+        return any(shard.has_nonpersistent_task() for shard in self.shards)
+
+    def _by_sentry_key(self, message):
+        key = message.headers['sentry_key'].encode('utf-8')
+        return self.shards[zlib.crc32(key) % len(self.shards)]
+
+    def _by_round_robin(self, message):
+        return next(self._round_robin)
@@ -0,0 +1,227 @@
+import collections
+import multiprocessing
+import struct
+import time
+
+from multiprocessing import shared_memory
+
+from elasticsearch_raven import exceptions
+from elasticsearch_raven import queues
+from elasticsearch_raven import transport
+
+MAX_DATAGRAM = 65535
+POLL_INTERVAL = 0.1
+
+# head: end of written records, claimed: next record to give to a reader,
+# tail: start of records that are still claimed, everything before it can
+# be overwritten
+HEADER = struct.Struct('<QQQQQQ')
+HEAD, CLAIMED, TAIL, RECEIVED, DROPPED, CLOSED = range(6)
+DATA_OFFSET = 64
+# size, state and receive time of a record
+RECORD = struct.Struct('<IId')
+READY, RELEASED, WRAP = range(3)
+
+
+class Closed(Exception):
+    pass
+
+
+class SharedRing(object):
+    def __init__(self, capacity, max_record=MAX_DATAGRAM, context=None):
+        self.record_space = RECORD.size + max_record
+        if capacity < 2 * self.record_space:
+            raise ValueError('ring buffer must fit at least two records of '
+                             '{} bytes'.format(self.record_space))
+        context = context or multiprocessing.get_context('fork')
+        self.capacity = capacity
+        self.max_record = max_record
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=DATA_OFFSET + capacity)
+        self.buf = self.shm.buf
+        self.lock = context.Lock()
+        self.available = context.Semaphore(0)
+        HEADER.pack_into(self.buf, 0, 0, 0, 0, 0, 0, 0)
+
+    def _header(self):
+        return list(HEADER.unpack_from(self.buf, 0))
+
+    def _set(self, field, value):
+        struct.pack_into('<Q', self.buf, field * 8, value)
+
+    @property
+    def stats(self):
+        with self.lock:
+            header = self._header()
+        return collections.Counter({
+            'ring_received': header[RECEIVED],
+            'ring_dropped': header[DROPPED],
+            'ring_used_bytes': header[HEAD] - header[TAIL],
+        })
+
+    def receive(self, sock):
+        head = self._reserve()
+        if head is None:
+            # no room for the largest datagram, it is read and dropped to
+            # keep the kernel buffer moving
+            data, address = sock.recvfrom(self.max_record)
+            with self.lock:
+                self._set(DROPPED, self._header()[DROPPED] + 1)
+            return address
+        offset = DATA_OFFSET + head % self.capacity + RECORD.size
+        size, address = sock.recvfrom_into(
+            self.buf[offset:offset + self.max_record])
+        self._commit(head, size)
+        return address
+
+    def put(self, data):
+        head = self._reserve()
+        if head is None:
+            with self.lock:
+                self._set(DROPPED, self._header()[DROPPED] + 1)
+            return False
+        offset = DATA_OFFSET + head % self.capacity + RECORD.size
+        self.buf[offset:offset + len(data)] = data
+        self._commit(head, len(data))
+        return True
+
+    def _reserve(self):
+        # only one process writes, so head can be read without the lock
+        # staying held, readers only move claimed and tail
+        with self.lock:
+            header = self._header()
+        head = header[HEAD]
+        offset = head % self.capacity
+        skip = self.capacity - offset
+        if skip >= self.record_space:
+            skip = 0
+        if self.capacity - (head - header[TAIL]) < skip + self.record_space:
+            return None
+        if skip:
+            if skip >= RECORD.size:
+                RECORD.pack_into(self.buf, DATA_OFFSET + offset, 0, WRAP, 0)
+            head += skip
+        return head
+
+    def _commit(self, head, size):
+        RECORD.pack_into(self.buf, DATA_OFFSET + head % self.capacity,
+                         size, READY, time.time())
+        with self.lock:
+            self._set(RECEIVED, self._header()[RECEIVED] + 1)
+            self._set(HEAD, head + RECORD.size + size)
+        self.available.release()
+
+    def close(self):
+        with self.lock:
+            self._set(CLOSED, 1)
+        self.available.release()
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                header = self._header()
+                claimed = self._skip_wraps(header[CLAIMED], header[HEAD])
+                if claimed < header[HEAD]:
+                    offset = DATA_OFFSET + claimed % self.capacity
+                    size, _, _ = RECORD.unpack_from(self.buf, offset)
+                    self._set(CLAIMED, claimed + RECORD.size + size)
+                    start = offset + RECORD.size
+                    view = self.buf[start:start + size]
+                elif header[CLOSED]:
+                    raise Closed()
+                else:
+                    view = None
+            if view is not None:
+                # one wake up is used per record, so the semaphore does not
+                # grow while readers are busy
+                self.available.acquire(False)
+                return view, claimed
+            if deadline is None:
+                remaining = POLL_INTERVAL
+            else:
+                remaining = min(deadline - time.monotonic(), POLL_INTERVAL)
+                if remaining <= 0:
+                    raise queues.Empty()
+            self.available.acquire(timeout=remaining)
+
+    def received_at(self, position):
+        # claimed records are not written until released, no lock is needed
+        offset = DATA_OFFSET + position % self.capacity
+        return RECORD.unpack_from(self.buf, offset)[2]
+
+    def release(self, position):
+        # records can be released out of order by many readers, tail only
+        # moves over a run of released ones
+        with self.lock:
+            offset = DATA_OFFSET + position % self.capacity
+            size, _, received = RECORD.unpack_from(self.buf, offset)
+            RECORD.pack_into(self.buf, offset, size, RELEASED, received)
+            header = self._header()
+            tail = self._skip_wraps(header[TAIL], header[CLAIMED])
+            while tail < header[CLAIMED]:
+                offset = DATA_OFFSET + tail % self.capacity
+                size, state, _ = RECORD.unpack_from(self.buf, offset)
+                if state != RELEASED:
+                    break
+                tail = self._skip_wraps(tail + RECORD.size + size,
+                                        header[CLAIMED])
+            self._set(TAIL, tail)
+
+    def _skip_wraps(self, position, end):
+        if position >= end:
+            return position
+        offset = position % self.capacity
+        if self.capacity - offset < RECORD.size:
+            return position + self.capacity - offset
+        _, state, _ = RECORD.unpack_from(self.buf, DATA_OFFSET + offset)
+        if state == WRAP:
+            return position + self.capacity - offset
+        return position
+
+    def drained(self):
+        with self.lock:
+            header = self._header()
+        return bool(header[CLOSED]) and header[TAIL] == header[HEAD]
+
+    def unlink(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingQueue(queues.AbstractQueue):
+    def __init__(self, ring):
+        self.ring = ring
+        self.stats = collections.Counter()
+        self._unfinished = 0
+
+    def get(self, timeout=None):
+        while True:
+            view, position = self.ring.get(timeout)
+            received = self.ring.received_at(position)
+            try:
+                message = transport.SentryMessage.create_from_view(
+                    view, received)
+                message.enqueued = received
+            except (exceptions.DamagedSentryMessageError,
+                    exceptions.BadSentryMessageHeaderError, ValueError):
+                self.stats['damaged'] += 1
+                continue
+            finally:
+                view.release()
+                self.ring.release(position)
+            self._unfinished += 1
+            return message
+
+    def put(self, message):
+        raise NotImplementedError
+
+    def join(self):
+        pass
+
+    def task_done(self):
+        self._unfinished -= 1
+
+    def has_nonpersistent_task(self):
+        return bool(self._unfinished) or not self.ring.drained()
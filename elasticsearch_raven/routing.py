@@ -0,0 +1,150 @@
+import collections
+import threading
+import time
+
+from elasticsearch_raven import configuration
+from elasticsearch_raven import exceptions
+from elasticsearch_raven import file_sink
+from elasticsearch_raven import queue_sender
+from elasticsearch_raven import queues
+from elasticsearch_raven import transport
+
+DEFAULT_CLUSTER = 'default'
+# messages are routed on receiving threads, only this many bytes of a body
+# are decompressed to find its project
+ROUTE_PREFIX = 4096
+
+
+def parse_clusters(pairs):
+    clusters = {}
+    for pair in pairs:
+        name, host = pair.split('=', 1)
+        clusters[name] = host
+    return clusters
+
+
+def parse_routes(pairs):
+    # projects are index patterns, which may contain colons themselves
+    routes = {}
+    for pair in pairs:
+        key, cluster = pair.rsplit(':', 1)
+        routes[key] = cluster
+    return routes
+
+
+def get_configured_router():
+    clusters = parse_clusters(configuration['elasticsearch_clusters'])
+    if not clusters:
+        return None
+    return Router(clusters, parse_routes(configuration['cluster_routes']))
+
+
+def route_queue(pending_logs, log_transport, open_queue):
+    # pending_logs and log_transport are kept for the default cluster, other
+    # clusters get their own
+    router = get_configured_router()
+    if router is None or isinstance(log_transport, file_sink.FileTransport):
+        # files take events of all clusters
+        return pending_logs
+    clusters = {DEFAULT_CLUSTER: (log_transport, pending_logs)}
+    for name, host in router.clusters.items():
+        clusters[name] = (transport.get_configured_log_transport(host),
+                          open_queue())
+    return RoutingQueue(router, clusters)
+
+
+def create_sender(log_transport, pending_logs, exception_handler):
+    if isinstance(pending_logs, RoutingQueue):
+        return RoutingSender(pending_logs, exception_handler)
+    return queue_sender.Sender(log_transport, pending_logs, exception_handler)
+
+
+class Router(object):
+    def __init__(self, clusters, routes):
+        unknown = set(routes.values()) - set(clusters) - {DEFAULT_CLUSTER}
+        if unknown:
+            raise ValueError('routes to unknown clusters: {}'.format(
+                ', '.join(sorted(unknown))))
+        self.clusters = clusters
+        self.routes = routes
+
+    def __call__(self, message):
+        if not self.routes:
+            return DEFAULT_CLUSTER
+        cluster = self.routes.get(message.headers.get('sentry_key'))
+        if cluster is not None:
+            return cluster
+        try:
+            data = transport.decompress_prefix(message.body, ROUTE_PREFIX)
+        except exceptions.DamagedSentryMessageBodyError:
+            return DEFAULT_CLUSTER
+        return self.routes.get(transport.extract_project(data),
+                               DEFAULT_CLUSTER)
+
+
+class RoutingQueue(queues.AbstractQueue):
+    def __init__(self, router, clusters):
+        self.route = router
+        self.clusters = clusters
+        self.stats = collections.Counter()
+
+    def put(self, message):
+        # a full queue of a slow cluster must not stop messages of the
+        # others, so its messages are dropped instead of waited on
+        try:
+            self.put_nowait(message)
+        except queues.Full:
+            pass
+
+    def put_nowait(self, message):
+        cluster = self.route(message)
+        try:
+            self.clusters[cluster][1].put_nowait(message)
+        except queues.Full:
+            self.stats['dropped_{}'.format(cluster)] += 1
+            raise
+
+    def join(self):
+        for _, cluster_queue in self.clusters.values():
+            cluster_queue.join()
+
+    def has_nonpersistent_task(self):
+        return any(cluster_queue.has_nonpersistent_task()
+                   for _, cluster_queue in self.clusters.values())
+
+
+class RoutingSender(object):
+    def __init__(self, pending_logs, exception_handler):
+        self.pending_logs = pending_logs
+        self.senders = [queue_sender.Sender(log_transport, cluster_queue,
+                                            exception_handler)
+                        for log_transport, cluster_queue
+                        in pending_logs.clusters.values()]
+
+    @property
+    def stats(self):
+        total = collections.Counter(self.pending_logs.stats)
+        for sender in self.senders:
+            total.update(sender.stats)
+        # transport of the default cluster is reported by the server
+        for name, (log_transport, _) in self.pending_logs.clusters.items():
+            if name != DEFAULT_CLUSTER:
+                total.update(log_transport.stats)
+        return total
+
+    def as_thread(self):
+        sender = threading.Thread(target=self.send)
+        sender.daemon = True
+        return sender
+
+    def send(self):
+        threads = [sender.as_thread() for sender in self.senders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def finish(self, timeout):
+        deadline = time.monotonic() + timeout
+        return all([sender.finish(max(deadline - time.monotonic(), 0))
+                    for sender in self.senders])
@@ -0,0 +1,74 @@
+import collections
+import os
+import socket
+import threading
+import time
+
+PROC_NET_UDP = ['/proc/net/udp', '/proc/net/udp6']
+
+UdpSocketInfo = collections.namedtuple(
+    'UdpSocketInfo', ['port', 'inode', 'receive_queue', 'drops'])
+
+
+def read_udp_sockets():
+    for path in PROC_NET_UDP:
+        try:
+            with open(path) as proc_file:
+                lines = proc_file.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            yield UdpSocketInfo(
+                port=int(fields[1].rsplit(':', 1)[1], 16),
+                inode=int(fields[9]),
+                receive_queue=int(fields[4].split(':')[1], 16),
+                drops=int(fields[12]))
+
+
+def read_udp_drops(port=None, inode=None):
+    drops = 0
+    for info in read_udp_sockets():
+        if port is not None and info.port != port:
+            continue
+        if inode is not None and info.inode != inode:
+            continue
+        drops += info.drops
+    return drops
+
+
+def set_receive_buffer(sock, size):
+    # SO_RCVBUFFORCE ignores net.core.rmem_max but needs CAP_NET_ADMIN
+    option = getattr(socket, 'SO_RCVBUFFORCE', socket.SO_RCVBUF)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+    except PermissionError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+
+class DropMonitor(object):
+    def __init__(self, sock, interval=5.0):
+        self.inode = os.fstat(sock.fileno()).st_ino
+        self.interval = interval
+        self.stats = collections.Counter()
+        self._initial_drops = None
+
+    def as_thread(self):
+        monitor = threading.Thread(target=self.run)
+        monitor.daemon = True
+        return monitor
+
+    def run(self):
+        while True:
+            self.update()
+            time.sleep(self.interval)
+
+    def update(self):
+        for info in read_udp_sockets():
+            if info.inode == self.inode:
+                if self._initial_drops is None:
+                    self._initial_drops = info.drops
+                self.stats['kernel_drops'] = info.drops - self._initial_drops
+                self.stats['receive_queue_bytes'] = info.receive_queue
+                return
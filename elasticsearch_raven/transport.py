@@ -11,15 +11,70 @@ import sys
 import time
 import zlib
 
-import elasticsearch
-
+from elasticsearch_raven import cache
 from elasticsearch_raven import configuration
 from elasticsearch_raven import exceptions
+from elasticsearch_raven import profiling
+from elasticsearch_raven.postfix import Limits
 from elasticsearch_raven.postfix import postfix_encoded_data
 
 
-class SentryMessage(collections.namedtuple('SentryMessage',
-                                           ['headers', 'body'])):
+SHARED_HEADERS_LIMIT = 1024
+HEADERS_LIMIT = 1024
+COMPRESSED_ENCODINGS = frozenset(['gzip', 'x-gzip', 'deflate'])
+# json is sent uncompressed, zlib and gzip streams are told apart by their
+# headers
+JSON_START = re.compile(br'\s*\{')
+ZLIB_OR_GZIP = 32 + zlib.MAX_WBITS
+# digest, message id, tuples and ordered dict entry of a cached document
+CACHE_ENTRY_OVERHEAD = 340
+_shared_headers = {}
+
+
+def shared_headers(headers):
+    try:
+        key = headers['sentry_key'], headers['sentry_secret']
+    except (KeyError, TypeError):
+        return headers
+    try:
+        return _shared_headers[key]
+    except KeyError:
+        pass
+    if len(_shared_headers) >= SHARED_HEADERS_LIMIT:
+        return headers
+    headers = {'sentry_key': sys.intern(key[0]),
+               'sentry_secret': sys.intern(key[1])}
+    return _shared_headers.setdefault(key, headers)
+
+
+class SentryMessage(object):
+    # received is when the proxy got the message, enqueued when it was put
+    # into the queue it was last taken from, both are unix timestamps
+    __slots__ = ('headers', 'body', 'received', 'enqueued')
+
+    def __init__(self, headers, body, received=None, enqueued=None):
+        self.headers = headers
+        self.body = body
+        self.received = received
+        self.enqueued = enqueued
+
+    def __eq__(self, other):
+        if not isinstance(other, SentryMessage):
+            return NotImplemented
+        return self.headers == other.headers and self.body == other.body
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'SentryMessage(headers={!r}, body={!r})'.format(self.headers,
+                                                               self.body)
+
     @classmethod
     def create_from_udp(cls, data):
         try:
@@ -28,50 +83,331 @@ class SentryMessage(collections.namedtuple('SentryMessage',
             raise exceptions.DamagedSentryMessageError
         headers = cls.parse_headers(str(byte_headers.decode('utf-8')))
         data = base64.b64decode(data)
-        return cls(headers, data)
+        return cls(headers, data, time.time())
+
+    @classmethod
+    def create_from_view(cls, view, received=None):
+        # headers are short, only they are copied out of the view
+        separator = bytes(view[:HEADERS_LIMIT]).find(b'\n\n')
+        if separator < 0:
+            raise exceptions.DamagedSentryMessageError
+        headers = cls.parse_headers(bytes(view[:separator]).decode('utf-8'))
+        return cls(headers, base64.b64decode(view[separator + 2:]), received)
 
     @classmethod
-    def create_from_http(cls, raw_headers, data):
+    def create_from_http(cls, raw_headers, data, content_encoding=None):
         headers = cls.parse_headers(raw_headers)
-        data = base64.b64decode(data)
-        return cls(headers, data)
+        received = time.time()
+        content_encoding = (content_encoding or 'identity').lower()
+        if content_encoding in COMPRESSED_ENCODINGS:
+            return cls(headers, data, received)
+        if content_encoding != 'identity':
+            raise exceptions.DamagedSentryMessageBodyError
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not JSON_START.match(data):
+            data = base64.b64decode(data)
+        return cls(headers, data, received)
 
     @staticmethod
     def parse_headers(raw_headers):
         match = re.search(r'sentry_key=(?P<sentry_key>[^, =]+), sentry_secret='
                           r'(?P<sentry_secret>[^, =]+)$', raw_headers)
         if match:
-            return match.groupdict()
+            return shared_headers(match.groupdict())
         else:
             raise exceptions.BadSentryMessageHeaderError
 
     def decode_body(self):
-        try:
-            return json.loads(zlib.decompress(self.body).decode('utf-8'))
-        except (zlib.error, ValueError):
+        return decode_json(decompress(self.body))
+
+
+def decompress(body, max_size=None):
+    if max_size is None:
+        max_size = configuration['max_decompressed_size']
+    if JSON_START.match(body):
+        if max_size and len(body) > max_size:
             raise exceptions.DamagedSentryMessageBodyError
+        return body
+    # output is limited, so a small body inflating to gigabytes is stopped
+    # after max_size bytes
+    decompressor = zlib.decompressobj(ZLIB_OR_GZIP)
+    try:
+        data = decompressor.decompress(body, max_size + 1 if max_size else 0)
+    except zlib.error:
+        raise exceptions.DamagedSentryMessageBodyError
+    if max_size and len(data) > max_size:
+        raise exceptions.DamagedSentryMessageBodyError
+    if not decompressor.eof:
+        # truncated stream
+        raise exceptions.DamagedSentryMessageBodyError
+    return data
+
+
+def decompress_prefix(body, size):
+    # only the start of the document is inflated, for picking fields that
+    # clients put on top
+    if JSON_START.match(body):
+        return body[:size]
+    try:
+        return zlib.decompressobj(ZLIB_OR_GZIP).decompress(body, size)
+    except zlib.error:
+        raise exceptions.DamagedSentryMessageBodyError
+
+
+def decode_json(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        raise exceptions.DamagedSentryMessageBodyError
+
+
+PROJECT_PATTERN = re.compile(br'"project"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+STRING_PATTERN = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"')
+# everything but brackets, strings are taken whole so escaped quotes and
+# brackets in them are never counted
+SKIP_PATTERN = re.compile(br'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+
+
+def top_level_value(data, pattern):
+    # the document is not parsed, it is scanned once up to every match
+    # counting brackets outside of strings, a match in the top level object
+    # is taken, so keys with the same name in extra or tags are skipped
+    position = 0
+    depth = 0
+    for match in pattern.finditer(data):
+        start = match.start()
+        while position < start:
+            position = SKIP_PATTERN.match(data, position, start).end()
+            if position == start:
+                break
+            char = data[position:position + 1]
+            if char == b'"':
+                # string goes on past the match, the match is inside of it
+                string = STRING_PATTERN.match(data, position)
+                position = string.end() if string else len(data)
+            else:
+                depth += 1 if char in b'{[' else -1
+                position += 1
+        if position == start and depth == 1:
+            return match.group(1)
+    return None
+
+
+def extract_project(data):
+    value = top_level_value(data, PROJECT_PATTERN)
+    if value is not None:
+        try:
+            return json.loads(value.decode('utf-8'))
+        except ValueError:
+            pass
+    return None
 
 
-def get_configured_log_transport():
-    return LogTransport(configuration['host'],
-                        use_ssl=configuration['use_ssl'],
-                        http_auth=configuration['http_auth'])
+LEVEL_PATTERN = re.compile(br'"level"\s*:\s*("(?:[^"\\]|\\.)*"|\d+)')
+LEVEL_NAMES = {50: 'fatal', 40: 'error', 30: 'warning', 20: 'info',
+               10: 'debug'}
 
 
-class LogTransport:
+def extract_level(data):
+    # raven-python sends numeric logging levels
+    value = top_level_value(data, LEVEL_PATTERN)
+    if value is not None:
+        try:
+            level = json.loads(value.decode('utf-8'))
+        except ValueError:
+            return None
+        if isinstance(level, int):
+            return LEVEL_NAMES.get(level)
+        return level.lower()
+    return None
+
+
+def get_configured_log_transport(host=None, output_directory=None):
+    if output_directory:
+        from elasticsearch_raven import file_sink
+        log_transport = file_sink.get_configured_file_transport(
+            output_directory)
+    else:
+        log_transport = LogTransport(host or configuration['host'],
+                                     use_ssl=configuration['use_ssl'],
+                                     http_auth=configuration['http_auth'],
+                                     compression_level=configuration[
+                                         'compression_level'])
+    postfix_limits = Limits(max_depth=configuration['postfix_max_depth'],
+                            max_string=configuration['postfix_max_string'],
+                            max_list=configuration['postfix_max_list'],
+                            max_fields=configuration['postfix_max_fields'],
+                            max_size=configuration['postfix_max_size'])
+    if postfix_limits:
+        log_transport.postfix_limits = postfix_limits
+    if configuration['passthrough_projects']:
+        log_transport.passthrough_projects = frozenset(
+            configuration['passthrough_projects'])
+    if configuration['ingest_lag_field']:
+        log_transport.lag_field = configuration['ingest_lag_field']
+    if configuration['document_cache_size']:
+        log_transport.document_cache = cache.LruCache(
+            configuration['document_cache_size'])
+    if configuration['index_lookahead'] and not output_directory:
+        from elasticsearch_raven import indices
+        scheduler = indices.IndexScheduler(
+            log_transport, configuration['index_lookahead'],
+            max_projects=configuration['index_lookahead_projects'],
+            expiry=configuration['index_lookahead_expiry'])
+        scheduler.as_thread().start()
+        log_transport.index_scheduler = scheduler
+    return log_transport
+
+
+class DocumentTransport(object):
+    # turns messages into documents and bulk lines, subclasses decide where
+    # they are sent
     DOCUMENT_TYPE = 'raven-log'
 
-    def __init__(self, host, use_ssl=False, http_auth=None):
+    def __init__(self):
+        self.index_scheduler = None
+        self.postfix_limits = None
+        self.passthrough_projects = frozenset()
+        self.lag_field = None
+        self.document_cache = None
+        self.timer = profiling.timer
+
+    @property
+    def stats(self):
+        if self.document_cache is None:
+            return collections.Counter()
+        return self.document_cache.stats
+
+    def bulk_lines(self, messages):
+        lines = []
+        for message in messages:
+            index, message_id, document = self.prepare(message)
+            if isinstance(document, bytes):
+                try:
+                    document = document.decode('utf-8')
+                except ValueError:
+                    raise exceptions.DamagedSentryMessageBodyError
+            else:
+                document = json.dumps(document)
+            lines.append(self._bulk_action(index, message_id))
+            lines.append(document)
+        return lines
+
+    def prepare(self, message):
+        if self.document_cache is None:
+            project, message_id, document = self._prepare(message)
+        else:
+            project, message_id, document = self._prepare_cached(message)
+        if (self.lag_field and message.received is not None and
+                not isinstance(document, bytes)):
+            # added after hashing, so a redelivered message keeps its id
+            document[self.lag_field] = round(
+                max(time.time() - message.received, 0), 3)
+        return self._get_index(project), message_id, document
+
+    def _prepare_cached(self, message):
+        # clients retrying send the same bytes again, the whole decoding is
+        # skipped for them, documents are kept serialized, so the cache is
+        # charged for the bytes it really holds
+        key = cache.body_key(message.body)
+        cached = self.document_cache.get(key)
+        if cached is None:
+            with self.timer.stage('decompress'):
+                raw_body = decompress(message.body)
+            project, message_id, document = self._prepare_raw(raw_body)
+            passthrough = isinstance(document, bytes)
+            if passthrough:
+                serialized = document
+            else:
+                serialized = json.dumps(document).encode('utf-8')
+            self.document_cache.put(
+                key, (project, message_id, serialized, passthrough),
+                sys.getsizeof(serialized) + CACHE_ENTRY_OVERHEAD)
+            return project, message_id, document
+        project, message_id, serialized, passthrough = cached
+        if self.lag_field and not passthrough:
+            # serialized documents are sent as they are, unless they need
+            # the lag field
+            return project, message_id, json.loads(serialized)
+        return project, message_id, serialized
+
+    def _prepare(self, message):
+        if self.passthrough_projects:
+            with self.timer.stage('decompress'):
+                raw_body = decompress(message.body)
+            return self._prepare_raw(raw_body)
+        with self.timer.stage('decode_body'):
+            message_body = message.decode_body()
+        return self._prepare_document(message_body)
+
+    def _prepare_raw(self, raw_body):
+        if self.passthrough_projects:
+            project = extract_project(raw_body)
+            # bulk body is newline delimited, pretty printed documents have
+            # to be parsed and serialized again
+            if project in self.passthrough_projects and b'\n' not in raw_body:
+                return project, hash_raw(raw_body), raw_body
+        with self.timer.stage('decode_body'):
+            message_body = decode_json(raw_body)
+        return self._prepare_document(message_body)
+
+    def _prepare_document(self, message_body):
+        with self.timer.stage('postfix'):
+            postfix_encoded_data(message_body, self.postfix_limits)
+        with self.timer.stage('hash_dict'):
+            message_id = hash_dict(message_body)
+        return message_body['project'], message_id, message_body
+
+    def _get_index(self, project):
+        if self.index_scheduler is not None:
+            self.index_scheduler.add_project(project)
+        return project.format(datetime.datetime.now())
+
+    def _bulk_action(self, index, message_id):
+        return json.dumps({'index': {'_index': index,
+                                     '_type': self.DOCUMENT_TYPE,
+                                     '_id': message_id}})
+
+    def close(self):
+        pass
+
+
+class LogTransport(DocumentTransport):
+    def __init__(self, host, use_ssl=False, http_auth=None,
+                 compression_level=0):
+        DocumentTransport.__init__(self)
+        # elasticsearch client is imported only when it is used, processes
+        # that just receive messages start without loading it
+        import elasticsearch
+        from elasticsearch_raven import connection
+        kwargs = {}
+        if compression_level:
+            kwargs['connection_class'] = connection.CompressedHttpConnection
+            kwargs['compression_level'] = compression_level
         self._connection = elasticsearch.Elasticsearch(hosts=[host],
                                                        http_auth=http_auth,
-                                                       use_ssl=use_ssl)
+                                                       use_ssl=use_ssl,
+                                                       **kwargs)
 
     def send_message(self, message):
-        message_body = message.decode_body()
-        postfix_encoded_data(message_body)
-        message_id = hash_dict(message_body)
-        index = message_body['project'].format(datetime.datetime.now())
-        self.send(message_body, index, message_id)
+        index, message_id, document = self.prepare(message)
+        if isinstance(document, bytes):
+            with self.timer.stage('send_raw'):
+                self.send_raw(document, index, message_id)
+        else:
+            with self.timer.stage('index'):
+                self.send(document, index, message_id)
+
+    def send_messages(self, messages):
+        # one bulk request for all messages, errors of single documents are
+        # returned in order instead of raised
+        lines = self.bulk_lines(messages)
+        with self.timer.stage('bulk'), logger_level_to_error('elasticsearch'):
+            response = self._connection.bulk(body='\n'.join(lines) + '\n')
+        return [bulk_item_error(item) for item in response['items']]
 
     def send(self, body, index, message_id):
         with logger_level_to_error('elasticsearch'):
@@ -79,6 +415,20 @@ class LogTransport:
                                    id=message_id,
                                    doc_type=self.DOCUMENT_TYPE)
 
+    def send_raw(self, raw_body, index, message_id):
+        try:
+            document = raw_body.decode('utf-8')
+        except ValueError:
+            raise exceptions.DamagedSentryMessageBodyError
+        action = self._bulk_action(index, message_id)
+        with logger_level_to_error('elasticsearch'):
+            response = self._connection.bulk(
+                body=action + '\n' + document + '\n')
+        for item in response['items']:
+            error = bulk_item_error(item)
+            if error is not None:
+                raise error
+
     def search(self, segment_size=1000, **kwargs):
         for offset in itertools.count(step=segment_size):
             response = self._connection.search(doc_type=self.DOCUMENT_TYPE,
@@ -93,6 +443,23 @@ class LogTransport:
     def delete(self, index, record_id):
         self._connection.delete(index, self.DOCUMENT_TYPE, record_id)
 
+    def create_index(self, index):
+        with logger_level_to_error('elasticsearch'):
+            # 400 means that the index already exists
+            self._connection.indices.create(index=index, ignore=400)
+
+    def put_template(self, name, body):
+        self._connection.indices.put_template(name=name, body=body)
+
+
+def bulk_item_error(item):
+    import elasticsearch
+    result = item['index']
+    if 'error' in result:
+        return elasticsearch.exceptions.TransportError(
+            result.get('status', 'N/A'), result['error'])
+    return None
+
 
 def hash_dict(dictionary):
     message_json = json.dumps(
@@ -103,6 +470,10 @@ def hash_dict(dictionary):
     return sha1.hexdigest()
 
 
+def hash_raw(data):
+    return hashlib.sha1(data).hexdigest()
+
+
 def retry_loop(timeout, delay, back_off=1.0):
     start_time = time.time()
     exceptions = []
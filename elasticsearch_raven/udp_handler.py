@@ -1,11 +1,116 @@
+import collections
 import datetime
+import random
+import socket
 import sys
-import signal
 import threading
+import time
 
+from elasticsearch_raven import configuration
+from elasticsearch_raven import profiling
+from elasticsearch_raven import sockets
 from elasticsearch_raven import transport
 from elasticsearch_raven import utils
 
+# sockets are read with this timeout, so handlers notice should_finish
+# without a signal interrupting them in the middle of a message
+RECEIVE_TIMEOUT = 0.5
+ACCESS_LOG_FLUSH_INTERVAL = 1.0
+
+
+def set_receive_buffer(sock, size):
+    actual = sockets.set_receive_buffer(sock, size)
+    if actual < size:
+        sys.stdout.write('Receive buffer limited to {} bytes, raise '
+                         'net.core.rmem_max or grant CAP_NET_ADMIN.\n'
+                         .format(actual))
+
+
+def start_stats_reporter(sock, sources):
+    monitor = sockets.DropMonitor(sock, configuration['stats_interval'])
+    monitor.as_thread().start()
+    utils.StatsReporter(sys.stdout, sources + [monitor],
+                        configuration['stats_interval']).as_thread().start()
+
+
+def get_configured_access_log():
+    return AccessLog(sys.stdout,
+                     sample_rate=configuration['debug_sample_rate'],
+                     aggregate_interval=configuration[
+                         'debug_aggregate_interval'],
+                     max_lines=configuration['debug_max_lines'])
+
+
+class AccessLog(object):
+    # receiving threads only append to memory, lines are formatted and
+    # written by a separate thread, so a slow stdout costs dropped lines
+    # instead of dropped datagrams
+    def __init__(self, stream, sample_rate=1.0, aggregate_interval=0.0,
+                 max_lines=10000):
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.aggregate_interval = aggregate_interval
+        self.max_lines = max_lines
+        self._lines = collections.deque()
+        self._counts = collections.Counter()
+        self._counts_since = time.time()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._dropped = 0
+
+    def as_thread(self):
+        writer = threading.Thread(target=self.run)
+        writer.daemon = True
+        return writer
+
+    def run(self):
+        while True:
+            time.sleep(self.aggregate_interval or ACCESS_LOG_FLUSH_INTERVAL)
+            self.flush()
+
+    def record(self, address):
+        if self.aggregate_interval:
+            with self._lock:
+                # sources are counted up to max_lines of them too
+                if (address in self._counts or
+                        len(self._counts) < self.max_lines):
+                    self._counts[address] += 1
+                else:
+                    self._dropped += 1
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if len(self._lines) < self.max_lines:
+            self._lines.append((address, time.time()))
+        else:
+            with self._lock:
+                self._dropped += 1
+
+    def flush(self):
+        with self._write_lock:
+            lines = []
+            while self._lines:
+                address, received = self._lines.popleft()
+                lines.append('{host}:{port} [{date}]\n'.format(
+                    host=address[0], port=address[1],
+                    date=datetime.datetime.fromtimestamp(received)))
+            with self._lock:
+                counts, self._counts = self._counts, collections.Counter()
+                dropped, self._dropped = self._dropped, 0
+            since, self._counts_since = self._counts_since, time.time()
+            date = datetime.datetime.fromtimestamp(since)
+            for address, count in sorted(counts.items()):
+                lines.append('{host}:{port} [{date}] {count} packets\n'
+                             .format(host=address[0], port=address[1],
+                                     date=date, count=count))
+            if dropped:
+                lines.append('[{date}] {count} access log entries dropped\n'
+                             .format(date=datetime.datetime.now(),
+                                     count=dropped))
+            if lines:
+                self.stream.write(''.join(lines))
+                self.stream.flush()
+
 
 class Handler(object):
     def __init__(self, sock, pending_logs, exception_handler, debug=False):
@@ -13,7 +118,10 @@ class Handler(object):
         self.pending_logs = pending_logs
         self.exception_handler = exception_handler
         self.debug = debug
+        self.access_log = get_configured_access_log() if debug else None
         self.should_finish = False
+        self.stats = collections.Counter()
+        self.timer = profiling.timer
 
     def as_thread(self):
         handler = threading.Thread(target=self.handle)
@@ -21,18 +129,55 @@ class Handler(object):
         return handler
 
     def handle(self):
+        if self.access_log is not None:
+            self.access_log.as_thread().start()
         try:
             try:
-                while True:
-                    data, address = self.sock.recvfrom(65535)
-                    with utils.ignore_signals([signal.SIGTERM, signal.SIGQUIT]):
-                        message = transport.SentryMessage.create_from_udp(data)
+                while not self.should_finish:
+                    try:
+                        with self.timer.stage('recv'):
+                            data, address = self.sock.recvfrom(65535)
+                    except socket.timeout:
+                        continue
+                    self.stats['received'] += 1
+                    with self.timer.stage('create_from_udp'):
+                        message = transport.SentryMessage.create_from_udp(
+                            data)
+                    with self.timer.stage('queue_put'):
                         self.pending_logs.put(message)
-                    if self.debug:
-                        sys.stdout.write('{host}:{port} [{date}]\n'.format(
-                            host=address[0], port=address[1],
-                            date=datetime.datetime.now()))
+                    if self.access_log is not None:
+                        self.access_log.record(address)
             finally:
                 self.sock.close()
+                if self.access_log is not None:
+                    self.access_log.flush()
         except Exception as e:
             self.exception_handler(e)
+
+
+class RawHandler(object):
+    def __init__(self, sock, ring, debug=False):
+        self.sock = sock
+        self.ring = ring
+        self.debug = debug
+        self.access_log = get_configured_access_log() if debug else None
+        self.should_finish = False
+        self.timer = profiling.timer
+
+    def handle(self):
+        if self.access_log is not None:
+            self.access_log.as_thread().start()
+        try:
+            while not self.should_finish:
+                try:
+                    with self.timer.stage('recv'):
+                        address = self.ring.receive(self.sock)
+                except socket.timeout:
+                    continue
+                if self.access_log is not None:
+                    self.access_log.record(address)
+        finally:
+            self.ring.close()
+            self.sock.close()
+            if self.access_log is not None:
+                self.access_log.flush()
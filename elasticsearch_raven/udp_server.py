@@ -1,7 +1,12 @@
 import argparse
+import multiprocessing
+import os
 import socket
 import sys
 import signal
+import time
+
+from multiprocessing import connection
 
 try:
     import queue
@@ -9,9 +14,13 @@ except ImportError:
     import Queue as queue
 
 from elasticsearch_raven import configuration
+from elasticsearch_raven import lanes
+from elasticsearch_raven import profiling
 from elasticsearch_raven import transport
 from elasticsearch_raven import queue_sender
 from elasticsearch_raven import queues
+from elasticsearch_raven import ring
+from elasticsearch_raven import routing
 from elasticsearch_raven import udp_handler
 
 
@@ -23,13 +32,22 @@ def run_server():
         sys.stdout.write('Wrong hostname.\n')
         sys.exit(1)
     else:
-        log_transport = transport.get_configured_log_transport()
+        if args.ring_buffer:
+            RingServer(sock, ring.SharedRing(args.ring_buffer), args.senders,
+                       args.debug, args.output_directory).run()
+            return
+        profiling.configure()
+        log_transport = transport.get_configured_log_transport(
+            output_directory=args.output_directory)
         if args.amqp_queue:
-            pending_logs = queues.KombuQueue(configuration['amqp_url'],
-                                             configuration['amqp_queue'])
+            pending_logs = queues.open_queue(
+                queues.KombuQueue, configuration['amqp_url'],
+                configuration['amqp_queue'],
+                lanes.get_configured_classifier())
         else:
-            pending_logs = queues.ThreadingQueue(
-                configuration['queue_maxsize'])
+            pending_logs = routing.route_queue(
+                queues.get_configured_queue(), log_transport,
+                queues.get_configured_queue)
         Server(sock, pending_logs, log_transport,
                args.debug).run()
 
@@ -44,15 +62,33 @@ def _parse_args():
     parser.add_argument(
         '--amqp-queue', action='store_const', const=True, default=False,
         help='Use amqp queue to store logs to send to elasticsearch.')
+    parser.add_argument(
+        '--ring-buffer', type=int, default=0, metavar='BYTES',
+        help='Receive in a separate process and pass datagrams to sender '
+             'processes through shared memory ring buffer of that size.')
+    parser.add_argument('--senders', type=int, default=1,
+                        help='Number of sender processes reading the ring '
+                             'buffer')
+    parser.add_argument(
+        '--output-directory', metavar='DIR',
+        help='Write documents to rotating bulk files in this directory '
+             'instead of sending them to elasticsearch.')
     return parser.parse_args()
 
 
 def get_socket(ip, port):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if configuration['udp_receive_buffer']:
+        udp_handler.set_receive_buffer(sock,
+                                       configuration['udp_receive_buffer'])
     sock.bind((ip, int(port)))
+    sock.settimeout(udp_handler.RECEIVE_TIMEOUT)
     return sock
 
 
+DRAIN_TIMEOUT = 30.0
+
+
 class Server(object):
     def __init__(self, sock, pending_logs, log_transport, debug=False):
         self.sock = sock
@@ -65,10 +101,14 @@ class Server(object):
         handler = udp_handler.Handler(
             self.sock, self.pending_logs, self.thread_exception_handler,
             debug=self.debug)
-        sender = queue_sender.Sender(self.log_transport, self.pending_logs,
-                                     self.thread_exception_handler)
-        handler.as_thread().start()
+        sender = routing.create_sender(self.log_transport, self.pending_logs,
+                                       self.thread_exception_handler)
+        handler_thread = handler.as_thread()
+        handler_thread.start()
         sender.as_thread().start()
+        if configuration['stats_interval']:
+            udp_handler.start_stats_reporter(
+                self.sock, [handler, sender, self.log_transport])
 
         def terminate(signum, frame):
             self.exception_queue.put(KeyboardInterrupt())
@@ -78,9 +118,14 @@ class Server(object):
         try:
             raise self.exception_queue.get()
         except KeyboardInterrupt:
+            # handler stops between messages, then queued messages are sent
+            # until the deadline or a second signal
+            deadline = time.monotonic() + DRAIN_TIMEOUT
             handler.should_finish = True
+            handler_thread.join(udp_handler.RECEIVE_TIMEOUT * 2)
             try:
-                while self.pending_logs.has_nonpersistent_task():
+                while (self.pending_logs.has_nonpersistent_task() and
+                       time.monotonic() < deadline):
                     try:
                         raise self.exception_queue.get(timeout=1)
                     except queue.Empty:
@@ -90,3 +135,98 @@ class Server(object):
 
     def thread_exception_handler(self, exception):
         self.exception_queue.put(exception)
+
+
+class RingServer(object):
+    def __init__(self, sock, ring, senders=1, debug=False,
+                 output_directory=None):
+        self.sock = sock
+        self.ring = ring
+        self.senders = senders
+        self.debug = debug
+        self.output_directory = output_directory
+        self.should_finish = False
+        self.killed = False
+
+    def run(self):
+        context = multiprocessing.get_context('fork')
+        receiver = context.Process(target=self._receive)
+        workers = [context.Process(target=self._send)
+                   for _ in range(self.senders)]
+        for process in [receiver] + workers:
+            process.start()
+        if configuration['stats_interval']:
+            udp_handler.start_stats_reporter(self.sock, [self.ring])
+
+        def terminate(signum, frame):
+            self.killed = self.should_finish
+            self.should_finish = True
+        for signum in [signal.SIGTERM, signal.SIGQUIT, signal.SIGINT]:
+            signal.signal(signum, terminate)
+        try:
+            failed = self._wait(receiver, workers)
+        finally:
+            self.ring.unlink()
+        if failed:
+            sys.exit(1)
+
+    def _wait(self, receiver, workers):
+        processes = [receiver] + workers
+        while not self.should_finish:
+            connection.wait([process.sentinel for process in processes], 1.0)
+            if any(process.exitcode is not None for process in processes):
+                break
+        # shutdown handshake: receiver closes the ring when it stops, senders
+        # exit once the ring is closed and every record is sent
+        if receiver.exitcode is None:
+            os.kill(receiver.pid, signal.SIGTERM)
+        receiver.join()
+        self.ring.close()
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        for worker in workers:
+            while (worker.exitcode is None and not self.killed and
+                   time.monotonic() < deadline):
+                worker.join(0.1)
+            if worker.exitcode is None:
+                # workers ignore SIGTERM, a sender stuck retrying has to be
+                # killed
+                worker.kill()
+                worker.join()
+        return any(process.exitcode for process in processes)
+
+    def _receive(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+        handler = udp_handler.RawHandler(self.sock, self.ring, self.debug)
+
+        def terminate(signum, frame):
+            handler.should_finish = True
+        signal.signal(signal.SIGTERM, terminate)
+        profiling.configure()
+        handler.handle()
+
+    def _send(self):
+        for signum in [signal.SIGTERM, signal.SIGQUIT, signal.SIGINT]:
+            signal.signal(signum, signal.SIG_IGN)
+        supervisor = os.getppid()
+        profiling.configure()
+        exception_queue = queue.Queue()
+        pending_logs = ring.RingQueue(self.ring)
+        log_transport = transport.get_configured_log_transport(
+            output_directory=self.output_directory)
+        queue_sender.Sender(log_transport, pending_logs, exception_queue.put
+                            ).as_thread().start()
+        # forked processes exit without running atexit handlers
+        try:
+            while pending_logs.has_nonpersistent_task():
+                try:
+                    exception = exception_queue.get(timeout=1)
+                except queue.Empty:
+                    if os.getppid() != supervisor:
+                        sys.exit(1)
+                else:
+                    if isinstance(exception, ring.Closed):
+                        return
+                    raise exception
+        finally:
+            log_transport.close()
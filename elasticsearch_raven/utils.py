@@ -1,6 +1,9 @@
-import contextlib
+import collections
+import json
+import os
 import time
 import signal
+import threading
 
 
 def retry_loop(delay, *, max_delay=None, back_off=1.0):
@@ -28,8 +31,47 @@ def retry_loop(delay, *, max_delay=None, back_off=1.0):
         yield retry
 
 
-@contextlib.contextmanager
-def ignore_signals(signals):
-    signal.pthread_sigmask(signal.SIG_BLOCK, signals)
-    yield
-    signal.pthread_sigmask(signal.SIG_UNBLOCK, signals)
+LATENCY_BUCKETS = (0.01, 0.1, 1.0, 10.0, 60.0, 600.0)
+
+
+def record_latency(stats, name, seconds):
+    # buckets are separate counters, so histograms of many senders can be
+    # summed like the other stats
+    seconds = max(seconds, 0.0)
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            stats['{}_le_{:g}'.format(name, bound)] += 1
+            break
+    else:
+        stats['{}_le_inf'.format(name)] += 1
+    stats['{}_sum'.format(name)] += seconds
+
+
+class StatsReporter(object):
+    def __init__(self, stats_file, sources, interval=5.0):
+        self.stats_file = stats_file
+        self.sources = sources
+        self.interval = interval
+
+    def as_thread(self):
+        reporter = threading.Thread(target=self.run)
+        reporter.daemon = True
+        return reporter
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.report()
+            except BrokenPipeError:
+                # nobody reads the stats anymore, drain and exit like on
+                # SIGTERM
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+    def report(self):
+        total = collections.Counter()
+        for source in self.sources:
+            total.update(source.stats)
+        self.stats_file.write(json.dumps(dict(total)) + '\n')
+        self.stats_file.flush()
@@ -8,10 +8,12 @@ setup(
     url='https://github.com/pozytywnie/elasticsearch-raven/',
     packages=['elasticsearch_raven'],
     scripts=['bin/elasticsearch-raven.py', 'bin/update_ids.py',
-             'bin/udp_to_amqp.py', 'bin/amqp_to_elasticsearch.py'],
+             'bin/udp_to_amqp.py', 'bin/amqp_to_elasticsearch.py',
+             'bin/load_generator.py', 'bin/elasticsearch-raven-http.py'],
     license='MIT',
     description='Proxy that allows to send logs from Raven to Elasticsearch.',
     long_description=open('README.rst').read(),
+    python_requires='>=3.8',
     install_requires=['elasticsearch', 'kombu'],
     test_suite='tests',
 )
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import amqp
+
+
+class GetShardsTest(TestCase):
+    @mock.patch.dict('elasticsearch_raven.amqp.configuration', {
+        'amqp_url': 'amqp://a', 'amqp_queue': 'logs', 'amqp_shards': 1,
+        'amqp_shard_urls': []})
+    def test_single(self):
+        self.assertEqual([('amqp://a', 'logs')], amqp.get_shards())
+
+    @mock.patch.dict('elasticsearch_raven.amqp.configuration', {
+        'amqp_url': 'amqp://a', 'amqp_queue': 'logs', 'amqp_shards': 3,
+        'amqp_shard_urls': ['amqp://b', 'amqp://c']})
+    def test_distributed(self):
+        self.assertEqual([('amqp://b', 'logs-0'), ('amqp://c', 'logs-1'),
+                          ('amqp://b', 'logs-2')], amqp.get_shards())
+
+
+class ParseSenderArgsTest(TestCase):
+    @mock.patch('argparse._sys')
+    def test_shards(self, sys):
+        sys.argv = ['test', '--shard', '1', '--shard', '3']
+        self.assertEqual([1, 3], amqp._parse_sender_args().shards)
+
+
+class RunSenderTest(TestCase):
+    @mock.patch('elasticsearch_raven.prefork.Supervisor')
+    @mock.patch('elasticsearch_raven.amqp.importlib')
+    @mock.patch('elasticsearch_raven.amqp.get_shards', mock.Mock())
+    @mock.patch('argparse._sys')
+    def test_prefork_preloads_clients(self, argparse_sys, importlib,
+                                      Supervisor):
+        argparse_sys.argv = ['test', '--processes', '2']
+        calls = mock.Mock()
+        calls.attach_mock(importlib.import_module, 'import_module')
+        calls.attach_mock(Supervisor, 'Supervisor')
+        amqp.run_sender()
+        self.assertEqual(
+            [mock.call.import_module(name)
+             for name in amqp.PRELOADED_MODULES] +
+            [mock.call.Supervisor(mock.ANY, 2, drain_timeout=30.0),
+             mock.call.Supervisor().run()], calls.mock_calls)
+
+
+class ImportTest(TestCase):
+    def test_handler_does_not_import_clients(self):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys; from elasticsearch_raven import amqp; '
+            'print(sorted({"elasticsearch", "kombu"} & set(sys.modules)))'])
+        self.assertEqual(b'[]', output.strip())
@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from elasticsearch_raven import cache
+
+
+class LruCacheTest(TestCase):
+    def setUp(self):
+        self.cache = cache.LruCache(10)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get(b'a'))
+        self.cache.put(b'a', 'value', 5)
+        self.assertEqual('value', self.cache.get(b'a'))
+        self.assertEqual({'document_cache_hits': 1,
+                          'document_cache_misses': 1,
+                          'document_cache_entries': 1,
+                          'document_cache_bytes': 5}, self.cache.stats)
+
+    def test_evict_least_recently_used(self):
+        self.cache.put(b'a', 'a', 4)
+        self.cache.put(b'b', 'b', 4)
+        self.cache.get(b'a')
+        self.cache.put(b'c', 'c', 4)
+        self.assertIsNone(self.cache.get(b'b'))
+        self.assertEqual('a', self.cache.get(b'a'))
+        self.assertEqual('c', self.cache.get(b'c'))
+        self.assertEqual(8, self.cache.stats['document_cache_bytes'])
+
+    def test_replace(self):
+        self.cache.put(b'a', 'a', 4)
+        self.cache.put(b'a', 'b', 6)
+        self.assertEqual('b', self.cache.get(b'a'))
+        self.assertEqual(6, self.cache.stats['document_cache_bytes'])
+
+    def test_too_large(self):
+        self.cache.put(b'a', 'a', 11)
+        self.assertIsNone(self.cache.get(b'a'))
+        self.assertEqual(0, self.cache.stats['document_cache_bytes'])
+
+    def test_body_key(self):
+        self.assertEqual(cache.body_key(b'body'), cache.body_key(b'body'))
+        self.assertNotEqual(cache.body_key(b'body'), cache.body_key(b'other'))
@@ -0,0 +1,62 @@
+import gzip
+from unittest import TestCase
+from unittest import mock
+
+import elasticsearch
+
+from elasticsearch_raven import connection
+
+
+class CompressedHttpConnectionTest(TestCase):
+    def setUp(self):
+        self.connection = connection.CompressedHttpConnection(
+            compression_level=6)
+        self.connection.pool = mock.Mock(headers={'authorization': 'x'})
+        self.ok = mock.Mock(status=200, data=b'{}')
+        self.bad_request = mock.Mock(status=400, data=b'{}')
+
+    def test_compressed(self):
+        self.connection.pool.urlopen.return_value = self.ok
+        self.connection.perform_request('POST', '/index', body=b'body')
+        (method, url, body), kwargs = self.connection.pool.urlopen.call_args
+        self.assertEqual(b'body', gzip.decompress(body))
+        self.assertEqual({'authorization': 'x', 'content-encoding': 'gzip'},
+                         kwargs['headers'])
+        self.assertTrue(self.connection.compression_supported)
+
+    def test_no_body(self):
+        self.connection.pool.urlopen.return_value = self.ok
+        self.connection.perform_request('GET', '/')
+        self.assertEqual(mock.call('GET', '/', None),
+                         self.connection.pool.urlopen.call_args)
+        self.assertIsNone(self.connection.compression_supported)
+
+    def test_not_supported(self):
+        self.connection.pool.urlopen.side_effect = [self.bad_request, self.ok]
+        self.connection.perform_request('POST', '/index', body=b'body')
+        self.assertFalse(self.connection.compression_supported)
+        self.assertEqual(mock.call('POST', '/index', b'body'),
+                         self.connection.pool.urlopen.call_args)
+
+    def test_bad_request(self):
+        self.connection.pool.urlopen.return_value = self.bad_request
+        self.assertRaises(elasticsearch.exceptions.RequestError,
+                          self.connection.perform_request, 'POST', '/index',
+                          body=b'body')
+        self.assertIsNone(self.connection.compression_supported)
+
+    def test_throttled(self):
+        throttled = mock.Mock(status=429, data=b'{}')
+        self.connection.pool.urlopen.side_effect = [throttled, self.ok]
+        self.assertRaises(elasticsearch.exceptions.TransportError,
+                          self.connection.perform_request, 'POST', '/index',
+                          body=b'body')
+        self.assertIsNone(self.connection.compression_supported)
+        self.connection.perform_request('POST', '/index', body=b'body')
+        self.assertTrue(self.connection.compression_supported)
+
+    def test_stats(self):
+        self.connection.pool.urlopen.return_value = self.ok
+        self.connection.perform_request('POST', '/index', body=b'x' * 1000)
+        self.assertEqual(1000, self.connection.stats['body_bytes'])
+        self.assertLess(self.connection.stats['sent_bytes'], 100)
@@ -0,0 +1,50 @@
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import controller
+
+
+class AimdControllerTest(TestCase):
+    def setUp(self):
+        self.controller = controller.AimdController(4, 100, 1.0)
+
+    def test_additive_increase(self):
+        for _ in range(3):
+            self.assertFalse(self.controller.update(0.1))
+        self.assertEqual(2, self.controller.concurrency)
+        self.assertEqual(4, self.controller.batch_size)
+
+    def test_limits(self):
+        for _ in range(1000):
+            self.controller.update(0.1)
+        self.assertEqual(4, self.controller.concurrency)
+        self.assertEqual(100, self.controller.batch_size)
+
+    def test_multiplicative_decrease(self):
+        for _ in range(1000):
+            self.controller.update(0.1)
+        self.assertTrue(self.controller.update(0.1, rejected=True))
+        self.assertEqual(2, self.controller.concurrency)
+        self.assertEqual(50, self.controller.batch_size)
+        self.assertTrue(self.controller.update(2.0))
+        self.assertEqual(1, self.controller.concurrency)
+        self.assertEqual(25, self.controller.batch_size)
+
+    def test_minimum(self):
+        self.controller.update(2.0)
+        self.assertEqual(1, self.controller.concurrency)
+        self.assertEqual(1, self.controller.batch_size)
+
+    @mock.patch.dict('elasticsearch_raven.controller.configuration',
+                     send_max_concurrency=1, send_max_batch=1)
+    def test_disabled(self):
+        self.assertIsNone(controller.get_configured_controller())
+
+    @mock.patch.dict('elasticsearch_raven.controller.configuration',
+                     send_max_concurrency=8, send_max_batch=1,
+                     send_target_latency=0.5)
+    def test_configured(self):
+        result = controller.get_configured_controller()
+        self.assertEqual((8, 1, 0.5), (result.max_concurrency,
+                                       result.max_batch,
+                                       result.target_latency))
@@ -0,0 +1,115 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import file_sink
+from elasticsearch_raven import transport
+
+
+def message(i, project='index-{0:%Y}'):
+    return transport.SentryMessage({}, zlib.compress(
+        json.dumps({'project': project, 'i': i}).encode()))
+
+
+class FileTransportTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self, suffix=''):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(suffix))
+
+    def read(self, name):
+        with gzip.open(os.path.join(self.directory, name)) as f:
+            return [json.loads(line) for line in f.read().splitlines()]
+
+    def test_bulk_lines(self):
+        log_transport = file_sink.FileTransport(self.directory)
+        self.assertEqual([None, None], log_transport.send_messages(
+            [message(0), message(1)]))
+        log_transport.close()
+        [name] = self.files()
+        self.assertTrue(name.endswith('.ndjson.gz'))
+        lines = self.read(name)
+        self.assertEqual('raven-log', lines[0]['index']['_type'])
+        self.assertEqual(transport.hash_dict({'project': 'index-{0:%Y}',
+                                              'i': 0}),
+                         lines[0]['index']['_id'])
+        self.assertEqual([{'project': 'index-{0:%Y}', 'i': 0},
+                          {'project': 'index-{0:%Y}', 'i': 1}], lines[1::2])
+
+    def test_part_until_closed(self):
+        log_transport = file_sink.FileTransport(self.directory,
+                                                flush_interval=0)
+        log_transport.send_message(message(0))
+        [name] = self.files()
+        self.assertTrue(name.endswith(file_sink.PART_SUFFIX))
+        # flushed batches can be read before the file is finished
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            data = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(
+                f.read())
+        self.assertEqual(2, len(data.splitlines()))
+        log_transport.close()
+        self.assertEqual([], self.files(file_sink.PART_SUFFIX))
+
+    @mock.patch('elasticsearch_raven.file_sink.threading.Timer')
+    def test_flush_later(self, Timer):
+        log_transport = file_sink.FileTransport(self.directory)
+        log_transport.send_message(message(0))
+        log_transport.send_message(message(1))
+        [name] = self.files()
+        self.assertEqual(0, os.path.getsize(os.path.join(self.directory,
+                                                         name)))
+        self.assertEqual([mock.call(1.0, log_transport._flush),
+                          mock.call().start()], Timer.mock_calls)
+        log_transport._flush()
+        self.assertLess(0, os.path.getsize(os.path.join(self.directory,
+                                                        name)))
+        log_transport.close()
+
+    def test_rotate_by_size(self):
+        log_transport = file_sink.FileTransport(self.directory, max_bytes=1)
+        log_transport.send_messages([message(0), message(1)])
+        log_transport.send_message(message(2))
+        log_transport.close()
+        first, second = self.files()
+        self.assertEqual(4, len(self.read(first)))
+        self.assertEqual(2, len(self.read(second)))
+
+    @mock.patch('elasticsearch_raven.file_sink.time')
+    def test_rotate_by_age(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        log_transport = file_sink.FileTransport(self.directory, max_age=60)
+        log_transport.send_message(message(0))
+        time_mock.monotonic.return_value = 59
+        log_transport.send_message(message(1))
+        time_mock.monotonic.return_value = 60
+        log_transport.send_message(message(2))
+        log_transport.close()
+        self.assertEqual([4, 2], [len(self.read(name))
+                                  for name in self.files()])
+
+    def test_uncompressed(self):
+        log_transport = file_sink.FileTransport(self.directory,
+                                                compression='none')
+        log_transport.send_message(message(0))
+        log_transport.close()
+        [name] = self.files()
+        self.assertTrue(name.endswith('.ndjson'))
+
+    def test_unknown_compression(self):
+        self.assertRaises(ValueError, file_sink.FileTransport,
+                          self.directory, compression='lzma')
+
+    @mock.patch.dict('sys.modules', {'zstandard': None})
+    def test_zstd_missing(self):
+        self.assertRaises(ImportError, file_sink.FileTransport,
+                          self.directory, compression='zstd')
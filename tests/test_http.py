@@ -6,7 +6,7 @@ from elasticsearch_raven.http import HttpUtils
 
 class StartSenderTest(TestCase):
     @mock.patch('elasticsearch_raven.http.transport.LogTransport')
-    @mock.patch('elasticsearch_raven.http.Sender')
+    @mock.patch('elasticsearch_raven.queue_sender.Sender')
     def test_thread_start(self, Sender, LogTransport):
         utils = HttpUtils()
         utils.start_sender()
@@ -16,15 +16,16 @@ class StartSenderTest(TestCase):
                           mock.call().as_thread(),
                           mock.call().as_thread().start()], Sender.mock_calls)
 
-    @mock.patch.dict('elasticsearch_raven.http.configuration', {
+    @mock.patch.dict('elasticsearch_raven.configuration', {
         'host': 'test_host', 'use_ssl': True})
     @mock.patch('elasticsearch_raven.http.transport.LogTransport')
-    @mock.patch('elasticsearch_raven.http.Sender')
+    @mock.patch('elasticsearch_raven.queue_sender.Sender')
     def test_configuration(self, Sender, LogTransport):
         utils = HttpUtils()
         utils.start_sender()
         self.assertEqual([mock.call('test_host', http_auth=None,
-                                    use_ssl=True)], LogTransport.mock_calls)
+                                    use_ssl=True, compression_level=0)],
+                         LogTransport.mock_calls)
 
 
 class GetApplicationTest(TestCase):
@@ -56,7 +57,17 @@ class GetApplicationTest(TestCase):
         aplication(self.environ, self.start_response)
         self.assertEqual([mock.call.create_from_http(
             self.environ['HTTP_X_SENTRY_AUTH'],
-            self.environ['wsgi.input'].read())], SentryMessage.mock_calls)
+            self.environ['wsgi.input'].read(), content_encoding=None)],
+            SentryMessage.mock_calls)
+
+    @mock.patch('elasticsearch_raven.http.transport.SentryMessage')
+    def test_content_encoding(self, SentryMessage):
+        self.environ['HTTP_CONTENT_ENCODING'] = 'gzip'
+        utils = HttpUtils()
+        aplication = utils.get_application()
+        aplication(self.environ, self.start_response)
+        self.assertEqual('gzip', SentryMessage.create_from_http.call_args[1][
+            'content_encoding'])
 
     @mock.patch('elasticsearch_raven.http.transport.SentryMessage')
     def test_put_on_pedding_logs(self, SentryMessage):
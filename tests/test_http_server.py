@@ -0,0 +1,125 @@
+import asyncio
+import base64
+import gzip
+import zlib
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import http_server
+from elasticsearch_raven import queues
+from elasticsearch_raven.transport import SentryMessage
+
+BODY = base64.b64encode(zlib.compress(b'{"project": "test"}'))
+AUTH = b'X-Sentry-Auth: Sentry sentry_key=key, sentry_secret=secret\r\n'
+
+
+def post(body=BODY, headers=b''):
+    return (b'POST /api/1/store/ HTTP/1.1\r\n' + AUTH + headers +
+            'Content-Length: {}\r\n\r\n'.format(len(body)).encode('ascii') +
+            body)
+
+
+class FakeWriter(object):
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class HandleConnectionTest(TestCase):
+    def setUp(self):
+        self.pending_logs = queues.ThreadingQueue()
+        self.server = http_server.Server('127.0.0.1', 0, self.pending_logs,
+                                         mock.Mock())
+
+    def handle(self, data):
+        writer = FakeWriter()
+
+        async def handle():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            await self.server.handle_connection(reader, writer)
+        asyncio.run(handle())
+        return writer
+
+    def test_pipelined_requests(self):
+        writer = self.handle(post() + post())
+        self.assertEqual(2, writer.data.count(b'HTTP/1.1 200 OK'))
+        self.assertEqual(2, writer.data.count(b'Connection: keep-alive'))
+        self.assertEqual(
+            SentryMessage({'sentry_key': 'key', 'sentry_secret': 'secret'},
+                          zlib.compress(b'{"project": "test"}')),
+            self.pending_logs.get(timeout=0))
+        self.assertTrue(writer.closed)
+
+    def test_connection_close(self):
+        writer = self.handle(post(headers=b'Connection: close\r\n') + post())
+        self.assertEqual(1, writer.data.count(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'Connection: close', writer.data)
+
+    def test_chunked_body(self):
+        chunked = (b'POST / HTTP/1.1\r\n' + AUTH +
+                   b'Transfer-Encoding: chunked\r\n\r\n' +
+                   b'5\r\n' + BODY[:5] + b'\r\n' +
+                   '{:x}\r\n'.format(len(BODY) - 5).encode('ascii') +
+                   BODY[5:] + b'\r\n0\r\n\r\n')
+        writer = self.handle(chunked)
+        self.assertTrue(writer.data.startswith(b'HTTP/1.1 200 OK'))
+        self.assertEqual(zlib.compress(b'{"project": "test"}'),
+                         self.pending_logs.get(timeout=0).body)
+
+    def test_gzip_body(self):
+        body = gzip.compress(b'{"project": "test"}')
+        writer = self.handle(post(body, b'Content-Encoding: gzip\r\n'))
+        self.assertTrue(writer.data.startswith(b'HTTP/1.1 200 OK'))
+        self.assertEqual(body, self.pending_logs.get(timeout=0).body)
+
+    def test_body_too_large(self):
+        self.server.max_body_size = len(BODY) - 1
+        writer = self.handle(post() + post())
+        self.assertEqual(http_server.RESPONSES[413, False], writer.data)
+
+    def test_negative_content_length(self):
+        writer = self.handle(b'POST / HTTP/1.1\r\n' + AUTH +
+                             b'Content-Length: -5\r\n\r\n')
+        self.assertEqual(http_server.RESPONSES[400, False], writer.data)
+
+    def test_negative_chunk_size(self):
+        writer = self.handle(b'POST / HTTP/1.1\r\n' + AUTH +
+                             b'Transfer-Encoding: chunked\r\n\r\n'
+                             b'-5\r\n')
+        self.assertEqual(http_server.RESPONSES[400, False], writer.data)
+
+    def test_trailer_too_long(self):
+        writer = self.handle(b'POST / HTTP/1.1\r\n' + AUTH +
+                             b'Transfer-Encoding: chunked\r\n\r\n'
+                             b'0\r\n' + b'a' * 100000 + b'\r\n\r\n')
+        self.assertEqual(http_server.RESPONSES[400, False], writer.data)
+
+    def test_missing_auth(self):
+        writer = self.handle(b'POST / HTTP/1.1\r\nContent-Length: 0\r\n\r\n')
+        self.assertTrue(writer.data.startswith(b'HTTP/1.1 400 Bad Request'))
+        self.assertEqual(1, self.server.stats['bad_requests'])
+
+    def test_method_not_allowed(self):
+        writer = self.handle(b'GET / HTTP/1.0\r\n\r\n')
+        self.assertEqual(http_server.RESPONSES[405, False], writer.data)
+
+    @mock.patch('elasticsearch_raven.http_server.PUT_TIMEOUT', 0)
+    def test_queue_full(self):
+        self.pending_logs = queues.ThreadingQueue(1)
+        self.pending_logs.put(mock.Mock())
+        self.server.pending_logs = self.pending_logs
+        writer = self.handle(post())
+        self.assertIn(b'HTTP/1.1 503 Service Unavailable', writer.data)
+        self.assertIn(b'Retry-After: 1', writer.data)
+        self.assertEqual(1, self.server.stats['rejected'])
@@ -0,0 +1,85 @@
+import datetime
+from unittest import TestCase
+from unittest import mock
+
+import elasticsearch
+
+from elasticsearch_raven import indices
+
+
+class IndexPatternTest(TestCase):
+    def test_date(self):
+        self.assertEqual('basic-index-*',
+                         indices.index_pattern('basic-index-{0:%Y.%m.%d}'))
+
+    def test_template_name(self):
+        self.assertEqual('elasticsearch-raven-basic-index-_',
+                         indices.template_name('Basic-index-{0:%Y.%m.%d}'))
+
+    def test_index_template(self):
+        template = indices.index_template('index-{0:%Y}', 'raven-log')
+        self.assertEqual('index-*', template['template'])
+        self.assertEqual(indices.DYNAMIC_TEMPLATES,
+                         template['mappings']['raven-log'][
+                             'dynamic_templates'])
+
+
+class IndexSchedulerTest(TestCase):
+    def setUp(self):
+        self.log_transport = mock.Mock()
+        self.log_transport.DOCUMENT_TYPE = 'raven-log'
+        self.scheduler = indices.IndexScheduler(self.log_transport, 3600)
+        self.scheduler.add_project('index-{0:%Y.%m.%d}')
+
+    def test_create_next_index(self):
+        self.scheduler.prepare(datetime.datetime(2014, 1, 1, 23, 30))
+        self.assertEqual([
+            mock.call.put_template(
+                'elasticsearch-raven-index-_',
+                indices.index_template('index-{0:%Y.%m.%d}', 'raven-log')),
+            mock.call.create_index('index-2014.01.02')],
+            self.log_transport.mock_calls)
+
+    def test_create_once(self):
+        self.scheduler.prepare(datetime.datetime(2014, 1, 1, 12, 0))
+        self.scheduler.prepare(datetime.datetime(2014, 1, 1, 13, 0))
+        self.assertEqual([mock.call.create_index('index-2014.01.01')],
+                         self.log_transport.create_index.mock_calls)
+        self.assertEqual(1, len(self.log_transport.put_template.mock_calls))
+
+    def test_connection_error(self):
+        self.log_transport.put_template.side_effect = [
+            elasticsearch.exceptions.ConnectionError('N/A', 'test', None),
+            None]
+        self.scheduler.prepare(datetime.datetime(2014, 1, 1))
+        self.scheduler.prepare(datetime.datetime(2014, 1, 1))
+        self.assertEqual(2, len(self.log_transport.put_template.mock_calls))
+        self.assertEqual([mock.call.create_index('index-2014.01.01')],
+                         self.log_transport.create_index.mock_calls)
+
+    def test_add_project_wakes_up(self):
+        self.scheduler._wake_up.clear()
+        self.scheduler.add_project('other-{0:%Y}')
+        self.assertTrue(self.scheduler._wake_up.is_set())
+
+    def test_max_projects(self):
+        scheduler = indices.IndexScheduler(self.log_transport, 3600,
+                                           max_projects=2)
+        for project in ['a-{0:%Y}', 'b-{0:%Y}', 'c-{0:%Y}']:
+            scheduler.add_project(project)
+        self.assertEqual(['b-{0:%Y}', 'c-{0:%Y}'], list(scheduler._projects))
+
+    @mock.patch('elasticsearch_raven.indices.time')
+    def test_expire_project(self, time_mock):
+        time_mock.monotonic.return_value = 0
+        scheduler = indices.IndexScheduler(self.log_transport, 3600,
+                                           expiry=100)
+        scheduler.add_project('a-{0:%Y}')
+        scheduler.add_project('b-{0:%Y}')
+        scheduler.prepare(datetime.datetime(2014, 1, 1))
+        time_mock.monotonic.return_value = 90
+        scheduler.add_project('b-{0:%Y}')
+        time_mock.monotonic.return_value = 100
+        scheduler.prepare(datetime.datetime(2014, 1, 1))
+        self.assertEqual(['b-{0:%Y}'], list(scheduler._projects))
+        self.assertEqual(['b-{0:%Y}'], list(scheduler._prepared))
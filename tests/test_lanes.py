@@ -0,0 +1,117 @@
+import json
+import zlib
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import lanes
+from elasticsearch_raven import queues
+from elasticsearch_raven.transport import SentryMessage
+
+
+def message(**event):
+    return SentryMessage({}, zlib.compress(json.dumps(event).encode('utf-8')))
+
+
+class SchedulerTest(TestCase):
+    def test_weights(self):
+        scheduler = lanes.Scheduler([3, 1])
+        chosen = [scheduler.choose([0, 1]) for _ in range(8)]
+        self.assertEqual([0, 0, 1, 0] * 2, chosen)
+
+    def test_ready_lanes_only(self):
+        scheduler = lanes.Scheduler([3, 1])
+        self.assertEqual([1, 1, 1], [scheduler.choose([1]) for _ in range(3)])
+        self.assertEqual(0, scheduler.choose([0, 1]))
+
+
+class ClassifierTest(TestCase):
+    def setUp(self):
+        self.classify = lanes.Classifier(
+            [8, 2, 1], {'fatal': 0, 'error': 0, 'warning': 1},
+            {'payments-{0:%Y.%m}': 0, 'noisy': 5})
+
+    def test_level(self):
+        self.assertEqual(0, self.classify(message(level='error')))
+        self.assertEqual(1, self.classify(message(level='WARNING')))
+        self.assertEqual(2, self.classify(message(level='info')))
+
+    def test_numeric_level(self):
+        self.assertEqual(0, self.classify(message(level=40)))
+        self.assertEqual(2, self.classify(message(level=20)))
+
+    def test_project(self):
+        self.assertEqual(0, self.classify(
+            message(project='payments-{0:%Y.%m}', level='debug')))
+
+    def test_lane_limited(self):
+        self.assertEqual(2, self.classify(message(project='noisy')))
+
+    def test_sentry_key(self):
+        self.assertEqual(0, lanes.Classifier([2, 1], {}, {'key': 0})(
+            SentryMessage({'sentry_key': 'key'}, b'x')))
+
+    def test_prefix_only(self):
+        late_level = message(extra='x' * lanes.CLASSIFY_PREFIX,
+                             level='error')
+        self.assertEqual(2, self.classify(late_level))
+
+    def test_damaged_body(self):
+        self.assertEqual(2, self.classify(SentryMessage({}, b'x')))
+
+    def test_parse_lanes(self):
+        self.assertEqual({'error': 0, 'a-{0:%Y.%m}': 1},
+                         lanes.parse_lanes(['error:0', 'a-{0:%Y.%m}:1']))
+
+
+class ThreadingQueueLanesTest(TestCase):
+    def test_errors_overtake_backlog(self):
+        classifier = lanes.Classifier([4, 1], {'error': 0})
+        pending_logs = queues.ThreadingQueue(lanes=lanes.Lanes(classifier))
+        for i in range(10):
+            pending_logs.put(message(level='info', i=i))
+        pending_logs.put(message(level='error'))
+        self.assertEqual('error',
+                         pending_logs.get(timeout=0).decode_body()['level'])
+        self.assertEqual(0, pending_logs.get(timeout=0).decode_body()['i'])
+
+    def test_byte_bounded(self):
+        classifier = lanes.Classifier([4, 1], {'error': 0})
+        pending_logs = queues.ThreadingQueue(max_bytes=1024,
+                                             lanes=lanes.Lanes(classifier))
+        pending_logs.put(message(level='error'))
+        self.assertEqual('error',
+                         pending_logs.get(timeout=0).decode_body()['level'])
+        self.assertEqual(0, pending_logs.queue.bytes)
+
+
+class LanedQueueTest(TestCase):
+    def setUp(self):
+        self.lanes = [mock.Mock(), mock.Mock()]
+        self.classifier = mock.Mock(weights=[1, 1], return_value=1)
+        self.pending_logs = queues.LanedQueue(self.lanes, self.classifier,
+                                              poll_interval=0)
+
+    def test_put(self):
+        self.pending_logs.put('message')
+        self.assertEqual([mock.call.put('message')], self.lanes[1].mock_calls)
+
+    def test_get_skips_empty_lane(self):
+        self.lanes[0].get_nowait.side_effect = queues.Empty
+        self.lanes[1].get_nowait.return_value = 'message'
+        self.assertEqual('message', self.pending_logs.get())
+        self.pending_logs.task_done()
+        self.assertEqual([mock.call.get_nowait(), mock.call.task_done()],
+                         self.lanes[1].mock_calls)
+
+    def test_choose_once_per_round(self):
+        self.pending_logs.scheduler = mock.Mock()
+        self.pending_logs.scheduler.choose.return_value = 1
+        self.lanes[1].get_nowait.side_effect = queues.Empty
+        self.lanes[0].get_nowait.return_value = 'message'
+        self.assertEqual('message', self.pending_logs.get())
+        self.assertEqual(1, len(self.pending_logs.scheduler.choose.mock_calls))
+
+    def test_get_timeout(self):
+        for lane in self.lanes:
+            lane.get_nowait.side_effect = queues.Empty
+        self.assertRaises(queues.Empty, self.pending_logs.get, timeout=0)
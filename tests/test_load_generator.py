@@ -0,0 +1,82 @@
+import argparse
+import io
+import os
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import load_generator
+from elasticsearch_raven import sockets
+from elasticsearch_raven.transport import SentryMessage
+
+
+class MakeDatagramTest(TestCase):
+    def test_parse(self):
+        data = load_generator.make_datagram('index', 10, sent=1.5)
+        body = SentryMessage.create_from_udp(data).decode_body()
+        self.assertEqual({'project': 'index', 'message': 'x' * 10,
+                          'extra': {'load_generator_sent': 1.5}}, body)
+
+
+class MessagesDueTest(TestCase):
+    def test_constant(self):
+        args = argparse.Namespace(rate=100.0, ramp_to=None, duration=10.0)
+        self.assertEqual(500.0, load_generator._messages_due(args, 5.0))
+
+    def test_ramp(self):
+        args = argparse.Namespace(rate=0.0, ramp_to=100.0, duration=10.0)
+        self.assertEqual(500.0, load_generator._messages_due(args, 10.0))
+
+
+class CaptureFileTest(TestCase):
+    def test_round_trip(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with open(path, 'wb') as capture_file:
+            load_generator.write_record(capture_file, 1.0, b'first')
+            load_generator.write_record(capture_file, 2.0, b'second')
+        self.assertEqual([(1.0, b'first'), (2.0, b'second')],
+                         list(load_generator.read_capture(path)))
+
+
+class FakeElasticsearchTest(TestCase):
+    @mock.patch('elasticsearch_raven.load_generator.http_server')
+    @mock.patch('elasticsearch_raven.load_generator.time')
+    def test_latency(self, time, http_server):
+        time.time.return_value = 10.0
+        sink = load_generator.FakeElasticsearch(9200)
+        sink.add([{'extra': {'load_generator_sent<float>': 9.0}},
+                  {'extra': {'load_generator_sent': 8.0}},
+                  {'extra': {}}])
+        report = sink.report(1.0)
+        self.assertEqual(3, report['indexed'])
+        self.assertEqual(1.0, report['latency_p50'])
+        self.assertEqual(2.0, report['latency_p100'])
+
+
+PROC_NET_UDP = (
+    '   sl  local_address rem_address   st tx_queue rx_queue tr tm->when '
+    'retrnsmt   uid  timeout inode ref pointer drops\n'
+    '  1: 0100007F:4E1F 00000000:0000 07 00000000:00000000 00:00000000 '
+    '00000000     0        0 1234 2 0000000000000000 7\n'
+    '  2: 00000000:0035 00000000:0000 07 00000000:00000000 00:00000000 '
+    '00000000     0        0 5678 2 0000000000000000 3\n')
+
+
+class ReadUdpDropsTest(TestCase):
+    def read_udp_drops(self, **kwargs):
+        with mock.patch('elasticsearch_raven.sockets.open', create=True,
+                        side_effect=lambda path: io.StringIO(PROC_NET_UDP)):
+            with mock.patch('elasticsearch_raven.sockets.PROC_NET_UDP',
+                            ['/proc/net/udp']):
+                return sockets.read_udp_drops(**kwargs)
+
+    def test_all(self):
+        self.assertEqual(10, self.read_udp_drops())
+
+    def test_port(self):
+        self.assertEqual(7, self.read_udp_drops(port=19999))
+
+    def test_inode(self):
+        self.assertEqual(3, self.read_udp_drops(inode=5678))
@@ -148,3 +148,70 @@ class PostfixListTest(TestCase):
         result = dict(postfix.postfix_list(*args))
         self.assertEqual([1, 2], result['test_name<int>'])
         self.assertEqual(['a'], result['test_name<string>'])
+
+
+class LimitsTest(TestCase):
+    def test_no_limits(self):
+        self.assertFalse(postfix.Limits())
+
+    def test_limits(self):
+        self.assertTrue(postfix.Limits(max_depth=1))
+
+    def test_no_truncation(self):
+        encoded_data = {'extra': {'x': 'test', 'y': [1, {'z': None}]}}
+        postfix.postfix_encoded_data(encoded_data, postfix.Limits(
+            max_depth=10, max_string=10, max_list=10, max_fields=10))
+        self.assertEqual(
+            {'extra': {'x<string>': 'test', 'y<int>': [1],
+                       'y': [{'z': None}]}},
+            encoded_data)
+
+    def test_depth(self):
+        encoded_data = {'extra': {'x': {'y': {'z': 1}}, 'a': 1}}
+        postfix.postfix_encoded_data(encoded_data,
+                                     postfix.Limits(max_depth=2))
+        self.assertEqual({'extra': {'x': {'y': {}}, 'a<int>': 1},
+                          '_truncated': ['depth']}, encoded_data)
+
+    def test_nested_list_depth(self):
+        encoded_data = {'extra': {'x': [[1]]}}
+        postfix.postfix_encoded_data(encoded_data,
+                                     postfix.Limits(max_depth=2))
+        self.assertEqual({'extra': {'x': [[]]}, '_truncated': ['depth']},
+                         encoded_data)
+
+    def test_string(self):
+        encoded_data = {'extra': {'x': 'abcdef'}}
+        postfix.postfix_encoded_data(encoded_data,
+                                     postfix.Limits(max_string=3))
+        self.assertEqual({'extra': {'x<string>': 'abc'},
+                          '_truncated': ['string']}, encoded_data)
+
+    def test_list(self):
+        encoded_data = {'extra': {'x': [1, 2, 3]}}
+        postfix.postfix_encoded_data(encoded_data, postfix.Limits(max_list=2))
+        self.assertEqual({'extra': {'x<int>': [1, 2]},
+                          '_truncated': ['list']}, encoded_data)
+
+    def test_fields(self):
+        encoded_data = {'extra': {'x': [1, 2, 3]}}
+        postfix.postfix_encoded_data(encoded_data,
+                                     postfix.Limits(max_fields=3))
+        self.assertEqual({'extra': {'x<int>': [1, 2]},
+                          '_truncated': ['fields']}, encoded_data)
+
+    def test_fields_shared_by_sentry_fields(self):
+        key = 'sentry.interfaces.Message'
+        encoded_data = {'extra': {'a': 1}, key: {'message': 'MESSAGE'}}
+        postfix.postfix_encoded_data(encoded_data,
+                                     postfix.Limits(max_fields=1))
+        self.assertEqual(['fields'], encoded_data['_truncated'])
+        self.assertEqual(1, sum(len(encoded_data[field])
+                                for field in ['extra', key]))
+
+    def test_size(self):
+        encoded_data = {'extra': {'x': 'a' * 100, 'y': 'b'}}
+        postfix.postfix_encoded_data(encoded_data,
+                                     postfix.Limits(max_size=50))
+        self.assertEqual(['size'], encoded_data['_truncated'])
+        self.assertEqual(1, len(encoded_data['extra']))
@@ -0,0 +1,54 @@
+import json
+import time
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import prefork
+
+
+def _worker(stats_file):
+    stats_file.write(json.dumps({'sent': 2}) + '\n')
+    stats_file.flush()
+    time.sleep(60)
+
+
+class SupervisorTest(TestCase):
+    def setUp(self):
+        self.supervisor = prefork.Supervisor(_worker, 2, drain_timeout=5.0)
+
+    def tearDown(self):
+        self.supervisor._drain()
+
+    def test_aggregate_stats(self):
+        self.supervisor._spawn()
+        self.supervisor._spawn()
+        deadline = time.monotonic() + 5.0
+        while (self.supervisor.stats()['sent'] < 4 and
+               time.monotonic() < deadline):
+            self.supervisor._read_stats(0.1)
+        self.assertEqual(4, self.supervisor.stats()['sent'])
+
+    @mock.patch('sys.stdout', mock.Mock())
+    def test_restart(self):
+        self.supervisor._spawn()
+        pid, = self.supervisor._workers
+        prefork.os.kill(pid, prefork.signal.SIGKILL)
+        deadline = time.monotonic() + 5.0
+        while (pid in self.supervisor._workers and
+               time.monotonic() < deadline):
+            self.supervisor._reap(respawn=True)
+        self.assertEqual(1, len(self.supervisor._workers))
+        self.assertNotIn(pid, self.supervisor._workers)
+
+    def test_drain(self):
+        self.supervisor._spawn()
+        self.supervisor._drain()
+        self.assertEqual({}, self.supervisor._workers)
+
+    def test_forward_signal(self):
+        self.supervisor._spawn()
+        pid, = self.supervisor._workers
+        with mock.patch('elasticsearch_raven.prefork.os.kill') as kill:
+            self.supervisor.forward_signal(prefork.signal.SIGUSR1, None)
+        self.assertEqual([mock.call(pid, prefork.signal.SIGUSR1)],
+                         kill.mock_calls)
@@ -0,0 +1,68 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import profiling
+
+
+class NullTimerTest(TestCase):
+    def test_stage(self):
+        timer = profiling.NullTimer()
+        with timer.stage('test'):
+            pass
+        self.assertIs(timer.stage('a'), timer.stage('b'))
+
+
+class StageTimerTest(TestCase):
+    @mock.patch('elasticsearch_raven.profiling.time')
+    def test_stage(self, time):
+        time.perf_counter.side_effect = [1.0, 1.5]
+        timer = profiling.StageTimer()
+        with timer.stage('test'):
+            pass
+        self.assertEqual({'test': 1}, timer._counts)
+        self.assertEqual({'test': 0.5}, timer._totals)
+
+    @mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_report(self, stdout):
+        timer = profiling.StageTimer()
+        timer.add('decode_body', 0.002)
+        timer.add('decode_body', 0.004)
+        timer.add('index', 0.01)
+        timer.report()
+        self.assertEqual('stages: decode_body=2/0.006s/3.000ms '
+                         'index=1/0.010s/10.000ms\n', stdout.getvalue())
+        self.assertEqual({}, timer._counts)
+
+
+class StackSamplerTest(TestCase):
+    @mock.patch('sys.stdout', mock.Mock())
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sampler = profiling.StackSampler(0.05, directory, interval=0.001)
+        waiting = threading.Event()
+        thread = threading.Thread(target=waiting.wait)
+        thread.start()
+        try:
+            sampler.run()
+        finally:
+            waiting.set()
+            thread.join()
+        path, = [os.path.join(directory, name)
+                 for name in os.listdir(directory)]
+        with open(path) as dump:
+            profile = dump.read()
+        self.assertIn(':wait', profile)
+
+    def test_toggle(self):
+        sampler = profiling.StackSampler(60, None)
+        sampler.dump = mock.Mock()
+        sampler.toggle()
+        sampler.toggle()
+        sampler._sampler.join(5)
+        self.assertEqual(1, len(sampler.dump.mock_calls))
@@ -0,0 +1,211 @@
+import threading
+from unittest import TestCase
+from unittest import mock
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from elasticsearch_raven import queues
+from elasticsearch_raven.transport import SentryMessage
+
+
+class ThreadingQueueTest(TestCase):
+    def test_count_bounded(self):
+        pending_logs = queues.ThreadingQueue(1)
+        self.assertIsInstance(pending_logs.queue, queue.Queue)
+        self.assertNotIsInstance(pending_logs.queue, queues.ByteBoundedQueue)
+
+    def test_byte_bounded(self):
+        pending_logs = queues.ThreadingQueue(max_bytes=10)
+        self.assertIsInstance(pending_logs.queue, queues.ByteBoundedQueue)
+
+    def test_empty(self):
+        pending_logs = queues.ThreadingQueue()
+        self.assertRaises(queues.Empty, pending_logs.get, timeout=0.01)
+
+    def test_has_nonpersistent_task(self):
+        pending_logs = queues.ThreadingQueue()
+        pending_logs.put(SentryMessage({}, b'body'))
+        pending_logs.get()
+        self.assertTrue(pending_logs.has_nonpersistent_task())
+        pending_logs.task_done()
+        self.assertFalse(pending_logs.has_nonpersistent_task())
+
+
+class ByteBoundedQueueTest(TestCase):
+    def test_bytes_accounting(self):
+        pending_logs = queues.ByteBoundedQueue(max_bytes=10)
+        pending_logs.put(SentryMessage({}, b'1234'))
+        pending_logs.put(SentryMessage({}, b'123'))
+        self.assertEqual(7, pending_logs.bytes)
+        pending_logs.get()
+        self.assertEqual(3, pending_logs.bytes)
+
+    def test_full(self):
+        pending_logs = queues.ByteBoundedQueue(max_bytes=10)
+        pending_logs.put(SentryMessage({}, b'12345678'))
+        self.assertRaises(queue.Full, pending_logs.put,
+                          SentryMessage({}, b'123'), block=False)
+        self.assertRaises(queue.Full, pending_logs.put,
+                          SentryMessage({}, b'123'), timeout=0.01)
+
+    def test_oversized_message_in_empty_queue(self):
+        pending_logs = queues.ByteBoundedQueue(max_bytes=10)
+        pending_logs.put(SentryMessage({}, b'x' * 100), block=False)
+        self.assertEqual(100, pending_logs.bytes)
+
+    def test_count_limit(self):
+        pending_logs = queues.ByteBoundedQueue(maxsize=1, max_bytes=10)
+        pending_logs.put(SentryMessage({}, b'1'))
+        self.assertRaises(queue.Full, pending_logs.put,
+                          SentryMessage({}, b'1'), block=False)
+
+    def test_blocking_put_wakes_up(self):
+        pending_logs = queues.ByteBoundedQueue(max_bytes=10)
+        pending_logs.put(SentryMessage({}, b'12345678'))
+        thread = threading.Thread(target=pending_logs.put,
+                                  args=(SentryMessage({}, b'123'),))
+        thread.start()
+        pending_logs.get()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(3, pending_logs.bytes)
+
+
+class KombuQueueTest(TestCase):
+    @mock.patch('kombu.Connection', mock.Mock())
+    def setUp(self):
+        self.pending_logs = queues.KombuQueue('amqp://', 'test')
+
+    @mock.patch('elasticsearch_raven.queues.time')
+    def test_timestamps(self, time):
+        time.time.return_value = 20.0
+        data = self.pending_logs._serialize(
+            SentryMessage({'sentry_key': 'a'}, b'body', received=10.0))
+        message = self.pending_logs._deserialize(data)
+        self.assertEqual(SentryMessage({'sentry_key': 'a'}, b'body'), message)
+        self.assertEqual((10.0, 20.0), (message.received, message.enqueued))
+
+    def test_without_timestamps(self):
+        message = self.pending_logs._deserialize([{}, 'Ym9keQ=='])
+        self.assertEqual(b'body', message.body)
+        self.assertIsNone(message.received)
+
+    def test_task_done_in_order(self):
+        processed = [mock.Mock(payload=[{}, '']), mock.Mock(payload=[{}, ''])]
+        self.pending_logs.queue.get.side_effect = processed
+        self.pending_logs.get()
+        self.pending_logs.get()
+        self.pending_logs.task_done()
+        self.assertEqual([mock.call.ack()], processed[0].mock_calls[-1:])
+        self.assertEqual([], processed[1].ack.mock_calls)
+
+
+class PublishingKombuQueueTest(TestCase):
+    @mock.patch('kombu.Connection', mock.Mock())
+    def setUp(self):
+        self.pending_logs = queues.PublishingKombuQueue(
+            'amqp://', 'test', batch_size=2, confirm_timeout=0.01)
+        self.message = SentryMessage({}, b'body')
+
+    def test_next_batch(self):
+        for i in range(3):
+            self.pending_logs._buffer.put(self.message)
+        self.assertEqual([self.message] * 2, self.pending_logs._next_batch())
+        self.assertEqual([self.message], self.pending_logs._next_batch())
+
+    def test_next_batch_starts_with_resend(self):
+        other = SentryMessage({}, b'other')
+        self.pending_logs._buffer.put(self.message)
+        self.pending_logs._resend.append(other)
+        self.assertEqual([other, self.message],
+                         self.pending_logs._next_batch())
+
+    def test_confirmed(self):
+        self.pending_logs._buffer.put(self.message)
+        self.pending_logs._buffer.put(self.message)
+        batch = self.pending_logs._next_batch()
+        self.pending_logs.connection.drain_events.side_effect = (
+            lambda timeout: self.pending_logs._on_ack(2, True))
+        self.pending_logs._publish_batch(batch)
+        self.assertFalse(self.pending_logs.has_nonpersistent_task())
+        self.assertEqual(2, self.pending_logs.stats['confirmed'])
+        self.assertEqual(2, len(self.pending_logs.queue.put.mock_calls))
+
+    def test_nacked(self):
+        self.pending_logs._buffer.put(self.message)
+        batch = self.pending_logs._next_batch()
+
+        def drain_events(timeout):
+            self.pending_logs._on_nack(1, False)
+        self.pending_logs.connection.drain_events.side_effect = drain_events
+        self.pending_logs._publish_batch(batch)
+        self.assertTrue(self.pending_logs.has_nonpersistent_task())
+        self.assertEqual([self.message], list(self.pending_logs._resend))
+
+    def test_timed_out(self):
+        self.pending_logs._buffer.put(self.message)
+        batch = self.pending_logs._next_batch()
+        self.pending_logs.connection.drain_events.side_effect = (
+            lambda timeout: None)
+        self.pending_logs._publish_batch(batch)
+        self.assertEqual(1, self.pending_logs.stats['timed_out'])
+        self.assertEqual([self.message], list(self.pending_logs._resend))
+
+    def test_late_ack(self):
+        self.pending_logs._on_ack(5, True)
+        self.assertEqual(0, self.pending_logs.stats['confirmed'])
+
+    def test_flush_timeout(self):
+        self.pending_logs._buffer.put(self.message)
+        self.assertFalse(self.pending_logs.flush(0.01))
+
+    def test_put_reraises_publisher_error(self):
+        self.pending_logs._error = Exception('test')
+        self.assertRaises(Exception, self.pending_logs.put, self.message)
+
+    @mock.patch('elasticsearch_raven.queues.PUT_POLL_INTERVAL', 0.01)
+    def test_put_full_buffer_reraises_publisher_error(self):
+        self.pending_logs._publisher = mock.Mock()
+        self.pending_logs._buffer = queue.Queue(1)
+        self.pending_logs._buffer.put(self.message)
+        timer = threading.Timer(
+            0.05, setattr, (self.pending_logs, '_error', Exception('test')))
+        timer.start()
+        self.assertRaises(Exception, self.pending_logs.put, self.message)
+        timer.join()
+
+
+class ShardNamesTest(TestCase):
+    def test_single(self):
+        self.assertEqual(['logs'], queues.shard_names('logs', 1))
+
+    def test_multiple(self):
+        self.assertEqual(['logs-0', 'logs-1'], queues.shard_names('logs', 2))
+
+
+class ShardedQueueTest(TestCase):
+    def setUp(self):
+        self.shards = [mock.Mock(), mock.Mock()]
+
+    def test_by_sentry_key(self):
+        pending_logs = queues.ShardedQueue(self.shards)
+        for i in range(4):
+            pending_logs.put(SentryMessage({'sentry_key': 'a'}, b''))
+        calls = [len(shard.put.mock_calls) for shard in self.shards]
+        self.assertEqual([0, 4], sorted(calls))
+
+    def test_round_robin(self):
+        pending_logs = queues.ShardedQueue(self.shards, 'round-robin')
+        for i in range(4):
+            pending_logs.put(SentryMessage({'sentry_key': 'a'}, b''))
+        calls = [len(shard.put.mock_calls) for shard in self.shards]
+        self.assertEqual([2, 2], calls)
+
+    def test_has_nonpersistent_task(self):
+        self.shards[0].has_nonpersistent_task.return_value = False
+        self.shards[1].has_nonpersistent_task.return_value = True
+        pending_logs = queues.ShardedQueue(self.shards)
+        self.assertTrue(pending_logs.has_nonpersistent_task())
@@ -0,0 +1,133 @@
+import base64
+import socket
+import zlib
+from unittest import TestCase
+
+from elasticsearch_raven import exceptions
+from elasticsearch_raven import queues
+from elasticsearch_raven import ring
+from elasticsearch_raven.transport import SentryMessage
+
+BODY = zlib.compress(b'{"project": "test"}')
+DATAGRAM = (b'sentry_key=key, sentry_secret=secret\n\n' +
+            base64.b64encode(BODY))
+
+
+class SharedRingTest(TestCase):
+    def setUp(self):
+        self.ring = ring.SharedRing(64, max_record=16)
+
+    def tearDown(self):
+        self.ring.unlink()
+
+    def get(self):
+        view, position = self.ring.get(timeout=0)
+        data = bytes(view)
+        view.release()
+        self.ring.release(position)
+        return data
+
+    def test_capacity_too_small(self):
+        self.assertRaises(ValueError, ring.SharedRing, 32, max_record=16)
+
+    def test_put_get(self):
+        self.ring.put(b'first')
+        self.ring.put(b'second')
+        self.assertEqual(b'first', self.get())
+        self.assertEqual(b'second', self.get())
+        self.assertRaises(queues.Empty, self.ring.get, timeout=0)
+
+    def test_wraparound(self):
+        for i in range(20):
+            self.assertTrue(self.ring.put('record {:02}'.format(i).encode()))
+            self.assertEqual('record {:02}'.format(i).encode(), self.get())
+        self.assertEqual(0, self.ring.stats['ring_used_bytes'])
+
+    def test_full(self):
+        self.assertTrue(self.ring.put(b'a' * 16))
+        self.assertTrue(self.ring.put(b'b' * 16))
+        self.assertFalse(self.ring.put(b'c'))
+        self.assertEqual(2, self.ring.stats['ring_received'])
+        self.assertEqual(1, self.ring.stats['ring_dropped'])
+
+    def test_release_out_of_order(self):
+        self.ring.put(b'a')
+        self.ring.put(b'b')
+        first = self.ring.get(timeout=0)
+        second = self.ring.get(timeout=0)
+        self.ring.release(second[1])
+        self.assertEqual(2 * (ring.RECORD.size + 1),
+                         self.ring.stats['ring_used_bytes'])
+        self.ring.release(first[1])
+        self.assertEqual(0, self.ring.stats['ring_used_bytes'])
+
+    def test_closed(self):
+        self.ring.put(b'a')
+        self.ring.close()
+        self.assertFalse(self.ring.drained())
+        self.assertEqual(b'a', self.get())
+        self.assertTrue(self.ring.drained())
+        self.assertRaises(ring.Closed, self.ring.get, timeout=0)
+
+    def test_receive(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            receiver.bind(('127.0.0.1', 0))
+            sender.bind(('127.0.0.1', 0))
+            sender.sendto(b'datagram', receiver.getsockname())
+            self.assertEqual(sender.getsockname(),
+                             self.ring.receive(receiver))
+        finally:
+            receiver.close()
+            sender.close()
+        self.assertEqual(b'datagram', self.get())
+
+
+class RingQueueTest(TestCase):
+    def setUp(self):
+        self.ring = ring.SharedRing(1024, max_record=256)
+        self.pending_logs = ring.RingQueue(self.ring)
+
+    def tearDown(self):
+        self.ring.unlink()
+
+    def test_get(self):
+        self.ring.put(DATAGRAM)
+        self.assertEqual(
+            SentryMessage({'sentry_key': 'key', 'sentry_secret': 'secret'},
+                          BODY),
+            self.pending_logs.get(timeout=0))
+        self.assertEqual(0, self.ring.stats['ring_used_bytes'])
+
+    def test_received(self):
+        self.ring.put(DATAGRAM)
+        message = self.pending_logs.get(timeout=0)
+        self.assertIsNotNone(message.received)
+        self.assertEqual(message.received, message.enqueued)
+
+    def test_skip_damaged(self):
+        self.ring.put(b'no headers')
+        self.ring.put(DATAGRAM)
+        self.assertEqual(BODY, self.pending_logs.get(timeout=0).body)
+        self.assertEqual(1, self.pending_logs.stats['damaged'])
+
+    def test_pending_until_drained(self):
+        self.ring.put(DATAGRAM)
+        self.ring.close()
+        self.pending_logs.get(timeout=0)
+        self.assertTrue(self.pending_logs.has_nonpersistent_task())
+        self.pending_logs.task_done()
+        self.assertFalse(self.pending_logs.has_nonpersistent_task())
+
+
+class CreateFromViewTest(TestCase):
+    def test_view(self):
+        message = SentryMessage.create_from_view(memoryview(DATAGRAM))
+        self.assertEqual(BODY, message.body)
+        self.assertEqual('key', message.headers['sentry_key'])
+
+    def test_missing_separator(self):
+        self.assertRaises(exceptions.DamagedSentryMessageError,
+                          SentryMessage.create_from_view,
+                          memoryview(b'sentry_key=key'))
@@ -0,0 +1,94 @@
+import collections
+import json
+import threading
+import zlib
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import queues
+from elasticsearch_raven import routing
+from elasticsearch_raven.transport import SentryMessage
+
+
+def message(sentry_key='key', **event):
+    return SentryMessage({'sentry_key': sentry_key, 'sentry_secret': 's'},
+                         zlib.compress(json.dumps(event).encode('utf-8')))
+
+
+class RouterTest(TestCase):
+    def setUp(self):
+        self.route = routing.Router(
+            {'heavy': 'heavy:9200', 'eu': 'eu:9200'},
+            {'payments-{0:%Y.%m}': 'heavy', 'eu-key': 'eu'})
+
+    def test_project(self):
+        self.assertEqual('heavy',
+                         self.route(message(project='payments-{0:%Y.%m}')))
+
+    def test_sentry_key(self):
+        self.assertEqual('eu', self.route(message('eu-key', project='a')))
+
+    def test_project_prefix_only(self):
+        self.assertEqual('default', self.route(message(
+            extra='x' * routing.ROUTE_PREFIX, project='payments-{0:%Y.%m}')))
+
+    def test_default(self):
+        self.assertEqual('default', self.route(message(project='other')))
+        self.assertEqual('default', self.route(SentryMessage({}, b'x')))
+
+    def test_unknown_cluster(self):
+        self.assertRaises(ValueError, routing.Router, {}, {'a': 'missing'})
+
+    def test_parse(self):
+        self.assertEqual({'heavy': 'http://heavy:9200'},
+                         routing.parse_clusters(['heavy=http://heavy:9200']))
+        self.assertEqual({'a-{0:%Y.%m}': 'heavy'},
+                         routing.parse_routes(['a-{0:%Y.%m}:heavy']))
+
+    @mock.patch.dict('elasticsearch_raven.routing.configuration',
+                     elasticsearch_clusters=[])
+    def test_not_configured(self):
+        pending_logs = mock.Mock()
+        self.assertIs(pending_logs, routing.route_queue(
+            pending_logs, mock.Mock(), mock.Mock()))
+
+
+class RoutingQueueTest(TestCase):
+    def setUp(self):
+        self.transports = {
+            'default': mock.Mock(stats=collections.Counter({'hits': 1})),
+            'heavy': mock.Mock(stats=collections.Counter({'hits': 2}))}
+        self.queues = {'default': queues.ThreadingQueue(),
+                       'heavy': queues.ThreadingQueue(1)}
+        self.pending_logs = routing.RoutingQueue(
+            routing.Router({'heavy': 'heavy:9200'}, {'heavy-key': 'heavy'}),
+            {name: (self.transports[name], self.queues[name])
+             for name in self.queues})
+
+    def test_full_cluster_does_not_block(self):
+        for _ in range(3):
+            self.pending_logs.put(message('heavy-key'))
+        self.pending_logs.put(message())
+        self.assertRaises(queues.Full, self.pending_logs.put_nowait,
+                          message('heavy-key'))
+        self.assertEqual({'dropped_heavy': 3}, self.pending_logs.stats)
+        self.assertTrue(self.queues['default'].has_nonpersistent_task())
+
+    def test_sender_per_cluster(self):
+        blocked = threading.Event()
+        self.transports['heavy'].send_message.side_effect = (
+            lambda message: blocked.wait())
+        sender = routing.create_sender(None, self.pending_logs, mock.Mock())
+        sender.as_thread().start()
+        self.pending_logs.put(message('heavy-key'))
+        self.pending_logs.put(message(project='a'))
+        self.queues['default'].join()
+        self.assertEqual(1, sender.stats['sent'])
+        blocked.set()
+        self.queues['heavy'].join()
+        self.assertEqual(2, sender.stats['sent'])
+
+    def test_transport_stats(self):
+        # default transport is reported by the server
+        sender = routing.create_sender(None, self.pending_logs, mock.Mock())
+        self.assertEqual(2, sender.stats['hits'])
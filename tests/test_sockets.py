@@ -0,0 +1,61 @@
+import socket
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from elasticsearch_raven import sockets
+
+PROC_NET_UDP = (
+    '   sl  local_address rem_address   st tx_queue rx_queue tr tm->when '
+    'retrnsmt   uid  timeout inode ref pointer drops\n'
+    '  12: 00000000:2329 00000000:0000 07 00000000:00000400 00:00000000 '
+    '00000000     0        0 1001 2 0000000000000000 7\n'
+    '  13: 0100007F:232A 00000000:0000 07 00000000:00000000 00:00000000 '
+    '00000000     0        0 1002 2 0000000000000000 3\n')
+
+
+class ReadUdpSocketsTest(TestCase):
+    def setUp(self):
+        self.proc_file = tempfile.NamedTemporaryFile('w')
+        self.proc_file.write(PROC_NET_UDP)
+        self.proc_file.flush()
+        patcher = mock.patch('elasticsearch_raven.sockets.PROC_NET_UDP',
+                             [self.proc_file.name, '/nonexistent'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.proc_file.close)
+
+    def test_parse(self):
+        self.assertEqual([(9001, 1001, 1024, 7), (9002, 1002, 0, 3)],
+                         list(sockets.read_udp_sockets()))
+
+    def test_drops(self):
+        self.assertEqual(10, sockets.read_udp_drops())
+        self.assertEqual(3, sockets.read_udp_drops(port=9002))
+        self.assertEqual(7, sockets.read_udp_drops(inode=1001))
+
+    @mock.patch('os.fstat')
+    def test_drop_monitor(self, fstat):
+        fstat.return_value.st_ino = 1001
+        monitor = sockets.DropMonitor(mock.Mock())
+        monitor.update()
+        self.assertEqual({'kernel_drops': 0, 'receive_queue_bytes': 1024},
+                         monitor.stats)
+        with open(self.proc_file.name, 'w') as proc_file:
+            proc_file.write(PROC_NET_UDP.replace(' 7\n', ' 12\n'))
+        monitor.update()
+        self.assertEqual(5, monitor.stats['kernel_drops'])
+
+
+class SetReceiveBufferTest(TestCase):
+    def test_fallback_without_privileges(self):
+        sock = mock.Mock()
+        sock.setsockopt.side_effect = [PermissionError(), None]
+        sock.getsockopt.return_value = 212992
+        with mock.patch('socket.SO_RCVBUFFORCE', 33, create=True):
+            self.assertEqual(212992,
+                             sockets.set_receive_buffer(sock, 1048576))
+        self.assertEqual(
+            [mock.call(socket.SOL_SOCKET, 33, 1048576),
+             mock.call(socket.SOL_SOCKET, socket.SO_RCVBUF, 1048576)],
+            sock.setsockopt.mock_calls)
@@ -1,9 +1,16 @@
 import datetime
+import gzip
+import json
 import logging
 import string
+import sys
+import zlib
 from unittest import TestCase
 from unittest import mock
 
+import elasticsearch
+
+from elasticsearch_raven import cache
 from elasticsearch_raven import exceptions
 from elasticsearch_raven import transport
 
@@ -71,6 +78,39 @@ class DecodeBodyTest(TestCase):
                           transport.SentryMessage.decode_body, message)
 
 
+class DecompressTest(TestCase):
+    def test_limit(self):
+        body = zlib.compress(b'{"a": "' + b'x' * 100 + b'"}')
+        self.assertEqual(109, len(transport.decompress(body, max_size=109)))
+        self.assertRaises(exceptions.DamagedSentryMessageBodyError,
+                          transport.decompress, body, max_size=108)
+
+    def test_bomb(self):
+        body = zlib.compress(b'\0' * 1024 * 1024 * 64, 9)
+        self.assertRaises(exceptions.DamagedSentryMessageBodyError,
+                          transport.decompress, body, max_size=1024)
+
+    def test_no_limit(self):
+        body = gzip.compress(b'{}' * 1000)
+        self.assertEqual(2000, len(transport.decompress(body, max_size=0)))
+
+    def test_json_limit(self):
+        self.assertRaises(exceptions.DamagedSentryMessageBodyError,
+                          transport.decompress, b'{"a": 1}', max_size=4)
+
+    def test_truncated(self):
+        body = zlib.compress(b'{"project": "test"}')[:-4]
+        self.assertRaises(exceptions.DamagedSentryMessageBodyError,
+                          transport.decompress, body)
+
+    @mock.patch.dict('elasticsearch_raven.transport.configuration',
+                     max_decompressed_size=4)
+    def test_configured(self):
+        message = transport.SentryMessage({}, zlib.compress(b'{"a": 1}'))
+        self.assertRaises(exceptions.DamagedSentryMessageBodyError,
+                          message.decode_body)
+
+
 class CreateFromUDPTest(TestCase):
     def test_empty(self):
         arg = b''
@@ -103,6 +143,57 @@ class CreateFromHttpTest(TestCase):
                          message.headers)
         self.assertEqual(b'body', message.body)
 
+    def test_compressed(self):
+        body = gzip.compress(b'{"project": "test"}')
+        message = transport.SentryMessage.create_from_http(
+            'sentry_key=a, sentry_secret=b', body, content_encoding='gzip')
+        self.assertEqual(body, message.body)
+        self.assertEqual({'project': 'test'}, message.decode_body())
+
+    def test_json(self):
+        message = transport.SentryMessage.create_from_http(
+            'sentry_key=a, sentry_secret=b', b' {"project": "test"}')
+        self.assertEqual({'project': 'test'}, message.decode_body())
+
+    def test_unknown_encoding(self):
+        self.assertRaises(exceptions.DamagedSentryMessageBodyError,
+                          transport.SentryMessage.create_from_http,
+                          'sentry_key=a, sentry_secret=b', b'body',
+                          content_encoding='br')
+
+
+class SharedHeadersTest(TestCase):
+    def test_same_object(self):
+        message1 = transport.SentryMessage.create_from_http(
+            'sentry_key=shared, sentry_secret=b', 'Ym9keQ==')
+        message2 = transport.SentryMessage.create_from_http(
+            'sentry_key=shared, sentry_secret=b', 'Ym9keQ==')
+        self.assertIs(message1.headers, message2.headers)
+
+    def test_unknown_headers(self):
+        headers = {'test_header': 'foo'}
+        self.assertIs(headers, transport.shared_headers(headers))
+
+    @mock.patch('elasticsearch_raven.transport._shared_headers', {})
+    @mock.patch('elasticsearch_raven.transport.SHARED_HEADERS_LIMIT', 0)
+    def test_limit(self):
+        headers = {'sentry_key': 'a', 'sentry_secret': 'b'}
+        self.assertIs(headers, transport.shared_headers(headers))
+
+
+class SentryMessageTest(TestCase):
+    def test_no_dict(self):
+        message = transport.SentryMessage({}, b'body')
+        self.assertRaises(AttributeError, setattr, message, 'foo', 'bar')
+
+    def test_equal(self):
+        self.assertEqual(transport.SentryMessage({'a': 'b'}, b'body'),
+                         transport.SentryMessage({'a': 'b'}, b'body'))
+
+    def test_repr(self):
+        self.assertEqual("SentryMessage(headers={'a': 'b'}, body=b'body')",
+                         repr(transport.SentryMessage({'a': 'b'}, b'body')))
+
 
 class LogTransportSendTest(TestCase):
     @mock.patch('elasticsearch_raven.transport.datetime')
@@ -111,10 +202,8 @@ class LogTransportSendTest(TestCase):
         log_transport = transport.LogTransport('example.com', use_ssl=False,
                                                http_auth='login:password')
         datetime_mock.datetime.now.return_value = datetime.datetime(2014, 1, 1)
-        headers = {}
         body = {'project': 'index-{0:%Y.%m.%d}', 'extra': {'foo': 'bar'}}
-        message = transport.SentryMessage(headers, body)
-        message.decode_body = mock.Mock()
+        message = mock.Mock(transport.SentryMessage)
         message.decode_body.return_value = body
         log_transport.send_message(message)
         self.assertEqual([mock.call(
@@ -139,6 +228,192 @@ class LogTransportSendTest(TestCase):
                          transport.hash_dict(arg2))
 
 
+@mock.patch('elasticsearch_raven.transport.time')
+@mock.patch('elasticsearch.Elasticsearch')
+class IngestLagTest(TestCase):
+    def test_lag_field(self, ElasticSearch, time):
+        time.time.return_value = 100.0
+        log_transport = transport.LogTransport('example.com')
+        log_transport.lag_field = 'ingest_lag'
+        body = {'project': 'index'}
+        message_id = transport.hash_dict(body)
+        index, result_id, document = log_transport.prepare(
+            transport.SentryMessage({}, zlib.compress(b'{"project": "index"}'),
+                                    received=97.5))
+        self.assertEqual(message_id, result_id)
+        self.assertEqual({'project': 'index', 'ingest_lag': 2.5}, document)
+
+    def test_received(self, ElasticSearch, time):
+        time.time.return_value = 100.0
+        message = transport.SentryMessage.create_from_udp(
+            b'sentry_key=a, sentry_secret=b\n\nYm9keQ==')
+        self.assertEqual(100.0, message.received)
+
+
+class ExtractProjectTest(TestCase):
+    def test_example(self):
+        self.assertEqual('index-{0:%Y}', transport.extract_project(
+            b'{"message": "a", "project": "index-{0:%Y}"}'))
+
+    def test_escaped(self):
+        self.assertEqual('a"b', transport.extract_project(
+            b'{"project" : "a\\"b"}'))
+
+    def test_missing(self):
+        self.assertIsNone(transport.extract_project(b'{"message": "a"}'))
+
+    def test_nested_key_skipped(self):
+        self.assertEqual('index', transport.extract_project(
+            b'{"extra": {"project": "other", "a": ["{\\"project\\""]}, '
+            b'"message": "project", "project": "index"}'))
+
+    def test_brackets_in_strings_skipped(self):
+        self.assertEqual('index', transport.extract_project(
+            b'{"message": "a}\\\\", "b": "\\"]}", "project": "index"}'))
+
+    def test_deeply_nested(self):
+        nested = b'{"project": "other", "a": ' * 10000
+        self.assertEqual('index', transport.extract_project(
+            b'{"extra": ' + nested + b'1' + b'}' * 10000 +
+            b', "project": "index"}'))
+
+
+class ExtractLevelTest(TestCase):
+    def test_name(self):
+        self.assertEqual('error', transport.extract_level(
+            b'{"message": "a", "level": "ERROR"}'))
+
+    def test_number(self):
+        self.assertEqual('warning', transport.extract_level(b'{"level": 30}'))
+
+    def test_missing(self):
+        self.assertIsNone(transport.extract_level(b'{"message": "a"}'))
+
+    def test_nested_key_skipped(self):
+        self.assertIsNone(transport.extract_level(
+            b'{"tags": [{"level": "error"}]}'))
+
+
+@mock.patch('elasticsearch_raven.transport.datetime')
+@mock.patch('elasticsearch.Elasticsearch')
+class LogTransportPassthroughTest(TestCase):
+    raw_body = b'{"project": "index-{0:%Y.%m.%d}", "extra": {"foo": "bar"}}'
+
+    def send_message(self, ElasticSearch, datetime_mock, raw_body):
+        datetime_mock.datetime.now.return_value = datetime.datetime(2014, 1, 1)
+        ElasticSearch.return_value.bulk.return_value = {
+            'items': [{'index': {'status': 201}}]}
+        log_transport = transport.LogTransport('example.com')
+        log_transport.passthrough_projects = frozenset(['index-{0:%Y.%m.%d}'])
+        message = transport.SentryMessage({}, zlib.compress(raw_body))
+        log_transport.send_message(message)
+        return ElasticSearch.return_value
+
+    def test_bulk(self, ElasticSearch, datetime_mock):
+        connection = self.send_message(ElasticSearch, datetime_mock,
+                                       self.raw_body)
+        (), kwargs = connection.bulk.call_args
+        action, document, end = kwargs['body'].split('\n')
+        self.assertEqual({'index': {
+            '_index': 'index-2014.01.01', '_type': 'raven-log',
+            '_id': transport.hash_raw(self.raw_body)}}, json.loads(action))
+        self.assertEqual(self.raw_body.decode('utf-8'), document)
+        self.assertEqual([], connection.index.mock_calls)
+
+    def test_other_project(self, ElasticSearch, datetime_mock):
+        raw_body = b'{"project": "other", "extra": {"foo": "bar"}}'
+        connection = self.send_message(ElasticSearch, datetime_mock, raw_body)
+        self.assertEqual([], connection.bulk.mock_calls)
+        self.assertEqual({'project': 'other', 'extra': {'foo<string>': 'bar'}},
+                         connection.index.call_args[1]['body'])
+
+    def test_newlines(self, ElasticSearch, datetime_mock):
+        raw_body = b'{"project": "index-{0:%Y.%m.%d}",\n "extra": {}}'
+        connection = self.send_message(ElasticSearch, datetime_mock, raw_body)
+        self.assertEqual([], connection.bulk.mock_calls)
+        self.assertEqual(1, len(connection.index.mock_calls))
+
+    def test_bulk_error(self, ElasticSearch, datetime_mock):
+        ElasticSearch.return_value.bulk.return_value = {
+            'items': [{'index': {'status': 400, 'error': 'test'}}]}
+        log_transport = transport.LogTransport('example.com')
+        self.assertRaises(elasticsearch.exceptions.TransportError,
+                          log_transport.send_raw, self.raw_body, 'index', 'id')
+
+
+@mock.patch('elasticsearch_raven.transport.datetime')
+@mock.patch('elasticsearch.Elasticsearch')
+class LogTransportSendMessagesTest(TestCase):
+    def test_bulk(self, ElasticSearch, datetime_mock):
+        datetime_mock.datetime.now.return_value = datetime.datetime(2014, 1, 1)
+        connection = ElasticSearch.return_value
+        connection.bulk.return_value = {'items': [
+            {'index': {'status': 201}},
+            {'index': {'status': 429, 'error': 'rejected'}}]}
+        log_transport = transport.LogTransport('example.com')
+        messages = [transport.SentryMessage({}, zlib.compress(
+            json.dumps({'project': 'index-{0:%Y}', 'i': i}).encode()))
+            for i in range(2)]
+        first, rejected = log_transport.send_messages(messages)
+        self.assertIsNone(first)
+        self.assertEqual(429, rejected.status_code)
+        (), kwargs = connection.bulk.call_args
+        lines = [json.loads(line) for line in kwargs['body'].splitlines()]
+        self.assertEqual('index-2014', lines[0]['index']['_index'])
+        self.assertEqual([{'project': 'index-{0:%Y}', 'i': 0},
+                          {'project': 'index-{0:%Y}', 'i': 1}],
+                         lines[1::2])
+
+
+@mock.patch('elasticsearch_raven.transport.time')
+@mock.patch('elasticsearch.Elasticsearch')
+class DocumentCacheTest(TestCase):
+    def setUp(self):
+        self.body = zlib.compress(b'{"project": "index", "extra": {"a": 1}}')
+
+    def create_transport(self):
+        log_transport = transport.LogTransport('example.com')
+        log_transport.document_cache = cache.LruCache(1024)
+        return log_transport
+
+    def test_repeat_is_not_decoded(self, ElasticSearch, time):
+        log_transport = self.create_transport()
+        first = log_transport.prepare(transport.SentryMessage({}, self.body))
+        with mock.patch('elasticsearch_raven.transport.decompress') as d:
+            second = log_transport.prepare(
+                transport.SentryMessage({}, self.body))
+        self.assertEqual([], d.mock_calls)
+        self.assertEqual(first[:2], second[:2])
+        self.assertEqual(json.dumps(first[2]).encode(), second[2])
+        self.assertEqual(1, log_transport.stats['document_cache_hits'])
+        self.assertEqual(1, log_transport.stats['document_cache_misses'])
+        self.assertEqual(
+            sys.getsizeof(second[2]) + transport.CACHE_ENTRY_OVERHEAD,
+            log_transport.stats['document_cache_bytes'])
+
+    def test_lag_field_not_cached(self, ElasticSearch, time):
+        time.time.return_value = 100.0
+        log_transport = self.create_transport()
+        log_transport.lag_field = 'ingest_lag'
+        log_transport.prepare(transport.SentryMessage({}, self.body,
+                                                      received=99.0))
+        _, message_id, document = log_transport.prepare(
+            transport.SentryMessage({}, self.body, received=97.5))
+        self.assertEqual(2.5, document['ingest_lag'])
+        self.assertEqual(transport.hash_dict(
+            {'project': 'index', 'extra': {'a<int>': 1}}), message_id)
+
+    def test_passthrough(self, ElasticSearch, time):
+        log_transport = self.create_transport()
+        log_transport.passthrough_projects = frozenset(['index'])
+        raw_body = zlib.decompress(self.body)
+        for _ in range(2):
+            self.assertEqual(
+                ('index', transport.hash_raw(raw_body), raw_body),
+                log_transport.prepare(transport.SentryMessage({}, self.body)))
+        self.assertEqual(1, log_transport.stats['document_cache_hits'])
+
+
 class LoggerLevelToErrorTest(TestCase):
     def test_level(self):
         logger = logging.getLogger('test')
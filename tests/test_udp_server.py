@@ -6,7 +6,9 @@ from unittest import mock
 
 import elasticsearch
 
+from elasticsearch_raven import controller
 from elasticsearch_raven import queue_sender
+from elasticsearch_raven import queues
 from elasticsearch_raven.transport import SentryMessage
 from elasticsearch_raven import udp_handler
 from elasticsearch_raven import udp_server
@@ -21,7 +23,7 @@ class RunServerTest(TestCase):
     @mock.patch('elasticsearch_raven.udp_server.get_socket')
     def test_args(self, get_socket, Server, sys, python_queue, queues,
                   Transport):
-        queues.ThreadingQueue.return_value = 'pending_logs'
+        queues.get_configured_queue.return_value = 'pending_logs'
         Transport.return_value = 'transport'
         get_socket.return_value = 'test_socket'
         sys.argv = ['test', '192.168.1.1', '8888', '--debug']
@@ -83,7 +85,9 @@ class _RunServerTest(TestCase):
             mock.call(self.sock, self.pending_logs,
                       server.thread_exception_handler, debug=False),
             mock.call().as_thread(),
-            mock.call().as_thread().start()], Handler.mock_calls)
+            mock.call().as_thread().start(),
+            mock.call().as_thread().join(1.0)], Handler.mock_calls)
+        self.assertTrue(Handler.return_value.should_finish)
 
     @mock.patch('elasticsearch_raven.udp_handler.Handler')
     @mock.patch('elasticsearch_raven.queue_sender.Sender')
@@ -97,6 +101,94 @@ class _RunServerTest(TestCase):
                           mock.call().as_thread(),
                           mock.call().as_thread().start()], Sender.mock_calls)
 
+    @mock.patch.dict('elasticsearch_raven.udp_server.configuration',
+                     {'stats_interval': 5.0})
+    @mock.patch('elasticsearch_raven.udp_handler.start_stats_reporter')
+    @mock.patch('elasticsearch_raven.udp_handler.Handler')
+    @mock.patch('elasticsearch_raven.queue_sender.Sender')
+    def test_stats_reporter_start(self, Sender, Handler, start_stats_reporter):
+        self.exception_queue.get.side_effect = KeyboardInterrupt
+        server = udp_server.Server(self.sock, self.pending_logs,
+                                   self.transport)
+        server.exception_queue = self.exception_queue
+        server.run()
+        self.assertEqual(
+            [mock.call(self.sock, [Handler.return_value, Sender.return_value,
+                                   self.transport])],
+            start_stats_reporter.mock_calls)
+
+
+class GetSocketTest(TestCase):
+    @mock.patch.dict('elasticsearch_raven.udp_server.configuration',
+                     {'udp_receive_buffer': 1048576})
+    @mock.patch('elasticsearch_raven.sockets.set_receive_buffer')
+    @mock.patch('socket.socket')
+    def test_receive_buffer(self, sock, set_receive_buffer):
+        set_receive_buffer.return_value = 2097152
+        udp_server.get_socket('127.0.0.1', 9001)
+        self.assertEqual([mock.call(sock.return_value, 1048576)],
+                         set_receive_buffer.mock_calls)
+
+
+@mock.patch('elasticsearch_raven.udp_handler.datetime')
+class AccessLogTest(TestCase):
+    def setUp(self):
+        self.stream = mock.Mock()
+
+    def written(self):
+        return ''.join(call[1][0] for call in self.stream.write.mock_calls)
+
+    def test_lines(self, datetime_mock):
+        datetime_mock.datetime.fromtimestamp.return_value = (
+            datetime.datetime(2014, 1, 1))
+        access_log = udp_handler.AccessLog(self.stream)
+        access_log.record(('192.168.1.1', 8888))
+        access_log.record(('192.168.1.2', 8888))
+        self.assertEqual([], self.stream.mock_calls)
+        access_log.flush()
+        self.assertEqual('192.168.1.1:8888 [2014-01-01 00:00:00]\n'
+                         '192.168.1.2:8888 [2014-01-01 00:00:00]\n',
+                         self.written())
+
+    @mock.patch('elasticsearch_raven.udp_handler.random')
+    def test_sampling(self, random_mock, datetime_mock):
+        datetime_mock.datetime.fromtimestamp.return_value = (
+            datetime.datetime(2014, 1, 1))
+        random_mock.random.side_effect = [0.05, 0.5]
+        access_log = udp_handler.AccessLog(self.stream, sample_rate=0.1)
+        access_log.record(('192.168.1.1', 8888))
+        access_log.record(('192.168.1.2', 8888))
+        access_log.flush()
+        self.assertEqual('192.168.1.1:8888 [2014-01-01 00:00:00]\n',
+                         self.written())
+
+    def test_aggregate(self, datetime_mock):
+        datetime_mock.datetime.fromtimestamp.return_value = (
+            datetime.datetime(2014, 1, 1))
+        access_log = udp_handler.AccessLog(self.stream,
+                                           aggregate_interval=10)
+        for _ in range(3):
+            access_log.record(('192.168.1.1', 8888))
+        access_log.record(('192.168.1.2', 8888))
+        access_log.flush()
+        self.assertEqual(
+            '192.168.1.1:8888 [2014-01-01 00:00:00] 3 packets\n'
+            '192.168.1.2:8888 [2014-01-01 00:00:00] 1 packets\n',
+            self.written())
+
+    def test_bounded(self, datetime_mock):
+        datetime_mock.datetime.fromtimestamp.return_value = (
+            datetime.datetime(2014, 1, 1))
+        datetime_mock.datetime.now.return_value = datetime.datetime(2014, 1, 2)
+        access_log = udp_handler.AccessLog(self.stream, max_lines=2)
+        for port in range(5):
+            access_log.record(('192.168.1.1', port))
+        access_log.flush()
+        self.assertEqual('192.168.1.1:0 [2014-01-01 00:00:00]\n'
+                         '192.168.1.1:1 [2014-01-01 00:00:00]\n'
+                         '[2014-01-02 00:00:00] 3 access log entries '
+                         'dropped\n', self.written())
+
 
 class GetHandlerTest(TestCase):
     def setUp(self):
@@ -107,16 +199,17 @@ class GetHandlerTest(TestCase):
         self.sock.recvfrom.side_effect = [({}, ('192.168.1.1', 8888)),
                                           self.exception]
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
     @mock.patch('elasticsearch_raven.udp_handler.datetime')
     @mock.patch('elasticsearch_raven.udp_server.transport.SentryMessage')
     @mock.patch('sys.stdout')
     def test_debug(self, stdout, SentryMessage, datetime_mock):
-        datetime_mock.datetime.now.return_value = datetime.datetime(2014, 1, 1)
+        datetime_mock.datetime.fromtimestamp.return_value = (
+            datetime.datetime(2014, 1, 1))
         self.run_handler_function(debug=True)
 
         self.assertEqual(
-            [mock.call.write('192.168.1.1:8888 [2014-01-01 00:00:00]\n')],
+            [mock.call.write('192.168.1.1:8888 [2014-01-01 00:00:00]\n'),
+             mock.call.flush()],
             stdout.mock_calls)
 
     def run_handler_function(self, **kwargs):
@@ -128,7 +221,6 @@ class GetHandlerTest(TestCase):
         else:
             thread._Thread__target()
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
     @mock.patch('elasticsearch_raven.udp_server.transport.SentryMessage')
     def test_exception(self, SentryMessage):
         self.run_handler_function()
@@ -136,7 +228,6 @@ class GetHandlerTest(TestCase):
         self.assertEqual([mock.call.put(self.exception)],
                          self.exception_queue.mock_calls)
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
     @mock.patch('elasticsearch_raven.udp_server.transport.SentryMessage')
     def test_put_result_and_join_on_queue(self, SentryMessage):
         self.run_handler_function()
@@ -149,6 +240,20 @@ class GetHandlerTest(TestCase):
         self.assertIsInstance(result, threading.Thread)
         self.assertEqual(True, result.daemon)
 
+    @mock.patch('elasticsearch_raven.udp_server.transport.SentryMessage')
+    def test_should_finish(self, SentryMessage):
+        handler = udp_handler.Handler(self.sock, self.pending_logs,
+                                      self.exception_queue)
+
+        def recvfrom(size):
+            handler.should_finish = True
+            raise socket.timeout()
+        self.sock.recvfrom.side_effect = recvfrom
+        handler.handle()
+        self.assertEqual([mock.call.recvfrom(65535), mock.call.close()],
+                         self.sock.mock_calls)
+        self.assertEqual([], self.exception_queue.mock_calls)
+
     @mock.patch('elasticsearch_raven.udp_server.transport.SentryMessage')
     def test_close_socket(self, SentryMessage):
         self.sock.recvfrom.side_effect = Exception
@@ -164,19 +269,17 @@ class GetSenderTest(TestCase):
         self.exception_queue = mock.Mock()
         self.transport = mock.Mock()
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
     def test_exception(self):
-        self.pending_logs.get.return_value = mock.Mock()
+        self.pending_logs.get.return_value = SentryMessage({}, b'')
         exception = Exception('test')
         self.transport.send_message.side_effect = exception
         self.run_sender_function()
         self.assertEqual([mock.call.put(exception)],
                          self.exception_queue.mock_calls)
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
     @mock.patch('elasticsearch_raven.utils.retry_loop')
     def test_retry_connection(self, retry_loop):
-        self.pending_logs.get.side_effect = [mock.Mock(), Exception]
+        self.pending_logs.get.side_effect = [SentryMessage({}, b''), Exception]
         exception = elasticsearch.exceptions.ConnectionError('test')
         self.transport.send_message.side_effect = [exception]*3 + [None]
         retry = mock.Mock()
@@ -200,15 +303,33 @@ class GetSenderTest(TestCase):
         self.assertIsInstance(result, threading.Thread)
         self.assertEqual(True, result.daemon)
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
     def test_task_done(self):
-        self.pending_logs.get.return_value = mock.Mock()
+        self.pending_logs.get.return_value = SentryMessage({}, b'')
         self.pending_logs.task_done.side_effect = Exception('test')
         self.run_sender_function()
         self.assertEqual([mock.call.get(), mock.call.task_done()],
                          self.pending_logs.mock_calls)
 
-    @mock.patch('elasticsearch_raven.utils.signal', mock.Mock())
+    def test_stats(self):
+        self.pending_logs.get.side_effect = [SentryMessage({}, b''), Exception]
+        sender = queue_sender.Sender(self.transport, self.pending_logs,
+                                     self.exception_queue)
+        sender.send()
+        self.assertEqual({'sent': 1}, sender.stats)
+
+    def test_finish(self):
+        sender = queue_sender.Sender(self.transport, self.pending_logs,
+                                     self.exception_queue)
+        self.assertTrue(sender.finish(0))
+        sender.send()
+        self.assertEqual([], self.pending_logs.mock_calls)
+
+    def test_finish_waits_for_message(self):
+        sender = queue_sender.Sender(self.transport, self.pending_logs,
+                                     self.exception_queue)
+        sender.in_flight.acquire()
+        self.assertFalse(sender.finish(0.01))
+
     @mock.patch('elasticsearch.Elasticsearch')
     def test_log_transport_error(self, Elasticsearch):
         exception = elasticsearch.exceptions.TransportError(404, 'test')
@@ -228,3 +349,95 @@ class GetSenderTest(TestCase):
              doc_type='elasticsearch-raven-log',
              index='elasticsearch-raven-error')],
             Elasticsearch.mock_calls)
+
+
+class BatchSenderTest(TestCase):
+    def setUp(self):
+        self.pending_logs = queues.ThreadingQueue()
+        self.exception_queue = mock.Mock()
+        self.transport = mock.Mock()
+        self.transport.send_messages.side_effect = lambda batch: [
+            None] * len(batch)
+        patcher = mock.patch(
+            'elasticsearch_raven.queue_sender.controller.'
+            'get_configured_controller',
+            return_value=controller.AimdController(4, 10, 1.0, min_batch=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sender = queue_sender.Sender(self.transport, self.pending_logs,
+                                          self.exception_queue)
+
+    def send(self, count):
+        for i in range(count):
+            self.pending_logs.put(SentryMessage({}, str(i).encode()))
+        self.sender.as_thread().start()
+        self.pending_logs.join()
+        self.assertTrue(self.sender.finish(1.0))
+
+    def test_batches(self):
+        self.send(30)
+        sent = [message.body for (batch,), _ in
+                self.transport.send_messages.call_args_list
+                for message in batch]
+        self.assertEqual([str(i).encode() for i in range(30)], sorted(
+            sent, key=int))
+        self.assertEqual(30, self.sender.stats['sent'])
+        self.assertLess(len(self.transport.send_messages.call_args_list), 30)
+        self.assertEqual([], self.exception_queue.mock_calls)
+
+    @mock.patch('elasticsearch_raven.utils.time', mock.Mock())
+    def test_rejected(self):
+        rejection = elasticsearch.exceptions.TransportError(429, 'rejected')
+        self.transport.send_messages.side_effect = [
+            [None, rejection], [None]]
+        self.pending_logs.put(SentryMessage({}, b'first'))
+        self.send(1)
+        self.assertEqual([SentryMessage({}, b'0')],
+                         self.transport.send_messages.call_args_list[1][0][0])
+        stats = self.sender.stats
+        self.assertEqual({'sent': 2, 'rejected': 1, 'throttled': 1,
+                          'send_concurrency': 2, 'send_batch_size': 3,
+                          'queue_latency_le_0.01': 2},
+                         {key: stats[key] for key in [
+                             'sent', 'rejected', 'throttled',
+                             'send_concurrency', 'send_batch_size',
+                             'queue_latency_le_0.01']})
+
+    def test_failed_batch_not_acknowledged(self):
+        self.pending_logs = mock.Mock()
+        self.pending_logs.get.side_effect = [
+            SentryMessage({}, str(i).encode()) for i in range(3)] + [
+            queues.Empty()] * 100
+        self.transport.send_messages.side_effect = Exception('failed')
+        sender = queue_sender.Sender(self.transport, self.pending_logs,
+                                     self.exception_queue)
+        sender.send()
+        self.assertTrue(sender.finish(1.0))
+        self.assertTrue(self.exception_queue.mock_calls)
+        self.pending_logs.task_done.assert_not_called()
+
+
+class LatencyStatsTest(TestCase):
+    @mock.patch('elasticsearch_raven.queue_sender.time')
+    def test_latency(self, time):
+        time.time.return_value = 1000.0
+        pending_logs = mock.Mock()
+        pending_logs.get.side_effect = [
+            SentryMessage({}, b'', received=900.0, enqueued=999.95),
+            Exception]
+        sender = queue_sender.Sender(mock.Mock(), pending_logs, mock.Mock())
+        sender.send()
+        self.assertEqual(1, sender.stats['queue_latency_le_0.1'])
+        self.assertEqual(1, sender.stats['ingest_latency_le_600'])
+        self.assertAlmostEqual(100.0, sender.stats['ingest_latency_sum'])
+
+
+class RingServerWaitTest(TestCase):
+    def test_kill_stuck_worker(self):
+        server = udp_server.RingServer(mock.Mock(), mock.Mock())
+        server.should_finish = server.killed = True
+        receiver = mock.Mock(exitcode=0)
+        worker = mock.Mock(exitcode=None)
+        server._wait(receiver, [worker])
+        self.assertEqual([mock.call.kill(), mock.call.join()],
+                         worker.mock_calls)
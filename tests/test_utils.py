@@ -1,3 +1,5 @@
+import io
+import json
 import time
 from unittest import TestCase
 from unittest import mock
@@ -24,3 +26,13 @@ class RetryLoopTest(TestCase):
             retry(Exception('test'))
         self.assertEqual([mock.call(1), mock.call(2), mock.call(4), mock.call(4)],
                          sleep.mock_calls)
+
+
+class StatsReporterTest(TestCase):
+    def test_report(self):
+        stats_file = io.StringIO()
+        sources = [mock.Mock(stats={'sent': 1}),
+                   mock.Mock(stats={'sent': 2, 'failed': 1})]
+        utils.StatsReporter(stats_file, sources).report()
+        self.assertEqual({'sent': 3, 'failed': 1},
+                         json.loads(stats_file.getvalue()))